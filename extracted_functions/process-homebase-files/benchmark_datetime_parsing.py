@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the date/time parsing in transform_homebase_csv.
+Compares the old row-wise df.apply(parse_datetime) passes against
+parse_datetime_columns on a synthetic timesheet.
+
+Usage: python benchmark_datetime_parsing.py [rows]
+"""
+
+import sys
+import time
+import logging
+import numpy as np
+import pandas as pd
+
+# Import functions from main.py
+from main import parse_datetime, parse_datetime_columns
+
+def create_synthetic_timesheet(rows):
+    """Create a DataFrame shaped like the parsed Homebase columns."""
+    rng = np.random.default_rng(42)
+    days = pd.date_range('2024-01-01', periods=365, freq='D')
+    day_idx = rng.integers(0, len(days), rows)
+    dates = pd.Series(days[day_idx].strftime('%B %d %Y').str.replace(' 0', ' ', regex=False))
+
+    def random_times(start_hour, end_hour):
+        hours = rng.integers(start_hour, end_hour, rows)
+        minutes = rng.integers(0, 60, rows)
+        suffix = np.where(hours >= 12, 'pm', 'am')
+        hours12 = np.where(hours % 12 == 0, 12, hours % 12)
+        return pd.Series([f"{h}:{m:02d}{s}" for h, m, s in zip(hours12, minutes, suffix)])
+
+    df = pd.DataFrame({
+        'clock_in_date': dates,
+        'clock_in_time': random_times(6, 12),
+        'clock_out_date': dates,
+        'clock_out_time': random_times(13, 22),
+        'break_start': random_times(11, 13),
+        'break_end': random_times(13, 14),
+    })
+
+    # About a third of shifts have no break, like the real exports
+    no_break = rng.random(rows) < 0.33
+    df.loc[no_break, ['break_start', 'break_end']] = np.nan
+    return df
+
+def parse_row_wise(df):
+    """The original implementation: four row-wise apply passes."""
+    return [
+        df.apply(lambda row: parse_datetime(row['clock_in_date'], row['clock_in_time']), axis=1),
+        df.apply(lambda row: parse_datetime(row['clock_out_date'], row['clock_out_time']), axis=1),
+        df.apply(lambda row: parse_datetime(row['clock_in_date'], row['break_start']), axis=1),
+        df.apply(lambda row: parse_datetime(row['clock_in_date'], row['break_end']), axis=1),
+    ]
+
+def parse_vectorized(df):
+    """The columnar implementation."""
+    return [
+        parse_datetime_columns(df['clock_in_date'], df['clock_in_time']),
+        parse_datetime_columns(df['clock_out_date'], df['clock_out_time']),
+        parse_datetime_columns(df['clock_in_date'], df['break_start']),
+        parse_datetime_columns(df['clock_in_date'], df['break_end']),
+    ]
+
+def time_it(func, df):
+    start = time.perf_counter()
+    result = func(df)
+    return result, time.perf_counter() - start
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    logging.getLogger('process-homebase-files').setLevel(logging.CRITICAL)
+
+    print(f"=== Benchmarking date/time parsing on {rows} rows ===")
+    df = create_synthetic_timesheet(rows)
+
+    old_result, old_seconds = time_it(parse_row_wise, df)
+    print(f"Row-wise apply:  {old_seconds:.2f}s")
+
+    new_result, new_seconds = time_it(parse_vectorized, df)
+    print(f"Vectorized:      {new_seconds:.2f}s")
+    print(f"Speedup:         {old_seconds / new_seconds:.1f}x")
+
+    # Both implementations must agree
+    for old_col, new_col in zip(old_result, new_result):
+        assert pd.to_datetime(old_col).equals(new_col), "Results differ between implementations"
+    print("Results match")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the multi-file pipeline in process_homebase_files.
+Runs run_homebase_pipeline against stubbed Drive and BigQuery clients that
+sleep to simulate network latency, once serially and once with a worker pool.
+
+Usage: python benchmark_pipeline.py [files] [max_workers]
+"""
+
+import sys
+import time
+import logging
+import threading
+import httplib2
+from datetime import date, timedelta
+
+# Import functions from main.py
+from main import run_homebase_pipeline
+
+# Simulated latencies in seconds
+DOWNLOAD_LATENCY = 0.3
+DRIVE_METADATA_LATENCY = 0.1
+LOAD_JOB_LATENCY = 1.0
+QUERY_LATENCY = 0.2
+
+HEADER = ("Name,Clock in date,Clock in time,Clock out date,Clock out time,Break start,Break end,"
+          "Break length,Break type,Payroll ID,Role,Wage rate,Scheduled hours,Actual vs. scheduled,"
+          "Total paid hours,Regular hours,Unpaid breaks,OT hours,Estimated wages,Cash tips,Credit tips,"
+          "No show reason,Employee note,Manager note\n")
+SHIFT = ("John Doe,May 5 2025,9:00am,May 5 2025,5:00pm,12:00pm,1:00pm,1:00,Unpaid,12345,Technician,"
+         "$15.00,8.00,0.00,7.00,7.00,1.00,0.00,$105.00,$10.00,$15.00,,,\n")
+
+def create_export(shifts=300):
+    """Create the bytes of a Homebase timesheet export."""
+    content = "Timesheets\nRestore Round Rock,May 5 2025 To May 18 2025\n\"\"\n" + HEADER + SHIFT * shifts
+    return content.encode('utf-8')
+
+class StubRequest:
+    """Stand-in for a googleapiclient HttpRequest."""
+
+    def __init__(self, result=None, latency=0.0, uri='', http=None):
+        self.result = result
+        self.latency = latency
+        self.uri = uri
+        self.headers = {}
+        self.http = http
+
+    def execute(self):
+        time.sleep(self.latency)
+        return self.result
+
+class StubMediaHttp:
+    """Serves file contents to MediaIoBaseDownload after a delay."""
+
+    def __init__(self, content):
+        self.content = content
+
+    def request(self, uri, method='GET', headers=None, **kwargs):
+        time.sleep(DOWNLOAD_LATENCY)
+        return httplib2.Response({'status': 200, 'content-length': str(len(self.content))}), self.content
+
+class StubFiles:
+    def __init__(self, content):
+        self.content = content
+
+    def get_media(self, fileId):
+        return StubRequest(uri=f"https://drive.example/{fileId}", http=StubMediaHttp(self.content))
+
+    def get(self, fileId, fields=None):
+        return StubRequest({'parents': ['source']}, DRIVE_METADATA_LATENCY)
+
+    def update(self, **kwargs):
+        return StubRequest({'id': kwargs.get('fileId')}, DRIVE_METADATA_LATENCY)
+
+    def copy(self, **kwargs):
+        return StubRequest({}, DRIVE_METADATA_LATENCY)
+
+class StubBatch:
+    """Runs batched requests in one simulated round trip."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        time.sleep(DRIVE_METADATA_LATENCY)
+        for request_id, request in self.requests:
+            self.callback(request_id, request.result, None)
+
+class StubDriveService:
+    def __init__(self, content):
+        self.content = content
+
+    def files(self):
+        return StubFiles(self.content)
+
+    def new_batch_http_request(self, callback=None):
+        return StubBatch(callback)
+
+class StubJob:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def result(self):
+        time.sleep(self.latency)
+
+class StubBigQueryClient:
+    """Records calls and sleeps like the BigQuery API would."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loads = 0
+        self.queries = 0
+
+    def get_table(self, table_id):
+        time.sleep(DRIVE_METADATA_LATENCY)
+        raise Exception(f"404 Not found: Table {table_id}")
+
+    def delete_table(self, table_id):
+        time.sleep(DRIVE_METADATA_LATENCY)
+
+    def load_table_from_dataframe(self, df, table_id, job_config=None):
+        with self.lock:
+            self.loads += 1
+        return StubJob(LOAD_JOB_LATENCY)
+
+    def query(self, sql, job_config=None):
+        with self.lock:
+            self.queries += 1
+        return StubJob(QUERY_LATENCY)
+
+def create_files(count):
+    """Drive listing entries for a backlog of two-week payroll periods."""
+    files = []
+    for i in range(count):
+        start = date(2025, 5, 5) - timedelta(weeks=2 * i)
+        end = start + timedelta(days=13)
+        files.append({'id': f"file-{i}", 'name': f"Restore Round Rock_{start}_{end}_timesheets.csv",
+                      'parents': ['source']})
+    return files
+
+def run(files, max_workers):
+    content = create_export()
+    bq_client = StubBigQueryClient()
+    start = time.perf_counter()
+    processed_files, validation_errors, _ = run_homebase_pipeline(
+        [files], lambda: StubDriveService(content), bq_client, 'loaded', max_workers=max_workers)
+    elapsed = time.perf_counter() - start
+
+    assert len(processed_files) == len(files), validation_errors
+    return elapsed, bq_client
+
+def main():
+    file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    logging.getLogger('process-homebase-files').setLevel(logging.WARNING)
+
+    print(f"=== Benchmarking pipeline on {file_count} files ===")
+    files = create_files(file_count)
+
+    serial_seconds, serial_client = run(files, 1)
+    print(f"1 worker:    {serial_seconds:.2f}s ({serial_client.loads} loads, {serial_client.queries} queries)")
+
+    pool_seconds, pool_client = run(files, max_workers)
+    print(f"{max_workers} workers:   {pool_seconds:.2f}s ({pool_client.loads} loads, {pool_client.queries} queries)")
+    print(f"Speedup:     {serial_seconds / pool_seconds:.1f}x")
+
+if __name__ == "__main__":
+    main()
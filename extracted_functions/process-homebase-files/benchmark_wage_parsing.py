@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the money column parsing in transform_homebase_csv.
+Compares the old per-cell Series.apply(parse_wage) calls against
+parse_money_columns on a synthetic timesheet.
+
+Usage: python benchmark_wage_parsing.py [rows]
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# Import functions from main.py
+from main import MONEY_COLUMNS, parse_wage, parse_money_columns
+
+def create_synthetic_money_columns(rows):
+    """Create money columns formatted like the Homebase export."""
+    rng = np.random.default_rng(42)
+    # Wage rates come from a small pay scale and shifts are in quarter hours
+    wage_rate = rng.choice(np.arange(12.0, 40.0, 0.5), rows)
+    hours = rng.integers(8, 48, rows) * 0.25
+    df = pd.DataFrame({
+        'wage_rate': wage_rate,
+        'estimated_wages': wage_rate * hours,
+        'cash_tips': rng.integers(0, 80, rows).astype(float),
+        'credit_tips': rng.integers(0, 15000, rows) / 100,
+    })
+    df = df.apply(lambda col: col.map(lambda value: f"${value:,.2f}"))
+
+    # Tips are blank on most shifts
+    for col in ['cash_tips', 'credit_tips']:
+        df.loc[rng.random(rows) < 0.6, col] = np.nan
+    return df
+
+def parse_per_cell(df):
+    """The original implementation: one apply per column."""
+    return pd.DataFrame({col: df[col].apply(parse_wage) for col in MONEY_COLUMNS})
+
+def parse_vectorized(df):
+    """The columnar implementation: all columns in one pass."""
+    return parse_money_columns(df, MONEY_COLUMNS)
+
+def best_of(func, df, repeats=3):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(df)
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    print(f"=== Benchmarking money parsing on {rows} rows x {len(MONEY_COLUMNS)} columns ===")
+    df = create_synthetic_money_columns(rows)
+
+    old_result, old_seconds = best_of(parse_per_cell, df)
+    print(f"Per-cell parse_wage:  {old_seconds * 1000:.1f}ms")
+
+    new_result, new_seconds = best_of(parse_vectorized, df)
+    print(f"parse_money_columns:  {new_seconds * 1000:.1f}ms")
+    print(f"Speedup:              {old_seconds / new_seconds:.1f}x")
+
+    # Both implementations must agree
+    pd.testing.assert_frame_equal(old_result.astype(float), new_result)
+    print("Results match")
+
+if __name__ == "__main__":
+    main()
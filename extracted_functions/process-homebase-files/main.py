@@ -1,8 +1,9 @@
+import csv
+import io
 import os
-import tempfile
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
-from io import StringIO
+from datetime import datetime, timedelta, timezone
 from google.cloud import bigquery
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
@@ -10,8 +11,13 @@ from googleapiclient.http import MediaIoBaseDownload
 from googleapiclient import errors as googleapiclient_errors
 import functions_framework
 import re
+import sqlite3
+import threading
+import time
+import uuid
 import google.auth
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging
 logging.basicConfig(
@@ -25,6 +31,120 @@ PROJECT_ID = "tys-bi"
 DATASET_ID = "homebase"
 SOURCE_FOLDER_ID = "1PDBU0dqzar49DEZXCAjeMeqEixVoaOnv"
 
+TIMESHEETS_TABLE_ID = f"{PROJECT_ID}.{DATASET_ID}.timesheets"
+TIMESHEETS_VIEW_ID = f"{PROJECT_ID}.{DATASET_ID}.timesheets_v"
+MATERIALIZED_VIEW_TABLE_ID = f"{PROJECT_ID}.{DATASET_ID}.timesheets_mv"
+# Consolidated loads go through a staging table that is dropped afterwards
+STAGING_TABLE_EXPIRATION = timedelta(days=1)
+
+INGESTION_LEDGER_TABLE_ID = f"{PROJECT_ID}.{DATASET_ID}.ingestion_ledger"
+
+# Set to a SQLite file path to keep the ingestion ledger locally instead of in BigQuery
+LEDGER_PATH = os.environ.get('HOMEBASE_LEDGER_PATH')
+
+# Where files are loaded: 'per_period' tables (timesheet_YYYYMMDD_YYYYMMDD_) or the
+# 'consolidated' timesheets table partitioned by payroll period
+LOAD_MODE = os.environ.get('HOMEBASE_LOAD_MODE', 'per_period')
+
+# How timesheets_mv is refreshed after a batch: 'full' rebuild or 'incremental' by payroll period
+MV_REFRESH_MODE = os.environ.get('HOMEBASE_MV_REFRESH_MODE', 'full')
+
+# Number of files downloaded, transformed and loaded at the same time
+MAX_WORKERS = int(os.environ.get('HOMEBASE_MAX_WORKERS', '4'))
+
+# Most workers a request may ask for; each one builds its own Drive service
+MAX_WORKERS_LIMIT = 16
+
+LOAD_MODES = ('per_period', 'consolidated')
+MV_REFRESH_MODES = ('full', 'incremental')
+
+# Homebase exports dates as "March 10 2025" and times as "9:44am"
+DATE_FORMAT = "%B %d %Y"
+TIME_FORMAT = "%I:%M%p"
+# strptime places a bare time on this date
+TIME_FORMAT_BASE = pd.Timestamp(1900, 1, 1)
+
+# Largest page size files().list accepts
+DRIVE_LIST_PAGE_SIZE = 1000
+
+# Drive batch requests accept at most 100 calls
+DRIVE_BATCH_SIZE = 100
+
+# Drive downloads are buffered in memory; fetch each export in as few requests as possible
+DOWNLOAD_CHUNK_SIZE = 10 * 1024 * 1024
+
+# First cells of the column header row in a Homebase export
+HOMEBASE_HEADER_PREFIX = ['Name', 'Clock in date', 'Clock in time']
+# Shift rows buffered before being turned into a DataFrame chunk; a chunk's
+# text and parse are the only memory held on top of the result
+CSV_CHUNK_SIZE = 5000
+
+# Currency columns that get a parsed *_numeric copy
+MONEY_COLUMNS = ['wage_rate', 'estimated_wages', 'cash_tips', 'credit_tips']
+
+# BigQuery schema of the timesheet tables
+TIMESHEET_SCHEMA = [
+    bigquery.SchemaField("location", "STRING"),
+    bigquery.SchemaField("payroll_period_start", "STRING"),
+    bigquery.SchemaField("payroll_period_end", "STRING"),
+    bigquery.SchemaField("name", "STRING"),
+    bigquery.SchemaField("clock_in_datetime", "TIMESTAMP"),
+    bigquery.SchemaField("clock_out_datetime", "TIMESTAMP"),
+    bigquery.SchemaField("break_start_datetime", "TIMESTAMP"),
+    bigquery.SchemaField("break_end_datetime", "TIMESTAMP"),
+    bigquery.SchemaField("break_length", "STRING"),
+    bigquery.SchemaField("break_type", "STRING"),
+    bigquery.SchemaField("payroll_id", "STRING"),
+    bigquery.SchemaField("role", "STRING"),
+    bigquery.SchemaField("wage_rate_numeric", "FLOAT"),
+    bigquery.SchemaField("scheduled_hours", "FLOAT"),
+    bigquery.SchemaField("actual_vs_scheduled", "FLOAT"),
+    bigquery.SchemaField("total_paid_hours", "FLOAT"),
+    bigquery.SchemaField("regular_hours", "FLOAT"),
+    bigquery.SchemaField("unpaid_breaks", "FLOAT"),
+    bigquery.SchemaField("ot_hours", "FLOAT"),
+    bigquery.SchemaField("estimated_wages_numeric", "FLOAT"),
+    bigquery.SchemaField("cash_tips_numeric", "FLOAT"),
+    bigquery.SchemaField("credit_tips_numeric", "FLOAT"),
+    bigquery.SchemaField("no_show_reason", "STRING"),
+    bigquery.SchemaField("employee_note", "STRING"),
+    bigquery.SchemaField("manager_note", "STRING"),
+    bigquery.SchemaField("processed_at", "TIMESTAMP"),
+    bigquery.SchemaField("clock_in_date_raw", "STRING"),
+    bigquery.SchemaField("clock_in_time_raw", "STRING"),
+    bigquery.SchemaField("clock_out_date_raw", "STRING"),
+    bigquery.SchemaField("clock_out_time_raw", "STRING"),
+    bigquery.SchemaField("break_start_raw", "STRING"),
+    bigquery.SchemaField("break_end_raw", "STRING")
+]
+
+# The consolidated table adds a DATE column to partition on
+CONSOLIDATED_TIMESHEET_SCHEMA = TIMESHEET_SCHEMA + [
+    bigquery.SchemaField("payroll_period_start_date", "DATE")
+]
+
+# Files loaded by previous runs, keyed by file name and content fingerprint
+INGESTION_LEDGER_SCHEMA = [
+    bigquery.SchemaField("file_id", "STRING"),
+    bigquery.SchemaField("file_name", "STRING"),
+    bigquery.SchemaField("fingerprint", "STRING"),
+    bigquery.SchemaField("md5_checksum", "STRING"),
+    bigquery.SchemaField("modified_time", "STRING"),
+    bigquery.SchemaField("row_count", "INTEGER"),
+    bigquery.SchemaField("download_seconds", "FLOAT"),
+    bigquery.SchemaField("transform_seconds", "FLOAT"),
+    bigquery.SchemaField("load_seconds", "FLOAT"),
+    bigquery.SchemaField("loaded_at", "TIMESTAMP")
+]
+
+# ID of the 'loaded' Drive folder, cached across warm invocations
+_loaded_folder_id = None
+
+# Worker thread state for run_homebase_pipeline
+_worker_state = threading.local()
+_table_locks = {}
+_table_locks_guard = threading.Lock()
+
 def parse_datetime(date_str, time_str):
     """Parse date and time strings into a datetime object."""
     if not date_str or not time_str or pd.isna(date_str) or pd.isna(time_str):
@@ -36,10 +156,10 @@ def parse_datetime(date_str, time_str):
 
     try:
         # Parse the date in the format "Month Day Year" (e.g., "March 10 2025")
-        date_obj = datetime.strptime(date_str, "%B %d %Y")
+        date_obj = datetime.strptime(date_str, DATE_FORMAT)
 
         # Parse the time in the format "h:mmam/pm" (e.g., "9:44am")
-        time_obj = datetime.strptime(time_str, "%I:%M%p")
+        time_obj = datetime.strptime(time_str, TIME_FORMAT)
 
         # Combine date and time
         return datetime.combine(date_obj.date(), time_obj.time())
@@ -47,6 +167,36 @@ def parse_datetime(date_str, time_str):
         logger.error(f"Error parsing date/time: {date_str} {time_str} - {e}")
         return None
 
+def _clean_text_column(series):
+    """Strip a column of cell values, keeping blank/missing cells as NaN."""
+    if series.dtype != object:
+        # Columns that are entirely empty (or all numbers) are not read as text
+        series = series.astype(str).where(series.notna())
+    return series.str.strip().mask(series == '')
+
+def parse_datetime_columns(date_series, time_series):
+    """Vectorized equivalent of parse_datetime for whole date and time columns.
+
+    The date and time columns are each converted in one pass with an explicit
+    format and then combined. An export only has a few hundred distinct dates
+    and times, so pandas parses each distinct value once instead of calling
+    strptime twice per row. Blank cells become NaT; malformed cells also become
+    NaT and are logged row by row, like parse_datetime does.
+    """
+    date_str = _clean_text_column(date_series)
+    time_str = _clean_text_column(time_series)
+
+    dates = pd.to_datetime(date_str, format=DATE_FORMAT, errors='coerce', cache=True)
+    times = pd.to_datetime(time_str, format=TIME_FORMAT, errors='coerce', cache=True)
+    parsed = dates + (times - TIME_FORMAT_BASE)
+
+    # Report only the rows that had values but could not be parsed
+    failed = parsed.isna() & date_str.notna() & time_str.notna()
+    for row_index in parsed.index[failed]:
+        logger.error(f"Error parsing date/time: {date_str[row_index]} {time_str[row_index]} (row {row_index})")
+
+    return parsed
+
 def parse_wage(wage_str):
     """Parse wage string into a float."""
     if not wage_str or pd.isna(wage_str):
@@ -60,49 +210,173 @@ def parse_wage(wage_str):
     except ValueError:
         return None
 
-def transform_homebase_csv(input_file_path):
-    """Transform Homebase CSV into BigQuery-compatible format."""
-    # Read the CSV file
-    with open(input_file_path, 'r') as f:
-        lines = f.readlines()
+def parse_money_columns(df, columns):
+    """Vectorized equivalent of parse_wage for one or more money columns.
 
-    # Find the actual data rows
-    data_rows = []
-    header_row = None  # Initialize header_row variable
+    All columns are normalized together in one pass. Each distinct cell value
+    is cleaned once (wage rates and tips repeat heavily across shifts): '$',
+    ',' and whitespace are stripped with bulk string ops, parenthesized
+    amounts like '(12.50)' become negative, and the result is converted with a
+    single pd.to_numeric call. Blank or unparseable cells become NaN.
 
-    for i, line in enumerate(lines):
-        if "Name,Clock in date,Clock in time" in line:
-            header_row = i
-            continue
+    Returns:
+        DataFrame of floats with the same index and column names.
+    """
+    codes, uniques = pd.factorize(df[columns].to_numpy(dtype=object).ravel())
+
+    text = pd.Series(uniques, dtype=object).astype(str)
+    text = text.str.replace(r'[\s$,]', '', regex=True)
+    text = text.str.replace(r'^\((.*)\)$', r'-\1', regex=True)
+    numeric = pd.to_numeric(text, errors='coerce').to_numpy(dtype=float)
+
+    # factorize marks missing cells with -1
+    values = np.where(codes >= 0, numeric.take(codes, mode='clip'), np.nan)
+    return pd.DataFrame(values.reshape(len(df), len(columns)), index=df.index, columns=columns)
 
-        if header_row is not None and i > header_row:  # Check if header_row is not None
-            # Stop if we hit a separator row
-            if line.startswith('-,-,-,-'):
-                continue
+def _is_homebase_data_row(row):
+    """Return True if a parsed row from below the header is an employee shift row."""
+    # Short rows and "-,-,-,-" separator rows
+    if len(row) < 5 or row[:4] == ['-', '-', '-', '-']:
+        return False
+
+    # Per-employee "Totals for ..." rows and the final "Totals" row
+    if row[0].startswith('Totals for ') or (row[0] == 'Totals' and row[1] == ''):
+        return False
 
-            # Skip empty rows
-            if line.strip() == '""' or line.strip() == '':
-                continue
+    # Skip rows that are all empty cells
+    return any(cell.strip() for cell in row)
 
-            # Check if this is a totals row
-            if "Totals for " in line:
-                continue
+def _record_lines(csv_file, consumed):
+    """Yield the lines of csv_file, remembering the raw lines of the row being parsed."""
+    for line in csv_file:
+        consumed.append(line)
+        yield line
 
-            # Check if this is the final totals row
-            if line.startswith('Totals,""'):
-                continue
+def _read_homebase_chunk(header_line, data_lines):
+    """Parse buffered raw data lines with pd.read_csv, keeping every cell as a string.
 
-            # This should be a data row
-            parts = line.strip().split(',')
-            if len(parts) >= 5:  # Ensure we have enough columns
-                data_rows.append(line)
+    Empties data_lines once they are joined, so the lines and their text
+    aren't both held while the chunk is parsed.
+    """
+    text = header_line + ''.join(data_lines)
+    data_lines.clear()
+    return pd.read_csv(io.StringIO(text), dtype=object)
+
+def _split_columns(chunk):
+    """Return a parsed chunk's columns and a separate array for each one.
+
+    The arrays are copies: views into the chunk's single block would keep
+    the whole chunk alive until every one of its columns has been joined.
+    """
+    return chunk.columns, [chunk[col].to_numpy(copy=True) for col in chunk.columns]
+
+def _infer_column_type(values):
+    """Convert a numeric-looking column like pd.read_csv does for a whole file."""
+    try:
+        return pd.to_numeric(values)
+    except (ValueError, TypeError):
+        return values  # Not a numeric column, keep the strings
+
+def read_homebase_csv(csv_file, chunk_size=CSV_CHUNK_SIZE):
+    """Stream a Homebase export into a DataFrame of its employee shift rows.
+
+    Runs a single pass over the file with the csv module, so quoted notes with
+    commas or line breaks are classified correctly. Rows before the header are
+    preamble; after the header, separator, blank, "Totals for" and final
+    totals rows are dropped. The raw lines of shift rows are buffered and
+    handed to pd.read_csv every chunk_size rows, so only one chunk of file
+    text is held in memory at a time. Each parsed chunk is split into its
+    column arrays straight away, and the frame is built one column at a time,
+    so the data is held about once rather than as chunks plus their
+    concatenation. Column types are inferred once over the whole file so they
+    don't depend on chunk boundaries.
+
+    Args:
+        csv_file: Text file object opened with newline=''
+        chunk_size: Number of shift rows parsed into each DataFrame chunk
+
+    Returns:
+        (DataFrame, str): the shift rows and the payroll period cell
+        (e.g. "May 5 2025 To May 18 2025") from the second row of the export
+    """
+    consumed = []
+    reader = csv.reader(_record_lines(csv_file, consumed))
+    header_line = None
+    payroll_period = None
+    data_lines = []
+    data_row_count = 0
+    columns = None
+    column_chunks = []
+
+    for row_number, row in enumerate(reader):
+        raw_lines = consumed[:]
+        consumed.clear()
+
+        if row_number == 1 and len(row) > 1:
+            payroll_period = row[1]
+
+        if row[:3] == HOMEBASE_HEADER_PREFIX:
+            header_line = ''.join(raw_lines)
+            continue
+
+        if header_line is None or not _is_homebase_data_row(row):
+            continue
+
+        data_lines.extend(raw_lines)
+        data_row_count += 1
+        if data_row_count >= chunk_size:
+            columns, arrays = _split_columns(_read_homebase_chunk(header_line, data_lines))
+            column_chunks.append(arrays)
+            data_row_count = 0
 
     # Check if we found a header row
-    if header_row is None:
+    if header_line is None:
         raise ValueError("Could not find header row in the CSV file")
 
-    # Create a DataFrame from the data rows
-    df = pd.read_csv(StringIO(''.join([lines[header_row]] + data_rows)))
+    if data_lines or not column_chunks:
+        columns, arrays = _split_columns(_read_homebase_chunk(header_line, data_lines))
+        column_chunks.append(arrays)
+
+    # Join and type one column at a time, dropping its chunks as it goes
+    data = {}
+    for index, col in enumerate(columns):
+        values = [chunk_arrays[index] for chunk_arrays in column_chunks]
+        for chunk_arrays in column_chunks:
+            chunk_arrays[index] = None
+        data[col] = _infer_column_type(values[0] if len(values) == 1 else np.concatenate(values))
+    # copy=False keeps each column's array instead of copying them into blocks
+    return pd.DataFrame(data, columns=columns, copy=False), payroll_period
+
+def _read_homebase_file_object(file_obj):
+    """Read a Homebase export from a binary or text file-like object."""
+    if isinstance(file_obj, io.TextIOBase):
+        return read_homebase_csv(file_obj)
+
+    # Decode bytes (e.g. a Drive download buffer) as the csv module reads it
+    text_file = io.TextIOWrapper(file_obj, encoding='utf-8', newline='')
+    try:
+        return read_homebase_csv(text_file)
+    finally:
+        text_file.detach()  # Leave the caller's buffer open
+
+def transform_homebase_csv(input_file, file_name=None):
+    """Transform Homebase CSV into BigQuery-compatible format.
+
+    Args:
+        input_file: Path to the CSV file, or a binary/text file-like object
+            with its contents (e.g. a BytesIO downloaded from Drive)
+        file_name: Original file name, used to extract the location. Defaults
+            to the basename of input_file when it is a path.
+    """
+    # Read the CSV file
+    if isinstance(input_file, (str, os.PathLike)):
+        file_name = file_name or os.path.basename(input_file)
+        with open(input_file, 'r', newline='') as f:
+            df, payroll_period = read_homebase_csv(f)
+    else:
+        if not file_name:
+            raise ValueError("file_name is required when transforming a file-like object")
+        df, payroll_period = _read_homebase_file_object(input_file)
 
     # Clean up column names
     df.columns = [col.strip().replace(' ', '_').lower() for col in df.columns]
@@ -112,10 +386,10 @@ def transform_homebase_csv(input_file_path):
         df.rename(columns={'actual_vs._scheduled': 'actual_vs_scheduled'}, inplace=True)
 
     # Convert date and time columns to datetime
-    df['clock_in_datetime'] = df.apply(lambda row: parse_datetime(row['clock_in_date'], row['clock_in_time']), axis=1)
-    df['clock_out_datetime'] = df.apply(lambda row: parse_datetime(row['clock_out_date'], row['clock_out_time']), axis=1)
-    df['break_start_datetime'] = df.apply(lambda row: parse_datetime(row['clock_in_date'], row['break_start']), axis=1)
-    df['break_end_datetime'] = df.apply(lambda row: parse_datetime(row['clock_in_date'], row['break_end']), axis=1)
+    df['clock_in_datetime'] = parse_datetime_columns(df['clock_in_date'], df['clock_in_time'])
+    df['clock_out_datetime'] = parse_datetime_columns(df['clock_out_date'], df['clock_out_time'])
+    df['break_start_datetime'] = parse_datetime_columns(df['clock_in_date'], df['break_start'])
+    df['break_end_datetime'] = parse_datetime_columns(df['clock_in_date'], df['break_end'])
 
     # Keep raw strings for clock_in_date and clock_in_time
     df['clock_in_date_raw'] = df['clock_in_date']
@@ -125,9 +399,6 @@ def transform_homebase_csv(input_file_path):
     df['break_start_raw'] = df['break_start']
     df['break_end_raw'] = df['break_end']
 
-    # Parse wage rate
-    df['wage_rate_numeric'] = df['wage_rate'].apply(parse_wage)
-
     # Convert numeric columns (only if they exist)
     numeric_cols = ['scheduled_hours', 'actual_vs_scheduled', 'total_paid_hours',
                     'regular_hours', 'unpaid_breaks', 'ot_hours']
@@ -136,30 +407,24 @@ def transform_homebase_csv(input_file_path):
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors='coerce')
 
-    # Parse estimated wages, cash tips, credit tips (if they exist)
-    if 'estimated_wages' in df.columns:
-        df['estimated_wages_numeric'] = df['estimated_wages'].apply(parse_wage)
-    else:
-        df['estimated_wages_numeric'] = None
+    # Parse wage rate, estimated wages, cash tips, credit tips (if they exist) in one pass
+    money_cols = [col for col in MONEY_COLUMNS if col in df.columns]
+    money_values = parse_money_columns(df, money_cols)
 
-    if 'cash_tips' in df.columns:
-        df['cash_tips_numeric'] = df['cash_tips'].apply(parse_wage)
-    else:
-        df['cash_tips_numeric'] = None
-
-    if 'credit_tips' in df.columns:
-        df['credit_tips_numeric'] = df['credit_tips'].apply(parse_wage)
-    else:
-        df['credit_tips_numeric'] = None
-        logger.warning("'credit_tips' column not found in CSV. Setting credit_tips_numeric to None.")
+    for col in MONEY_COLUMNS:
+        if col in money_values.columns:
+            df[f'{col}_numeric'] = money_values[col]
+        else:
+            df[f'{col}_numeric'] = None
+            logger.warning(f"'{col}' column not found in CSV. Setting {col}_numeric to None.")
 
     # Add a timestamp for when this data was processed
     df['processed_at'] = datetime.now()
 
     # Extract location and payroll period from the file
-    location = os.path.basename(input_file_path).split('_')[0]
-    payroll_period_start = lines[1].split(',')[1].split(' To ')[0].strip()
-    payroll_period_end = lines[1].split(',')[1].split(' To ')[1].strip()
+    location = file_name.split('_')[0]
+    payroll_period_start = payroll_period.split(' To ')[0].strip()
+    payroll_period_end = payroll_period.split(' To ')[1].strip()
 
     df['location'] = location
     df['payroll_period_start'] = payroll_period_start
@@ -205,8 +470,138 @@ def get_drive_service():
 
     return build('drive', 'v3', credentials=credentials)
 
+def download_drive_file(drive_service, file_id):
+    """Download a Drive file into an in-memory buffer, positioned at the start."""
+    request = drive_service.files().get_media(fileId=file_id)
+
+    buffer = io.BytesIO()
+    downloader = MediaIoBaseDownload(buffer, request, chunksize=DOWNLOAD_CHUNK_SIZE)
+    done = False
+    while not done:
+        _, done = downloader.next_chunk()  # We don't need the status
+
+    buffer.seek(0)
+    return buffer
+
+def normalize_modified_after(value):
+    """Validate a modified_after filter and format it as an RFC 3339 UTC timestamp.
+
+    The value ends up inside the Drive query, so anything that isn't a
+    timestamp is rejected rather than escaped.
+
+    Args:
+        value: ISO 8601 / RFC 3339 date or timestamp, e.g. '2025-05-01T00:00:00Z';
+            a timestamp without an offset is taken as UTC
+
+    Returns:
+        str like '2025-05-01T00:00:00Z'
+
+    Raises:
+        ValueError: If value is not a timestamp
+    """
+    if not isinstance(value, str):
+        raise ValueError(f"modified_after must be an RFC 3339 timestamp, got {value!r}")
+    text = value.strip()
+    if text.endswith(('Z', 'z')):
+        # fromisoformat only accepts the 'Z' suffix from Python 3.11
+        text = text[:-1] + '+00:00'
+    try:
+        timestamp = datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"modified_after must be an RFC 3339 timestamp, got {value!r}")
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def parse_run_options(request_json):
+    """Validate the max_workers, load_mode and mv_refresh options of a request.
+
+    Missing options fall back to the environment defaults. max_workers above
+    MAX_WORKERS_LIMIT is lowered to the limit.
+
+    Returns:
+        dict with 'max_workers', 'load_mode' and 'refresh_mode'
+
+    Raises:
+        ValueError: If an option has an unknown or invalid value
+    """
+    request_json = request_json or {}
+
+    max_workers = request_json.get('max_workers', MAX_WORKERS)
+    # Whole numbers only: int() would truncate 2.5, and True counts as an int
+    if isinstance(max_workers, str) and max_workers.isdigit():
+        max_workers = int(max_workers)
+    if isinstance(max_workers, bool) or not isinstance(max_workers, int) or max_workers < 1:
+        raise ValueError(f"max_workers must be a positive integer, got {max_workers!r}")
+    if max_workers > MAX_WORKERS_LIMIT:
+        logger.warning(f"max_workers {max_workers} is above the limit, using {MAX_WORKERS_LIMIT}")
+        max_workers = MAX_WORKERS_LIMIT
+
+    load_mode = request_json.get('load_mode', LOAD_MODE)
+    if load_mode not in LOAD_MODES:
+        raise ValueError(f"load_mode must be one of {', '.join(LOAD_MODES)}, got {load_mode!r}")
+
+    refresh_mode = request_json.get('mv_refresh', MV_REFRESH_MODE)
+    if refresh_mode not in MV_REFRESH_MODES:
+        raise ValueError(f"mv_refresh must be one of {', '.join(MV_REFRESH_MODES)}, got {refresh_mode!r}")
+
+    return {'max_workers': max_workers, 'load_mode': load_mode, 'refresh_mode': refresh_mode}
+
+def list_source_file_pages(drive_service, name_contains='timesheets', modified_after=None):
+    """Yield pages of Homebase CSV files from the source folder as Drive returns them.
+
+    Requests the largest page size and follows nextPageToken until the
+    listing is exhausted. The name and modifiedTime filters are part of the
+    query, so Drive only returns matching files.
+
+    Args:
+        drive_service: Drive service
+        name_contains: Substring the file name must contain
+        modified_after: Optional RFC 3339 timestamp; only files modified after
+            it are listed. Raises ValueError if it isn't a timestamp.
+
+    Yields:
+        list of file dicts with id, name, parents, md5Checksum and modifiedTime
+    """
+    query = f"'{SOURCE_FOLDER_ID}' in parents and mimeType='text/csv' and trashed=false"
+    if name_contains:
+        escaped_name = name_contains.replace("\\", "\\\\").replace("'", "\\'")
+        query += f" and name contains '{escaped_name}'"
+    if modified_after:
+        query += f" and modifiedTime > '{normalize_modified_after(modified_after)}'"
+
+    page_token = None
+    while True:
+        results = drive_service.files().list(
+            q=query,
+            pageSize=DRIVE_LIST_PAGE_SIZE,
+            pageToken=page_token,
+            fields="nextPageToken, files(id, name, parents, md5Checksum, modifiedTime)"
+        ).execute()
+
+        files = results.get('files', [])
+        if files:
+            yield files
+
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+
+def list_source_files(drive_service, name_contains='timesheets', modified_after=None):
+    """Yield Homebase CSV files from the source folder one at a time, see list_source_file_pages."""
+    for page in list_source_file_pages(drive_service, name_contains, modified_after):
+        yield from page
+
 def get_or_create_loaded_folder(drive_service):
-    """Get the ID of the 'loaded' folder or create it if it doesn't exist."""
+    """Get the ID of the 'loaded' folder or create it if it doesn't exist.
+
+    The ID is cached for the life of the container, so warm invocations
+    skip the Drive search.
+    """
+    global _loaded_folder_id
+    if _loaded_folder_id:
+        return _loaded_folder_id
+
     # First try to find the folder
     query = "name='loaded' and mimeType='application/vnd.google-apps.folder' and trashed=false"
     results = drive_service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
@@ -214,7 +609,8 @@ def get_or_create_loaded_folder(drive_service):
 
     if folders:
         logger.info(f"Found 'loaded' folder with ID: {folders[0]['id']}")
-        return folders[0]['id']
+        _loaded_folder_id = folders[0]['id']
+        return _loaded_folder_id
 
     # If folder doesn't exist, create it
     file_metadata = {
@@ -226,7 +622,8 @@ def get_or_create_loaded_folder(drive_service):
     try:
         folder = drive_service.files().create(body=file_metadata, fields='id').execute()
         logger.info(f"Created 'loaded' folder with ID: {folder['id']}")
-        return folder['id']
+        _loaded_folder_id = folder['id']
+        return _loaded_folder_id
     except Exception as e:
         logger.error(f"Error creating 'loaded' folder: {e}")
         return None
@@ -282,8 +679,13 @@ def validate_date_range(start_date_str, end_date_str):
     except ValueError as e:
         return False, f"Error parsing dates: {e}"
 
-def get_table_id_from_filename(file_name):
-    """Extract table ID from filename and validate date range."""
+def get_payroll_period_from_filename(file_name):
+    """Extract the payroll period from a filename and validate the date range.
+
+    Returns:
+        (date, date): start and end of the payroll period, or None if the
+        filename has no date range
+    """
     match = re.search(r'_(\d{4}-\d{2}-\d{2})_(\d{4}-\d{2}-\d{2})_', file_name)
     if not match:
         return None
@@ -297,11 +699,99 @@ def get_table_id_from_filename(file_name):
         logger.error(f"Invalid date range in file {file_name}: {error_message}")
         raise ValueError(f"Please check date ranges: {error_message}")
 
+    return (datetime.strptime(start_date, "%Y-%m-%d").date(),
+            datetime.strptime(end_date, "%Y-%m-%d").date())
+
+def get_table_id_from_filename(file_name):
+    """Extract table ID from filename and validate date range."""
+    payroll_period = get_payroll_period_from_filename(file_name)
+    if not payroll_period:
+        return None
+
     # Format for table ID
-    start_date_formatted = start_date.replace('-', '')
-    end_date_formatted = end_date.replace('-', '')
+    start_date_formatted = payroll_period[0].strftime("%Y%m%d")
+    end_date_formatted = payroll_period[1].strftime("%Y%m%d")
     return f"{PROJECT_ID}.{DATASET_ID}.timesheet_{start_date_formatted}_{end_date_formatted}_"
 
+def create_consolidated_table(bq_client):
+    """Create the consolidated timesheets table if it doesn't exist.
+
+    The table is partitioned by payroll period start date and clustered by
+    location, so replacing or querying a period only touches its partition.
+    """
+    table = bigquery.Table(TIMESHEETS_TABLE_ID, schema=CONSOLIDATED_TIMESHEET_SCHEMA)
+    table.time_partitioning = bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY,
+        field="payroll_period_start_date"
+    )
+    table.clustering_fields = ["location"]
+    return bq_client.create_table(table, exists_ok=True)
+
+def load_consolidated_timesheet(df, payroll_period_start_date, bq_client):
+    """Replace one location's rows for a payroll period in the consolidated table.
+
+    The rows are loaded into a staging table first, then one transaction
+    deletes the location's rows in the period's partition and inserts the
+    staged ones, so a failed load leaves the old rows in place. Other
+    locations in the same period are left alone.
+    """
+    df = df.assign(payroll_period_start_date=payroll_period_start_date)
+    locations = sorted(df['location'].dropna().unique())
+
+    staging_table_id = f"{TIMESHEETS_TABLE_ID}_staging_{payroll_period_start_date:%Y%m%d}_{uuid.uuid4().hex[:8]}"
+    staging_table = bigquery.Table(staging_table_id, schema=CONSOLIDATED_TIMESHEET_SCHEMA)
+    # Expires on its own if the function dies before dropping it
+    staging_table.expires = datetime.now(timezone.utc) + STAGING_TABLE_EXPIRATION
+    bq_client.create_table(staging_table)
+    try:
+        job_config = bigquery.LoadJobConfig(
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+            schema=CONSOLIDATED_TIMESHEET_SCHEMA
+        )
+        job = bq_client.load_table_from_dataframe(df, staging_table_id, job_config=job_config)
+        job.result()  # Wait for the job to complete
+
+        replace_query = f"""
+        BEGIN TRANSACTION;
+        DELETE FROM `{TIMESHEETS_TABLE_ID}`
+        WHERE payroll_period_start_date = @payroll_period_start_date
+        AND location IN UNNEST(@locations);
+        INSERT INTO `{TIMESHEETS_TABLE_ID}`
+        SELECT * FROM `{staging_table_id}`;
+        COMMIT TRANSACTION;
+        """
+        replace_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("payroll_period_start_date", "DATE", payroll_period_start_date),
+            bigquery.ArrayQueryParameter("locations", "STRING", locations)
+        ])
+        bq_client.query(replace_query, job_config=replace_config).result()
+    finally:
+        bq_client.delete_table(staging_table_id, not_found_ok=True)
+    logger.info(f"Loaded {len(df)} rows into {TIMESHEETS_TABLE_ID} for {payroll_period_start_date} ({', '.join(locations)})")
+
+def migrate_per_period_tables(bq_client):
+    """One-time copy of the per-period timesheet_YYYYMMDD_YYYYMMDD_ tables into the consolidated table.
+
+    Only payroll periods that aren't in the consolidated table yet are
+    copied, so it is safe to run more than once. The old tables are kept;
+    point timesheets_v at the consolidated table once this has run.
+    """
+    create_consolidated_table(bq_client)
+
+    migrate_query = f"""
+    INSERT INTO `{TIMESHEETS_TABLE_ID}`
+    SELECT *, PARSE_DATE('%Y%m%d', SUBSTR(_TABLE_SUFFIX, 1, 8)) AS payroll_period_start_date
+    FROM `{PROJECT_ID}.{DATASET_ID}.timesheet_*`
+    WHERE REGEXP_CONTAINS(_TABLE_SUFFIX, r'^\\d{{8}}_\\d{{8}}_$')
+    AND PARSE_DATE('%Y%m%d', SUBSTR(_TABLE_SUFFIX, 1, 8)) NOT IN (
+        SELECT DISTINCT payroll_period_start_date FROM `{TIMESHEETS_TABLE_ID}`
+    )
+    """
+    query_job = bq_client.query(migrate_query)
+    query_job.result()  # Wait for the query to complete
+    logger.info(f"Migrated {query_job.num_dml_affected_rows} rows from per-period tables into {TIMESHEETS_TABLE_ID}")
+    return query_job.num_dml_affected_rows
+
 def check_if_file_processed(file_name, bq_client):
     """Check if the file has already been processed by looking for the table in BigQuery.
     If the table exists, drop it so we can reprocess the file."""
@@ -360,6 +850,431 @@ def move_file_to_loaded_folder(file_id, drive_service, loaded_folder_id):
     except Exception as e:
         logger.error(f"Error moving file {file_id} to 'loaded' folder: {e}")
 
+def _execute_drive_batch(drive_service, requests):
+    """Run Drive requests through the batch HTTP API.
+
+    Args:
+        drive_service: Drive service
+        requests: (file_id, request) pairs; file IDs identify the requests
+
+    Returns:
+        dict of file_id -> exception for the requests that failed. If a whole
+        batch fails (e.g. a transport error), every request in it is included.
+    """
+    failures = {}
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            failures[request_id] = exception
+
+    for i in range(0, len(requests), DRIVE_BATCH_SIZE):
+        chunk = requests[i:i + DRIVE_BATCH_SIZE]
+        try:
+            batch = drive_service.new_batch_http_request(callback=callback)
+            for file_id, request in chunk:
+                batch.add(request, request_id=file_id)
+            batch.execute()
+        except Exception as e:
+            logger.error(f"Drive batch of {len(chunk)} requests failed: {e}")
+            for file_id, _ in chunk:
+                failures.setdefault(file_id, e)
+
+    return failures
+
+def move_files_to_loaded_folder(files, drive_service, loaded_folder_id):
+    """Move files to the 'loaded' folder with batched Drive requests.
+
+    Parents come from the files().list response, so all moves go out in one
+    batch request (per 100 files) instead of a get and an update per file.
+    Files listed without parents fall back to move_file_to_loaded_folder.
+    Files that can't be moved are copied to the folder instead, also batched.
+    """
+    if not loaded_folder_id:
+        logger.warning("Cannot move files: 'loaded' folder ID is missing")
+        return
+
+    moves = []
+    for file in files:
+        if 'parents' not in file:
+            move_file_to_loaded_folder(file['id'], drive_service, loaded_folder_id)
+            continue
+
+        moves.append((file['id'], drive_service.files().update(
+            fileId=file['id'],
+            addParents=loaded_folder_id,
+            removeParents=",".join(file['parents']),
+            fields='id, parents'
+        )))
+
+    if not moves:
+        return
+
+    failures = _execute_drive_batch(drive_service, moves)
+    for file_id, _ in moves:
+        if file_id not in failures:
+            logger.info(f"Successfully moved file {file_id} to folder {loaded_folder_id}")
+
+    if not failures:
+        return
+
+    # If we can't move the files, at least try to copy them to the loaded folder
+    for file_id, error in failures.items():
+        logger.error(f"Error moving file {file_id} to 'loaded' folder: {error}")
+        logger.info(f"Attempting to copy file {file_id} to loaded folder instead")
+
+    copies = [(file_id, drive_service.files().copy(fileId=file_id, body={'parents': [loaded_folder_id]}))
+              for file_id in failures]
+    copy_failures = _execute_drive_batch(drive_service, copies)
+    for file_id in failures:
+        if file_id in copy_failures:
+            logger.error(f"Error copying file {file_id} to 'loaded' folder: {copy_failures[file_id]}")
+        else:
+            logger.info(f"Successfully copied file {file_id} to folder {loaded_folder_id}")
+
+def get_file_fingerprint(file):
+    """Identify a Drive file's content: its md5Checksum, or id + modifiedTime if Drive has no checksum."""
+    if file.get('md5Checksum'):
+        return file['md5Checksum']
+    return f"{file['id']}:{file.get('modifiedTime', '')}"
+
+def create_ledger_entry(file, result):
+    """Build the ledger row for a successfully loaded file."""
+    timings = result.get('timings', {})
+    return {
+        'file_id': file['id'],
+        'file_name': file['name'],
+        'fingerprint': get_file_fingerprint(file),
+        'md5_checksum': file.get('md5Checksum'),
+        'modified_time': file.get('modifiedTime'),
+        'row_count': result.get('row_count'),
+        'download_seconds': timings.get('download'),
+        'transform_seconds': timings.get('transform'),
+        'load_seconds': timings.get('load'),
+        'loaded_at': datetime.utcnow().isoformat(),
+    }
+
+class BigQueryIngestionLedger:
+    """Ingestion ledger kept in a small BigQuery table.
+
+    Files are looked up with one query per run and new entries are appended
+    with one load job per run.
+    """
+
+    def __init__(self, bq_client, table_id=INGESTION_LEDGER_TABLE_ID):
+        self.bq_client = bq_client
+        self.table_id = table_id
+
+    def find_loaded(self, files):
+        """Return the (file_name, fingerprint) pairs of these files that were already loaded."""
+        if not files:
+            return set()
+
+        query = f"""
+        SELECT DISTINCT file_name, fingerprint FROM `{self.table_id}`
+        WHERE fingerprint IN UNNEST(@fingerprints)
+        """
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ArrayQueryParameter("fingerprints", "STRING", [get_file_fingerprint(file) for file in files])
+        ])
+        try:
+            rows = self.bq_client.query(query, job_config=job_config).result()
+            return {(row['file_name'], row['fingerprint']) for row in rows}
+        except Exception as e:
+            logger.warning(f"Could not read ingestion ledger {self.table_id}, processing all files: {e}")
+            return set()
+
+    def record(self, entries):
+        """Append ledger entries for loaded files."""
+        if not entries:
+            return
+
+        job_config = bigquery.LoadJobConfig(
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            create_disposition=bigquery.CreateDisposition.CREATE_IF_NEEDED,
+            schema=INGESTION_LEDGER_SCHEMA
+        )
+        try:
+            self.bq_client.load_table_from_json(entries, self.table_id, job_config=job_config).result()
+        except Exception as e:
+            logger.error(f"Error recording {len(entries)} files in ingestion ledger {self.table_id}: {e}")
+
+class SQLiteIngestionLedger:
+    """Local stand-in for the BigQuery ingestion ledger, for local runs and tests."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with sqlite3.connect(self.path) as connection:
+            sqlite_types = {'FLOAT': 'REAL', 'INTEGER': 'INTEGER'}
+            columns = ', '.join(f"{field.name} {sqlite_types.get(field.field_type, 'TEXT')}"
+                                for field in INGESTION_LEDGER_SCHEMA)
+            connection.execute(f"CREATE TABLE IF NOT EXISTS ingestion_ledger ({columns})")
+
+    def find_loaded(self, files):
+        """Return the (file_name, fingerprint) pairs of these files that were already loaded."""
+        fingerprints = [get_file_fingerprint(file) for file in files]
+        if not fingerprints:
+            return set()
+
+        placeholders = ', '.join('?' for _ in fingerprints)
+        with self._lock, sqlite3.connect(self.path) as connection:
+            rows = connection.execute(
+                f"SELECT DISTINCT file_name, fingerprint FROM ingestion_ledger WHERE fingerprint IN ({placeholders})",
+                fingerprints
+            ).fetchall()
+        return set(rows)
+
+    def record(self, entries):
+        """Append ledger entries for loaded files."""
+        if not entries:
+            return
+
+        names = [field.name for field in INGESTION_LEDGER_SCHEMA]
+        with self._lock, sqlite3.connect(self.path) as connection:
+            connection.executemany(
+                f"INSERT INTO ingestion_ledger ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})",
+                [[entry.get(name) for name in names] for entry in entries]
+            )
+
+def get_ingestion_ledger(bq_client):
+    """Use the SQLite stand-in when HOMEBASE_LEDGER_PATH is set, otherwise the BigQuery table."""
+    if LEDGER_PATH:
+        return SQLiteIngestionLedger(LEDGER_PATH)
+    return BigQueryIngestionLedger(bq_client)
+
+def refresh_materialized_view(bq_client):
+    """Rebuild the timesheets_mv table from the timesheets_v view."""
+    sql_query = f"""
+    CREATE OR REPLACE TABLE `{MATERIALIZED_VIEW_TABLE_ID}` AS
+    SELECT * FROM `{TIMESHEETS_VIEW_ID}`
+    """
+    try:
+        query_job = bq_client.query(sql_query)
+        query_job.result()  # Wait for the query to complete
+        logger.info("Successfully updated materialized view table.")
+        return True
+    except Exception as e:
+        logger.error(f"Error updating materialized view: {e}")
+        return False
+
+def refresh_materialized_view_periods(bq_client, payroll_periods):
+    """Replace only the given payroll periods in timesheets_mv.
+
+    Deletes and re-inserts the rows for each payroll_period_start in one
+    transaction, so the work scales with the periods loaded in this run
+    rather than the whole history. Falls back to a full rebuild if the
+    incremental refresh fails (e.g. timesheets_mv doesn't exist yet).
+    """
+    sql_query = f"""
+    BEGIN TRANSACTION;
+    DELETE FROM `{MATERIALIZED_VIEW_TABLE_ID}`
+    WHERE payroll_period_start IN UNNEST(@payroll_periods);
+    INSERT INTO `{MATERIALIZED_VIEW_TABLE_ID}`
+    SELECT * FROM `{TIMESHEETS_VIEW_ID}`
+    WHERE payroll_period_start IN UNNEST(@payroll_periods);
+    COMMIT TRANSACTION;
+    """
+    try:
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ArrayQueryParameter("payroll_periods", "STRING", sorted(payroll_periods))
+        ])
+        query_job = bq_client.query(sql_query, job_config=job_config)
+        query_job.result()  # Wait for the query to complete
+        logger.info(f"Successfully refreshed materialized view for periods: {', '.join(sorted(payroll_periods))}")
+        return True
+    except Exception as e:
+        logger.error(f"Incremental materialized view refresh failed, rebuilding instead: {e}")
+        return refresh_materialized_view(bq_client)
+
+def refresh_after_batch(bq_client, results, refresh_mode=MV_REFRESH_MODE):
+    """Refresh timesheets_mv once for a whole batch of processed files.
+
+    Does nothing unless at least one file was loaded.
+
+    Args:
+        bq_client: BigQuery client
+        results: Result dicts from process_file
+        refresh_mode: 'full' to rebuild the table, 'incremental' to replace
+            only the payroll periods loaded in this batch
+    """
+    loaded_results = [result for result in results if not result['error']]
+    if not loaded_results:
+        logger.info("No files were loaded. Skipping materialized view refresh.")
+        return False
+
+    if refresh_mode == 'incremental':
+        # An export without shift rows has no payroll period, so its old rows can't be targeted
+        if all(result['payroll_period_start'] is not None for result in loaded_results):
+            payroll_periods = {result['payroll_period_start'] for result in loaded_results}
+            return refresh_materialized_view_periods(bq_client, payroll_periods)
+        logger.info("A loaded file had no shifts, so its payroll period is unknown. Rebuilding the materialized view.")
+    return refresh_materialized_view(bq_client)
+
+def process_file(file, drive_service, bq_client, load_mode=LOAD_MODE):
+    """Validate, download, transform and load a single Homebase file.
+
+    In 'per_period' load mode each payroll period gets its own table, which
+    is dropped and reloaded; in 'consolidated' mode the rows replace the
+    file's location and period in the partitioned timesheets table.
+
+    Returns:
+        dict with 'file_name', 'error' (None on success), 'move' (True if
+        the file should go to the 'loaded' folder), and for loaded files the
+        'payroll_period_start', 'row_count' and per-step 'timings'
+    """
+    file_id = file['id']
+    file_name = file['name']
+
+    # Validate the filename first before downloading
+    try:
+        table_id = get_table_id_from_filename(file_name)
+        if not table_id:
+            error_msg = f"Could not extract date range from filename: {file_name}"
+            logger.error(error_msg)
+            return {'file_name': file_name, 'error': error_msg, 'payroll_period_start': None}
+    except ValueError as date_error:
+        # This will catch the date validation errors from get_table_id_from_filename
+        error_msg = f"Invalid file {file_name}: {str(date_error)}"
+        logger.error(error_msg)
+        # Move the file to the loaded folder anyway to prevent reprocessing attempts
+        return {'file_name': file_name, 'error': error_msg, 'payroll_period_start': None, 'move': True}
+
+    try:
+        timings = {}
+
+        # Download the file into memory and transform the CSV
+        step_start = time.perf_counter()
+        file_buffer = download_drive_file(drive_service, file_id)
+        timings['download'] = time.perf_counter() - step_start
+
+        step_start = time.perf_counter()
+        df = transform_homebase_csv(file_buffer, file_name=file_name)
+        timings['transform'] = time.perf_counter() - step_start
+
+        step_start = time.perf_counter()
+        if load_mode == 'consolidated':
+            # Files for the same payroll period write the same partition, so load them one at a time
+            payroll_period_start_date = get_payroll_period_from_filename(file_name)[0]
+            with _get_table_lock(f"{TIMESHEETS_TABLE_ID}${payroll_period_start_date:%Y%m%d}"):
+                load_consolidated_timesheet(df, payroll_period_start_date, bq_client)
+        else:
+            # Load data into BigQuery
+            job_config = bigquery.LoadJobConfig(
+                write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+                schema=TIMESHEET_SCHEMA
+            )
+
+            # Files for the same payroll period share a table, so drop and load them one at a time
+            with _get_table_lock(table_id):
+                # Check if file has already been processed
+                # Note: check_if_file_processed now drops the table if it exists
+                check_if_file_processed(file_name, bq_client)
+
+                job = bq_client.load_table_from_dataframe(df, table_id, job_config=job_config)
+                job.result()  # Wait for the job to complete
+        timings['load'] = time.perf_counter() - step_start
+
+        # The file is moved to the 'loaded' folder and the materialized view
+        # is refreshed once for the whole batch
+        return {'file_name': file_name, 'error': None, 'move': True,
+                'payroll_period_start': df['payroll_period_start'].iloc[0] if len(df) else None,
+                'row_count': len(df), 'timings': timings}
+
+    except Exception as e:
+        error_msg = f"Error processing file {file_name}: {str(e)}"
+        logger.error(error_msg)
+        return {'file_name': file_name, 'error': error_msg, 'payroll_period_start': None}
+
+def _get_table_lock(table_id):
+    """Return the lock serializing writes to one BigQuery table."""
+    with _table_locks_guard:
+        return _table_locks.setdefault(table_id, threading.Lock())
+
+def _init_pipeline_worker(drive_service_factory):
+    """Give each worker thread its own Drive service; they are not thread-safe."""
+    _worker_state.drive_service = drive_service_factory()
+
+def _process_file_in_worker(file, bq_client, load_mode):
+    return process_file(file, _worker_state.drive_service, bq_client, load_mode=load_mode)
+
+def run_homebase_pipeline(file_pages, drive_service_factory, bq_client, loaded_folder_id, max_workers=MAX_WORKERS,
+                          refresh_mode=MV_REFRESH_MODE, load_mode=LOAD_MODE, ledger=None):
+    """Process Drive files concurrently with a bounded pool of worker threads.
+
+    Files whose content is already in the ingestion ledger are skipped before
+    any download and just moved to the 'loaded' folder. Each worker
+    downloads, transforms and loads one file at a time, so up to max_workers
+    downloads and BigQuery load jobs are in flight together. At the end,
+    finished files are moved in one Drive batch request, timesheets_mv is
+    refreshed once if any file was loaded, and loaded files are recorded in
+    the ledger.
+
+    Args:
+        file_pages: Iterable of pages (lists) of file dicts from the Drive
+            listing, e.g. list_source_file_pages()
+        drive_service_factory: Callable returning a new Drive service
+        bq_client: BigQuery client (shared, it is thread-safe)
+        loaded_folder_id: ID of the 'loaded' folder
+        max_workers: Number of files processed at the same time
+        refresh_mode: 'full' or 'incremental' timesheets_mv refresh, see refresh_after_batch
+        load_mode: 'per_period' or 'consolidated' tables, see process_file
+        ledger: Ingestion ledger (see get_ingestion_ledger), or None to process every file
+
+    Returns:
+        (list, list, list): (processed_files, validation_errors, skipped_files) in listing order
+    """
+    processed_files = []
+    validation_errors = []
+    skipped = []
+    submitted = []
+    consolidated_table_ready = False
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers),
+                            initializer=_init_pipeline_worker,
+                            initargs=(drive_service_factory,)) as executor:
+        # Workers start on the first page while later pages are still being listed
+        for page in file_pages:
+            # Skip files whose content was already loaded
+            already_loaded = ledger.find_loaded(page) if ledger else set()
+
+            for file in page:
+                if (file['name'], get_file_fingerprint(file)) in already_loaded:
+                    logger.info(f"Skipping {file['name']}: unchanged since it was last loaded")
+                    skipped.append(file)
+                    continue
+
+                if load_mode == 'consolidated' and not consolidated_table_ready:
+                    create_consolidated_table(bq_client)
+                    consolidated_table_ready = True
+
+                submitted.append((file, executor.submit(_process_file_in_worker, file, bq_client, load_mode)))
+
+        to_process = [file for file, _ in submitted]
+        results = [future.result() for _, future in submitted]
+
+    # Move loaded, invalid and skipped files out of the source folder in one batch
+    to_move = skipped + [file for file, result in zip(to_process, results) if result.get('move')]
+    if to_move:
+        # A failed move must not stop the refresh and ledger for files that loaded
+        try:
+            move_files_to_loaded_folder(to_move, drive_service_factory(), loaded_folder_id)
+        except Exception as e:
+            logger.error(f"Error moving files to 'loaded' folder: {e}")
+
+    for result in results:
+        if result['error']:
+            validation_errors.append(result['error'])
+        else:
+            processed_files.append(result['file_name'])
+
+    refresh_after_batch(bq_client, results, refresh_mode=refresh_mode)
+
+    if ledger:
+        ledger.record([create_ledger_entry(file, result)
+                       for file, result in zip(to_process, results) if not result['error']])
+
+    return processed_files, validation_errors, [file['name'] for file in skipped]
+
 @functions_framework.http
 def process_homebase_files(request):
     """Cloud Function to process Homebase timesheet files from Google Drive."""
@@ -376,6 +1291,21 @@ def process_homebase_files(request):
         except ValueError as e:
             return f"Test validation failed: {str(e)}"
 
+    # One-time copy of the per-period tables into the consolidated table
+    if request_json and request_json.get('migrate_to_consolidated'):
+        bq_client = bigquery.Client(project=PROJECT_ID)
+        migrated_rows = migrate_per_period_tables(bq_client)
+        return f"Migrated {migrated_rows} rows into {TIMESHEETS_TABLE_ID}"
+
+    # The filter goes into the Drive query, so reject anything that isn't a timestamp up front
+    modified_after = (request_json or {}).get('modified_after')
+    try:
+        if modified_after:
+            modified_after = normalize_modified_after(modified_after)
+        run_options = parse_run_options(request_json)
+    except ValueError as e:
+        return str(e), 400
+
     # Initialize clients
     drive_service = get_drive_service()
     bq_client = bigquery.Client(project=PROJECT_ID)
@@ -391,127 +1321,16 @@ def process_homebase_files(request):
         dataset.location = "US"
         bq_client.create_dataset(dataset, exists_ok=True)
 
-    # List files in the source folder
-    results = drive_service.files().list(
-        q=f"'{SOURCE_FOLDER_ID}' in parents and mimeType='text/csv' and name contains 'timesheets'",
-        fields="files(id, name)"
-    ).execute()
-
-    files = results.get('files', [])
-
-    if not files:
-        return "No files found to process."
-
-    processed_files = []
-    validation_errors = []
-
-    for file in files:
-        file_id = file['id']
-        file_name = file['name']
-
-        # Check if file has already been processed
-        # Note: check_if_file_processed now drops the table if it exists
-        check_if_file_processed(file_name, bq_client)
-
-        # Validate the filename first before downloading
-        try:
-            table_id = get_table_id_from_filename(file_name)
-            if not table_id:
-                error_msg = f"Could not extract date range from filename: {file_name}"
-                logger.error(error_msg)
-                validation_errors.append(error_msg)
-                continue
-        except ValueError as date_error:
-            # This will catch the date validation errors from get_table_id_from_filename
-            error_msg = f"Invalid file {file_name}: {str(date_error)}"
-            logger.error(error_msg)
-            validation_errors.append(error_msg)
-            # Move the file to the loaded folder anyway to prevent reprocessing attempts
-            move_file_to_loaded_folder(file_id, drive_service, loaded_folder_id)
-            continue
-
-        # Download the file
-        request = drive_service.files().get_media(fileId=file_id)
-
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            downloader = MediaIoBaseDownload(temp_file, request)
-            done = False
-            while not done:
-                _, done = downloader.next_chunk()  # We don't need the status
-
-            temp_file_path = temp_file.name
-
-        try:
-            # Transform the CSV
-            df = transform_homebase_csv(temp_file_path)
-
-            # Load data into BigQuery
-            job_config = bigquery.LoadJobConfig(
-                write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-                schema=[
-                    bigquery.SchemaField("location", "STRING"),
-                    bigquery.SchemaField("payroll_period_start", "STRING"),
-                    bigquery.SchemaField("payroll_period_end", "STRING"),
-                    bigquery.SchemaField("name", "STRING"),
-                    bigquery.SchemaField("clock_in_datetime", "TIMESTAMP"),
-                    bigquery.SchemaField("clock_out_datetime", "TIMESTAMP"),
-                    bigquery.SchemaField("break_start_datetime", "TIMESTAMP"),
-                    bigquery.SchemaField("break_end_datetime", "TIMESTAMP"),
-                    bigquery.SchemaField("break_length", "STRING"),
-                    bigquery.SchemaField("break_type", "STRING"),
-                    bigquery.SchemaField("payroll_id", "STRING"),
-                    bigquery.SchemaField("role", "STRING"),
-                    bigquery.SchemaField("wage_rate_numeric", "FLOAT"),
-                    bigquery.SchemaField("scheduled_hours", "FLOAT"),
-                    bigquery.SchemaField("actual_vs_scheduled", "FLOAT"),
-                    bigquery.SchemaField("total_paid_hours", "FLOAT"),
-                    bigquery.SchemaField("regular_hours", "FLOAT"),
-                    bigquery.SchemaField("unpaid_breaks", "FLOAT"),
-                    bigquery.SchemaField("ot_hours", "FLOAT"),
-                    bigquery.SchemaField("estimated_wages_numeric", "FLOAT"),
-                    bigquery.SchemaField("cash_tips_numeric", "FLOAT"),
-                    bigquery.SchemaField("credit_tips_numeric", "FLOAT"),
-                    bigquery.SchemaField("no_show_reason", "STRING"),
-                    bigquery.SchemaField("employee_note", "STRING"),
-                    bigquery.SchemaField("manager_note", "STRING"),
-                    bigquery.SchemaField("processed_at", "TIMESTAMP"),
-                    bigquery.SchemaField("clock_in_date_raw", "STRING"),
-                    bigquery.SchemaField("clock_in_time_raw", "STRING"),
-                    bigquery.SchemaField("clock_out_date_raw", "STRING"),
-                    bigquery.SchemaField("clock_out_time_raw", "STRING"),
-                    bigquery.SchemaField("break_start_raw", "STRING"),
-                    bigquery.SchemaField("break_end_raw", "STRING")
-                ]
-            )
-
-            job = bq_client.load_table_from_dataframe(df, table_id, job_config=job_config)
-            job.result()  # Wait for the job to complete
+    # List files in the source folder; pages are processed as they arrive
+    file_pages = list_source_file_pages(
+        drive_service,
+        name_contains=(request_json or {}).get('name_contains', 'timesheets'),
+        modified_after=modified_after
+    )
 
-            # Run SQL query to update materialized view after loading the data
-            sql_query = """
-            CREATE OR REPLACE TABLE `tys-bi.homebase.timesheets_mv` AS
-            SELECT * FROM `tys-bi.homebase.timesheets_v`
-            """
-            try:
-                query_job = bq_client.query(sql_query)
-                query_job.result()  # Wait for the query to complete
-                logger.info("Successfully updated materialized view table.")
-            except Exception as e:
-                logger.error(f"Error updating materialized view: {e}")
-
-            # Move file to 'loaded' folder
-            move_file_to_loaded_folder(file_id, drive_service, loaded_folder_id)
-
-            processed_files.append(file_name)
-
-        except Exception as e:
-            error_msg = f"Error processing file {file_name}: {str(e)}"
-            logger.error(error_msg)
-            validation_errors.append(error_msg)
-        finally:
-            # Clean up temp file
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
+    ledger = None if (request_json or {}).get('force') else get_ingestion_ledger(bq_client)
+    processed_files, validation_errors, skipped_files = run_homebase_pipeline(
+        file_pages, get_drive_service, bq_client, loaded_folder_id, ledger=ledger, **run_options)
 
     # Prepare the response
     response_parts = []
@@ -519,12 +1338,15 @@ def process_homebase_files(request):
     if processed_files:
         response_parts.append(f"Successfully processed {len(processed_files)} files: {', '.join(processed_files)}")
 
+    if skipped_files:
+        response_parts.append(f"Skipped {len(skipped_files)} unchanged files: {', '.join(skipped_files)}")
+
     if validation_errors:
         response_parts.append(f"Validation errors found in {len(validation_errors)} files:")
         for error in validation_errors:
             response_parts.append(f"  - {error}")
 
-    if not processed_files and not validation_errors:
-        return "No new files to process."
+    if not processed_files and not validation_errors and not skipped_files:
+        return "No files found to process."
 
     return "\n".join(response_parts)
\ No newline at end of file
@@ -6,11 +6,13 @@ to verify that the code handles missing columns correctly.
 """
 
 import os
+import io
 import pandas as pd
 from datetime import datetime
 
 # Import functions from main.py
-from main import parse_wage
+from main import (parse_wage, parse_money_columns, parse_datetime, parse_datetime_columns,
+                  read_homebase_csv, transform_homebase_csv)
 
 def create_test_csv_with_credit_tips():
     """Create a test CSV file with the 'credit_tips' column."""
@@ -109,6 +111,164 @@ def test_without_credit_tips():
             os.remove(test_file)
             print(f"Removed test file: {test_file}")
 
+def test_parse_datetime_columns():
+    """Test that the vectorized parser matches parse_datetime row by row."""
+    print("\n=== Testing vectorized date/time parsing ===")
+
+    dates = pd.Series(['May 5 2025', 'May 6 2025', ' March 10 2025 ', 'May 7 2025', None, '', 'Not a date', 'may 8 2025'])
+    times = pd.Series(['9:00am', '12:30PM', '9:44am', None, '9:00am', '9:00am', '9:00am', '11:59pm'])
+
+    parsed = parse_datetime_columns(dates, times)
+    expected = [parse_datetime(d, t) for d, t in zip(dates, times)]
+
+    for value, expected_value in zip(parsed, expected):
+        if expected_value is None:
+            assert pd.isna(value)
+        else:
+            assert value == expected_value
+    print("Sample values:", parsed.tolist())
+
+def test_parse_money_columns():
+    """Test that the vectorized money parser matches parse_wage."""
+    print("\n=== Testing vectorized money parsing ===")
+
+    test_file = create_test_csv_with_credit_tips()
+    try:
+        df = pd.read_csv(test_file, header=2)
+        money_cols = ['Wage rate', 'Estimated wages', 'Cash tips', 'Credit tips']
+
+        parsed = parse_money_columns(df, money_cols)
+        for col in money_cols:
+            assert parsed[col].tolist() == df[col].apply(parse_wage).tolist()
+        print("Sample values:", parsed.values.tolist())
+    finally:
+        if os.path.exists(test_file):
+            os.remove(test_file)
+
+    df = pd.DataFrame({'amount': ['$1,020.00', ' $5.50 ', '', None, 'n/a', '(12.50)', '$(3.00)']})
+    parsed = parse_money_columns(df, ['amount'])['amount']
+    assert parsed.tolist()[:2] == [1020.0, 5.5]
+    assert parsed[2:5].isna().all()
+    assert parsed.tolist()[5:] == [-12.5, -3.0]
+
+def create_test_homebase_export():
+    """Create a test CSV file laid out like a full Homebase timesheet export."""
+    csv_content = """Timesheets,,,,,,,,,,,,,,,,,,,,,,,
+Restore Round Rock,May 5 2025 To May 18 2025,,,,,,,,,,,,,,,,,,,,,,
+""
+Name,Clock in date,Clock in time,Clock out date,Clock out time,Break start,Break end,Break length,Break type,Payroll ID,Role,Wage rate,Scheduled hours,Actual vs. scheduled,Total paid hours,Regular hours,Unpaid breaks,OT hours,Estimated wages,Cash tips,Credit tips,No show reason,Employee note,Manager note
+John Doe,May 5 2025,9:00am,May 5 2025,5:00pm,12:00pm,1:00pm,1:00,Unpaid,12345,Technician,$15.00,8.00,0.00,7.00,7.00,1.00,0.00,$105.00,$10.00,$15.00,,,
+John Doe,May 6 2025,9:00am,May 6 2025,1:00pm,,,,,12345,Technician,$15.00,4.00,0.00,4.00,4.00,0.00,0.00,$60.00,,,,,
+-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-
+Totals for John Doe,"",,,,,,,,,,,12.00,0.00,11.00,11.00,1.00,0.00,$165.00,$10.00,$15.00,,,
+Jane Smith,May 6 2025,8:00am,May 6 2025,4:30pm,12:00pm,12:30pm,0:30,Unpaid,67890,Manager,"$1,020.00",8.00,0.50,8.00,8.00,0.50,0.00,$160.00,$5.00,$20.00,,,
+-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-,-
+Totals for Jane Smith,"",,,,,,,,,,,8.00,0.50,8.00,8.00,0.50,0.00,$160.00,$5.00,$20.00,,,
+""
+Totals,"",,,,,,,,,,,20.00,0.50,19.00,19.00,1.50,0.00,$325.00,$15.00,$35.00,,,
+"""
+
+    test_file = "Restore Round Rock_2025-05-05_2025-05-18_timesheets.csv"
+    with open(test_file, "w") as f:
+        f.write(csv_content)
+
+    return test_file
+
+def test_transform_homebase_csv():
+    """Test the full transform on a small Homebase export."""
+    print("\n=== Testing transform_homebase_csv ===")
+
+    test_file = create_test_homebase_export()
+    try:
+        df = transform_homebase_csv(test_file)
+
+        assert len(df) == 3
+        assert df['location'].unique().tolist() == ['Restore Round Rock']
+        assert df['payroll_period_start'].iloc[0] == 'May 5 2025'
+        assert df['payroll_period_end'].iloc[0] == 'May 18 2025'
+        assert df['clock_in_datetime'].tolist() == [
+            datetime(2025, 5, 5, 9, 0), datetime(2025, 5, 6, 9, 0), datetime(2025, 5, 6, 8, 0)]
+        assert pd.isna(df['break_start_datetime'].iloc[1])
+        assert df['break_end_datetime'].iloc[2] == datetime(2025, 5, 6, 12, 30)
+        assert df['wage_rate_numeric'].tolist() == [15.0, 15.0, 1020.0]
+        assert df['credit_tips_numeric'].iloc[0] == 15.0
+        assert pd.isna(df['credit_tips_numeric'].iloc[1])
+        print(f"Transformed {len(df)} rows")
+    finally:
+        if os.path.exists(test_file):
+            os.remove(test_file)
+
+def test_transform_homebase_csv_from_buffer():
+    """Test transforming an in-memory download gives the same rows as the file path."""
+    print("\n=== Testing transform_homebase_csv from a buffer ===")
+
+    test_file = create_test_homebase_export()
+    try:
+        with open(test_file, "rb") as f:
+            buffer = io.BytesIO(f.read())
+
+        from_path = transform_homebase_csv(test_file)
+        from_buffer = transform_homebase_csv(buffer, file_name=test_file)
+
+        columns = [col for col in from_path.columns if col != 'processed_at']
+        pd.testing.assert_frame_equal(from_path[columns], from_buffer[columns])
+        assert not buffer.closed
+
+        try:
+            transform_homebase_csv(buffer)
+            assert False, "Expected a ValueError without file_name"
+        except ValueError as e:
+            print(f"Got expected error: {e}")
+    finally:
+        if os.path.exists(test_file):
+            os.remove(test_file)
+
+def test_read_homebase_csv_quoted_notes():
+    """Test that quoted notes with commas and line breaks stay in one row, across chunks."""
+    print("\n=== Testing streaming reader with quoted notes ===")
+
+    test_file = create_test_homebase_export()
+    try:
+        with open(test_file) as f:
+            content = f.read()
+        content = content.replace(
+            "$60.00,,,,,",
+            '$60.00,,,,"Left early, sick","Totals for the week\nchecked, ok"')
+        with open(test_file, "w") as f:
+            f.write(content)
+
+        with open(test_file, newline='') as f:
+            df, payroll_period = read_homebase_csv(f, chunk_size=1)
+
+        assert payroll_period == 'May 5 2025 To May 18 2025'
+        assert len(df) == 3
+        assert df['Employee note'].iloc[1] == 'Left early, sick'
+        assert df['Manager note'].iloc[1] == 'Totals for the week\nchecked, ok'
+        assert df['Payroll ID'].tolist() == [12345, 12345, 67890]
+        print("Notes:", df['Employee note'].tolist())
+    finally:
+        if os.path.exists(test_file):
+            os.remove(test_file)
+
+def test_read_homebase_csv_types_ignore_chunks():
+    """Column types come from the whole file, whatever the chunk size."""
+    print("\n=== Testing column types across chunks ===")
+
+    with open(create_test_csv_with_credit_tips()) as f:
+        content = f.read()
+    # A note that looks numeric in the first chunk and is text in the second
+    content = content.replace("$15.00,,,\n", "$15.00,,42,\n").replace("$20.00,,,\n", "$20.00,,sick,\n")
+    os.remove("test_with_credit_tips.csv")
+
+    whole, _ = read_homebase_csv(io.StringIO(content, newline=''))
+    chunked, _ = read_homebase_csv(io.StringIO(content, newline=''), chunk_size=1)
+
+    pd.testing.assert_frame_equal(chunked, whole)
+    assert chunked['Employee note'].tolist() == ['42', 'sick']
+    assert chunked['Payroll ID'].tolist() == [12345, 67890]
+    assert chunked['Total paid hours'].tolist() == [7.0, 8.0]
+    print(chunked.dtypes.value_counts().to_dict())
+
 def main():
     """Run all tests."""
     print("=== Testing CSV Parsing and Column Handling ===")
@@ -118,6 +278,13 @@ def main():
     
     # Test without credit_tips column
     test_without_credit_tips()
+
+    test_parse_datetime_columns()
+    test_parse_money_columns()
+    test_transform_homebase_csv()
+    test_transform_homebase_csv_from_buffer()
+    test_read_homebase_csv_quoted_notes()
+    test_read_homebase_csv_types_ignore_chunks()
     
     print("\n=== All Tests Completed ===")
 
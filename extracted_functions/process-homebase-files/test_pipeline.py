@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Tests for the batch-level steps of process_homebase_files, using a fake
+BigQuery client that records the statements it is asked to run.
+"""
+
+import io
+import os
+import tempfile
+from datetime import date
+import pandas as pd
+
+import main
+from main import (TIMESHEETS_TABLE_ID, SQLiteIngestionLedger, create_ledger_entry, get_payroll_period_from_filename,
+                  list_source_files, load_consolidated_timesheet, move_files_to_loaded_folder, refresh_after_batch,
+                  normalize_modified_after, parse_run_options, process_homebase_files, run_homebase_pipeline,
+                  transform_homebase_csv)
+from benchmark_pipeline import HEADER
+
+class FakeJob:
+    def result(self):
+        return []
+
+class FakeBigQueryClient:
+    """Records queries instead of running them."""
+
+    def __init__(self, fail_queries=0):
+        self.queries = []
+        self.loads = []
+        self.created_tables = []
+        self.deleted_tables = []
+        self.fail_queries = fail_queries
+
+    def query(self, sql, job_config=None):
+        self.queries.append((sql, job_config))
+        if len(self.queries) <= self.fail_queries:
+            raise Exception("Not found: Table tys-bi:homebase.timesheets_mv")
+        return FakeJob()
+
+    def load_table_from_dataframe(self, df, table_id, job_config=None):
+        self.loads.append((df, table_id, job_config))
+        return FakeJob()
+
+    def create_table(self, table, exists_ok=False):
+        self.created_tables.append(table)
+        return table
+
+    def delete_table(self, table_id, not_found_ok=False):
+        self.deleted_tables.append(table_id)
+
+class FakeRequest:
+    def __init__(self, result=None):
+        self.result = result
+
+    def execute(self):
+        return self.result
+
+class FakeFailingRequest:
+    def execute(self):
+        raise Exception("403 insufficientFilePermissions")
+
+class FakeBatch:
+    def __init__(self, drive_service, callback):
+        self.drive_service = drive_service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.drive_service.calls.append(('batch', len(self.requests)))
+        if self.drive_service.failing_batches:
+            self.drive_service.failing_batches -= 1
+            raise ConnectionResetError("Connection reset by peer")
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except Exception as e:
+                self.callback(request_id, None, e)
+
+class FakeDriveService:
+    """Records Drive calls; only metadata operations are supported."""
+
+    def __init__(self, unmovable=(), failing_batches=0):
+        self.calls = []
+        self.unmovable = set(unmovable)
+        # Number of batch requests that fail as a whole before any request runs
+        self.failing_batches = failing_batches
+
+    def files(self):
+        return self
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def get(self, fileId, fields=None):
+        self.calls.append(('get', fileId))
+        return FakeRequest({'parents': ['source']})
+
+    def update(self, fileId, **kwargs):
+        self.calls.append(('update', fileId))
+        if fileId in self.unmovable:
+            return FakeFailingRequest()
+        return FakeRequest({'id': fileId})
+
+    def copy(self, fileId, body=None):
+        self.calls.append(('copy', fileId))
+        return FakeRequest({'id': f"copy-of-{fileId}"})
+
+    def list(self, **kwargs):
+        self.calls.append(('list', kwargs))
+        pages = {None: ({'files': [{'id': 'file-1'}, {'id': 'file-2'}], 'nextPageToken': 'page-2'}),
+                 'page-2': ({'files': [{'id': 'file-3'}]})}
+        return FakeRequest(pages[kwargs.get('pageToken')])
+
+    def get_media(self, fileId):
+        raise AssertionError(f"File {fileId} should not be downloaded")
+
+def loaded(file_name, period):
+    return {'file_name': file_name, 'error': None, 'payroll_period_start': period}
+
+def failed(file_name):
+    return {'file_name': file_name, 'error': f"Error processing file {file_name}", 'payroll_period_start': None}
+
+def test_refresh_runs_once_per_batch():
+    """A full rebuild runs once however many files were loaded."""
+    bq_client = FakeBigQueryClient()
+    results = [loaded('a.csv', 'May 5 2025'), loaded('b.csv', 'April 21 2025'), failed('c.csv')]
+
+    assert refresh_after_batch(bq_client, results, refresh_mode='full')
+    assert len(bq_client.queries) == 1
+    assert 'CREATE OR REPLACE TABLE' in bq_client.queries[0][0]
+
+def test_refresh_skipped_when_nothing_loaded():
+    """No refresh runs when every file failed."""
+    bq_client = FakeBigQueryClient()
+
+    assert not refresh_after_batch(bq_client, [failed('a.csv'), failed('b.csv')])
+    assert not refresh_after_batch(bq_client, [])
+    assert bq_client.queries == []
+
+def test_incremental_refresh_replaces_loaded_periods():
+    """Incremental mode only touches the payroll periods loaded in this batch."""
+    bq_client = FakeBigQueryClient()
+    results = [loaded('a.csv', 'May 5 2025'), loaded('b.csv', 'May 5 2025'), loaded('c.csv', 'April 21 2025')]
+
+    assert refresh_after_batch(bq_client, results, refresh_mode='incremental')
+    assert len(bq_client.queries) == 1
+    sql, job_config = bq_client.queries[0]
+    assert 'DELETE FROM' in sql and 'CREATE OR REPLACE' not in sql
+    assert job_config.query_parameters[0].values == ['April 21 2025', 'May 5 2025']
+
+def test_incremental_refresh_falls_back_to_rebuild():
+    """A failed incremental refresh falls back to a full rebuild."""
+    bq_client = FakeBigQueryClient(fail_queries=1)
+
+    assert refresh_after_batch(bq_client, [loaded('a.csv', 'May 5 2025')], refresh_mode='incremental')
+    assert len(bq_client.queries) == 2
+    assert 'CREATE OR REPLACE TABLE' in bq_client.queries[1][0]
+
+def test_incremental_refresh_with_empty_export():
+    """An export without shifts has no period; the refresh rebuilds instead of failing on None."""
+    content = ("Timesheets\nRestore Round Rock,May 5 2025 To May 18 2025\n\"\"\n" + HEADER).encode('utf-8')
+    df = transform_homebase_csv(io.BytesIO(content), file_name='Restore Round Rock_2025-05-05_2025-05-18_timesheets.csv')
+    assert len(df) == 0
+
+    bq_client = FakeBigQueryClient()
+    results = [loaded('a.csv', 'May 5 2025'), loaded('empty.csv', None)]
+
+    assert refresh_after_batch(bq_client, results, refresh_mode='incremental')
+    assert len(bq_client.queries) == 1
+    assert 'CREATE OR REPLACE TABLE' in bq_client.queries[0][0]
+
+def test_load_consolidated_replaces_location_in_period():
+    """Consolidated loads stage the rows, then swap out the file's location/period in one transaction."""
+    bq_client = FakeBigQueryClient()
+    period_start, _ = get_payroll_period_from_filename('Restore Round Rock_2025-05-05_2025-05-18_timesheets.csv')
+    df = pd.DataFrame({'location': ['Restore Round Rock'] * 2, 'name': ['John Doe', 'Jane Smith']})
+
+    load_consolidated_timesheet(df, period_start, bq_client)
+
+    staging_table = bq_client.created_tables[0]
+    staging_table_id = f"{staging_table.project}.{staging_table.dataset_id}.{staging_table.table_id}"
+    assert staging_table_id.startswith(f"{TIMESHEETS_TABLE_ID}_staging_20250505_")
+    assert staging_table.expires is not None
+
+    loaded_df, table_id, load_config = bq_client.loads[0]
+    assert table_id == staging_table_id
+    assert load_config.write_disposition == 'WRITE_TRUNCATE'
+    assert loaded_df['payroll_period_start_date'].tolist() == [date(2025, 5, 5)] * 2
+
+    sql, job_config = bq_client.queries[0]
+    statements = [statement.strip() for statement in sql.split(';') if statement.strip()]
+    assert statements[0] == 'BEGIN TRANSACTION' and statements[-1] == 'COMMIT TRANSACTION'
+    assert statements[1].startswith(f"DELETE FROM `{TIMESHEETS_TABLE_ID}`")
+    assert statements[2].startswith(f"INSERT INTO `{TIMESHEETS_TABLE_ID}`") and staging_table_id in statements[2]
+    assert job_config.query_parameters[0].value == date(2025, 5, 5)
+    assert job_config.query_parameters[1].values == ['Restore Round Rock']
+    assert bq_client.deleted_tables == [staging_table_id]
+
+def test_failed_consolidated_load_keeps_existing_rows():
+    """If the staging load fails, the old rows are never deleted and the staging table is dropped."""
+    class FailingLoadClient(FakeBigQueryClient):
+        def load_table_from_dataframe(self, df, table_id, job_config=None):
+            raise Exception("400 Provided Schema does not match Table")
+
+    bq_client = FailingLoadClient()
+    period_start, _ = get_payroll_period_from_filename('Restore Round Rock_2025-05-05_2025-05-18_timesheets.csv')
+    df = pd.DataFrame({'location': ['Restore Round Rock'], 'name': ['John Doe']})
+
+    try:
+        load_consolidated_timesheet(df, period_start, bq_client)
+    except Exception:
+        pass
+    else:
+        raise AssertionError("the failed load was not reported")
+    assert bq_client.queries == []
+    assert len(bq_client.deleted_tables) == 1
+
+def test_ledger_skips_unchanged_files():
+    """Files already in the ledger with the same content are moved without downloading."""
+    file = {'id': 'file-1', 'name': 'Restore Round Rock_2025-05-05_2025-05-18_timesheets.csv', 'parents': ['source'],
+            'md5Checksum': 'abc123', 'modifiedTime': '2025-05-19T10:00:00Z'}
+    changed = dict(file, md5Checksum='def456')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ledger = SQLiteIngestionLedger(os.path.join(tmp_dir, 'ledger.db'))
+        ledger.record([create_ledger_entry(file, {'row_count': 120, 'timings': {'download': 0.5}})])
+
+        assert ledger.find_loaded([file, changed]) == {(file['name'], 'abc123')}
+
+        drive_service = FakeDriveService()
+        bq_client = FakeBigQueryClient()
+        processed_files, validation_errors, skipped_files = run_homebase_pipeline(
+            [[file]], lambda: drive_service, bq_client, 'loaded', max_workers=2, ledger=ledger)
+
+    assert (processed_files, validation_errors, skipped_files) == ([], [], [file['name']])
+    assert drive_service.calls == [('update', 'file-1'), ('batch', 1)]
+    assert bq_client.queries == [] and bq_client.loads == []
+
+def test_move_files_in_one_batch():
+    """Moves use listing parents and go out in one batch; failed moves are copied instead."""
+    files = [{'id': f"file-{i}", 'name': f"file-{i}.csv", 'parents': ['source']} for i in range(3)]
+    drive_service = FakeDriveService(unmovable=['file-2'])
+
+    move_files_to_loaded_folder(files, drive_service, 'loaded')
+
+    assert [call for call in drive_service.calls if call[0] == 'batch'] == [('batch', 3), ('batch', 1)]
+    assert ('copy', 'file-2') in drive_service.calls
+    assert not any(call[0] == 'get' for call in drive_service.calls)
+
+def test_failed_batch_falls_back_to_copies():
+    """A batch that fails as a whole counts every move in it as failed, so they are copied."""
+    files = [{'id': f"file-{i}", 'name': f"file-{i}.csv", 'parents': ['source']} for i in range(3)]
+    drive_service = FakeDriveService(failing_batches=1)
+
+    move_files_to_loaded_folder(files, drive_service, 'loaded')
+
+    assert [call for call in drive_service.calls if call[0] == 'batch'] == [('batch', 3), ('batch', 3)]
+    assert [call[1] for call in drive_service.calls if call[0] == 'copy'] == ['file-0', 'file-1', 'file-2']
+
+class FakeBrokenDriveService(FakeDriveService):
+    """Fails every move before it reaches a batch."""
+
+    def update(self, fileId, **kwargs):
+        raise Exception("Unable to find the server at www.googleapis.com")
+
+def test_move_errors_do_not_stop_refresh_or_ledger():
+    """Loaded files are refreshed and recorded in the ledger even when moving them fails."""
+    file = {'id': 'file-1', 'name': 'Restore Round Rock_2025-05-05_2025-05-18_timesheets.csv', 'parents': ['source'],
+            'md5Checksum': 'abc123', 'modifiedTime': '2025-05-19T10:00:00Z'}
+    result = {'file_name': file['name'], 'error': None, 'move': True, 'payroll_period_start': 'May 5 2025',
+              'row_count': 120, 'timings': {'download': 0.5}}
+    process_file_in_worker = main._process_file_in_worker
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ledger = SQLiteIngestionLedger(os.path.join(tmp_dir, 'ledger.db'))
+        bq_client = FakeBigQueryClient()
+        try:
+            main._process_file_in_worker = lambda file, bq_client, load_mode: result
+            processed_files, validation_errors, _ = run_homebase_pipeline(
+                [[file]], FakeBrokenDriveService, bq_client, 'loaded', max_workers=1, refresh_mode='full',
+                ledger=ledger)
+        finally:
+            main._process_file_in_worker = process_file_in_worker
+
+        assert processed_files == [file['name']] and validation_errors == []
+        assert len(bq_client.queries) == 1
+        assert ledger.find_loaded([file]) == {(file['name'], 'abc123')}
+
+def test_listing_follows_page_tokens():
+    """The listing uses the largest page size, follows nextPageToken and filters in the query."""
+    drive_service = FakeDriveService()
+
+    files = list(list_source_files(drive_service, modified_after='2025-05-01T00:00:00Z'))
+
+    assert [file['id'] for file in files] == ['file-1', 'file-2', 'file-3']
+    list_calls = [call[1] for call in drive_service.calls if call[0] == 'list']
+    assert [call['pageToken'] for call in list_calls] == [None, 'page-2']
+    assert list_calls[0]['pageSize'] == 1000
+    assert "name contains 'timesheets'" in list_calls[0]['q']
+    assert "modifiedTime > '2025-05-01T00:00:00Z'" in list_calls[0]['q']
+    assert 'nextPageToken' in list_calls[0]['fields']
+
+def test_modified_after_must_be_a_timestamp():
+    """modified_after is normalized to UTC, and anything else is rejected before it reaches the query."""
+    assert normalize_modified_after('2025-05-01T00:00:00Z') == '2025-05-01T00:00:00Z'
+    assert normalize_modified_after('2025-05-01T07:30:00-05:00') == '2025-05-01T12:30:00Z'
+    assert normalize_modified_after('2025-05-01') == '2025-05-01T00:00:00Z'
+
+    for value in ["2020' or name contains '", "2025-05-01T00:00:00Z' or trashed=true or '", 'yesterday', 20250501]:
+        try:
+            normalize_modified_after(value)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"{value!r} was accepted")
+
+    drive_service = FakeDriveService()
+    try:
+        list(list_source_files(drive_service, modified_after="2020' or name contains '"))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("the listing accepted an invalid modified_after")
+    assert drive_service.calls == []
+
+class FakeHttpRequest:
+    def __init__(self, body):
+        self.body = body
+
+    def get_json(self, silent=False):
+        return self.body
+
+def test_run_options_are_validated():
+    """Bad max_workers, load_mode or mv_refresh values are rejected with a 400 before any work starts."""
+    assert parse_run_options(None) == {'max_workers': main.MAX_WORKERS, 'load_mode': main.LOAD_MODE,
+                                       'refresh_mode': main.MV_REFRESH_MODE}
+    assert parse_run_options({'max_workers': '8', 'load_mode': 'consolidated', 'mv_refresh': 'incremental'}) == \
+        {'max_workers': 8, 'load_mode': 'consolidated', 'refresh_mode': 'incremental'}
+    assert parse_run_options({'max_workers': 100000})['max_workers'] == main.MAX_WORKERS_LIMIT
+
+    for body in [{'max_workers': 'lots'}, {'max_workers': 0}, {'max_workers': -2}, {'max_workers': 2.5},
+                 {'max_workers': True}, {'max_workers': None}, {'load_mode': 'consolidate'},
+                 {'mv_refresh': 'incremntal'}, {'mv_refresh': None}]:
+        try:
+            parse_run_options(body)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"{body!r} was accepted")
+
+        # Rejected before the Drive and BigQuery clients are created
+        message, status = process_homebase_files(FakeHttpRequest(body))
+        assert status == 400 and list(body)[0] in message
+
+if __name__ == "__main__":
+    test_refresh_runs_once_per_batch()
+    test_refresh_skipped_when_nothing_loaded()
+    test_incremental_refresh_replaces_loaded_periods()
+    test_incremental_refresh_falls_back_to_rebuild()
+    test_incremental_refresh_with_empty_export()
+    test_load_consolidated_replaces_location_in_period()
+    test_failed_consolidated_load_keeps_existing_rows()
+    test_ledger_skips_unchanged_files()
+    test_move_files_in_one_batch()
+    test_failed_batch_falls_back_to_copies()
+    test_move_errors_do_not_stop_refresh_or_ledger()
+    test_listing_follows_page_tokens()
+    test_modified_after_must_be_a_timestamp()
+    test_run_options_are_validated()
+    print("All tests passed")
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Offline replay benchmark for the Referrizer scraper.
+Serves the fixture contact pages, or recorded ones from --pages-dir, from a
+local server with a configurable latency and jitter, and scrapes them with
+headless Chrome. The "view more" fields can be made to arrive after the click
+and every 10th/4th contact is missing a field, so the waits in
+get_contact_details are exercised like on the live app.
+
+Two targets:
+  contacts  scrape_contacts with already started browsers, the scrape loop only
+  main      the whole main(), from browser startup to the MERGE, with BigQuery stubbed
+
+Reports contacts per minute, CPU seconds and peak RSS of Chrome and of this
+process, per-contact latency percentiles and the run's phase timings, and
+writes them to a JSON file. With --baseline a previous results file is
+compared and a drop in contacts per minute beyond --tolerance fails the run.
+
+Needs Chrome and chromedriver (set CHROMEDRIVER_PATH, and CHROME_BINARY if
+Chrome is not installed) and psutil.
+
+Usage: python benchmark_replay.py [--contacts 100] [--workers 1 2 4] [--latency-ms 150]
+                                  [--jitter-ms 100] [--view-more-delay-ms 300] [--target contacts]
+                                  [--output replay-results.json] [--baseline old-results.json]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+from datetime import datetime, timezone
+import pandas as pd
+import psutil
+
+import main as scraper
+from fixture_site import CONTACTS, SESSION_COOKIE, FixtureSite
+
+class ResourceSampler:
+    """Samples CPU time and RSS of this process and of chromedriver and Chrome under it."""
+
+    def __init__(self, interval=0.1):
+        self.process = psutil.Process()
+        self.interval = interval
+        self.cpu_start = self.cpu_seconds(self.process)
+        # Last CPU time seen per child, so browsers that exit mid-run still count
+        self.child_cpu = {}
+        self.peak_browser_rss = 0
+        self.peak_python_rss = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    @staticmethod
+    def cpu_seconds(process):
+        times = process.cpu_times()
+        return times.user + times.system
+
+    def sample(self):
+        browser_rss = 0
+        for child in self.process.children(recursive=True):
+            try:
+                self.child_cpu[child.pid] = self.cpu_seconds(child)
+                browser_rss += child.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        self.peak_browser_rss = max(self.peak_browser_rss, browser_rss)
+        self.peak_python_rss = max(self.peak_python_rss, self.process.memory_info().rss)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self.child_cpu_start = dict(self.child_cpu)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+    def result(self):
+        browser_cpu = sum(cpu - self.child_cpu_start.get(pid, 0) for pid, cpu in self.child_cpu.items())
+        return {
+            'python_cpu_seconds': round(self.cpu_seconds(self.process) - self.cpu_start, 2),
+            'browser_cpu_seconds': round(browser_cpu, 2),
+            'peak_browser_rss_mb': round(self.peak_browser_rss / (1024 * 1024)),
+            'peak_python_rss_mb': round(self.peak_python_rss / (1024 * 1024)),
+        }
+
+class ReplayJob:
+    def __init__(self, df=None):
+        self.df = df
+
+    def result(self):
+        return self
+
+    def to_dataframe(self):
+        return self.df if self.df is not None else pd.DataFrame()
+
+class ReplayBigQueryClient:
+    """Hands out the replayed contact IDs and accepts loads and queries without a network."""
+
+    def __init__(self, contact_ids):
+        self.contact_ids = contact_ids
+        self.loaded_rows = 0
+
+    def query(self, sql, job_config=None):
+        if 'ret_clients' in sql:
+            return ReplayJob(pd.DataFrame({'id': self.contact_ids, 'lastVisitDate': None}))
+        return ReplayJob()
+
+    def load_table_from_dataframe(self, df, table_id, job_config=None):
+        self.loaded_rows += len(df)
+        return ReplayJob()
+
+    def load_table_from_json(self, rows, table_id, job_config=None):
+        return ReplayJob()
+
+class ReplayRequest:
+    """Stands in for the flask.Request that main reads its options from."""
+
+    def __init__(self, options):
+        self.options = options
+
+    def get_json(self, silent=False):
+        return self.options
+
+def saved_session_state():
+    """A session with the fixture's login cookie, so no run has to log in."""
+    return {'cookies': [{'name': SESSION_COOKIE[0], 'value': SESSION_COOKIE[1], 'path': '/'}],
+            'local_storage': {}}
+
+def restart_browser(driver):
+    """Replace a dead browser the way BrowserManager.replace does, outside the shared manager."""
+    try:
+        driver.quit()
+    except Exception:
+        pass
+    new_driver = scraper.create_chrome_driver(remote_debugging=False)
+    scraper.restore_session_state(new_driver, saved_session_state())
+    return new_driver
+
+def run_contacts(contact_ids, workers):
+    """Scrape with started, logged-in browsers: the scrape loop without startup or MERGE."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        drivers = [scraper.create_chrome_driver(remote_debugging=False) for _ in range(workers)]
+    try:
+        for driver in drivers:
+            scraper.restore_session_state(driver, saved_session_state())
+        bq_client = ReplayBigQueryClient(contact_ids)
+        uploader = scraper.StagingUploader('replay', datetime.now(timezone.utc), bq_client)
+        supervisor = scraper.ScrapeSupervisor(restart_browser)
+        scraper.run_timer.reset()
+        with ResourceSampler() as sampler, contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            scraped, failed_contact_ids = scraper.scrape_contacts(drivers, contact_ids, uploader,
+                                                                  supervisor=supervisor)
+            uploader.flush()
+            elapsed = time.perf_counter() - start
+    finally:
+        for driver in drivers:
+            driver.quit()
+    return {
+        'scraped': scraped,
+        'failed': len(failed_contact_ids),
+        'elapsed_seconds': round(elapsed, 2),
+        **sampler.result(),
+        'latency': supervisor.metrics.summary(),
+        'phases': scraper.run_timer.summary(),
+    }
+
+def run_main(contact_ids, workers):
+    """Run the whole main() against the replay site with BigQuery stubbed out."""
+    bq_client = ReplayBigQueryClient(contact_ids)
+    scraper.set_bigquery_client(bq_client)
+    scraper._schedule_table_ready = False
+    output = io.StringIO()
+    with tempfile.TemporaryDirectory() as state_dir:
+        # The session and checkpoint live in a throwaway directory
+        scraper.SESSION_BUCKET = None
+        scraper.SESSION_DIR = state_dir
+        scraper.LocalStateStore(state_dir).save(saved_session_state())
+        try:
+            with ResourceSampler() as sampler, contextlib.redirect_stdout(output):
+                start = time.perf_counter()
+                response = scraper.main(ReplayRequest({'workers': workers}))
+                elapsed = time.perf_counter() - start
+        finally:
+            with contextlib.redirect_stdout(io.StringIO()):
+                scraper.browser_manager.shutdown()
+            scraper.set_bigquery_client(None)
+
+    # main logs its run report as the last JSON line
+    report = {}
+    for line in output.getvalue().splitlines():
+        if line.startswith('{') and '"severity"' in line:
+            report = json.loads(line)
+    contacts = report.get('contacts', {})
+    return {
+        'response': response if isinstance(response, str) else list(response),
+        'scraped': bq_client.loaded_rows,
+        'failed': len(contact_ids) - bq_client.loaded_rows,
+        'elapsed_seconds': round(elapsed, 2),
+        **sampler.result(),
+        'latency': contacts,
+        'phases': report.get('phases', {}),
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_with_baseline(results, baseline_path, tolerance):
+    """Print the change in contacts/min per worker count; True when none dropped beyond the tolerance."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    baseline_runs = {run['workers']: run for run in baseline['runs'] if run['target'] == results['config']['target']}
+    passed = True
+    for run in results['runs']:
+        old = baseline_runs.get(run['workers'])
+        if not old:
+            continue
+        change = run['contacts_per_minute'] / old['contacts_per_minute'] - 1
+        regressed = change < -tolerance
+        passed = passed and not regressed
+        print(f"{run['workers']} workers vs baseline {baseline.get('git_commit')}: {change:+.0%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return passed
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay benchmark for the Referrizer scraper")
+    parser.add_argument('--contacts', type=int, default=100, help="contacts per run")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2], help="browser worker counts to run")
+    parser.add_argument('--target', choices=['contacts', 'main'], default='contacts')
+    parser.add_argument('--latency-ms', type=int, default=150, help="contact page latency")
+    parser.add_argument('--jitter-ms', type=int, default=100, help="random extra page latency, up to this")
+    parser.add_argument('--asset-latency-ms', type=int, default=50)
+    parser.add_argument('--view-more-delay-ms', type=int, default=300,
+                        help="delay before the view more fields appear; 0 has them in the page already")
+    parser.add_argument('--pages-dir', help="directory of recorded <contact_id>.html pages")
+    parser.add_argument('--scrape-profile', action='store_true', help="use the lightweight Chrome profile")
+    parser.add_argument('--output', default='replay-results.json')
+    parser.add_argument('--baseline', help="previous results file to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="allowed drop in contacts/min")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    os.environ['USE_HEADLESS'] = 'true'
+    scraper.SCRAPE_PROFILE = args.scrape_profile
+    contact_ids = list(CONTACTS)[:args.contacts]
+    run = run_main if args.target == 'main' else run_contacts
+
+    print(f"=== Replaying {len(contact_ids)} contacts ({args.target}), {args.latency_ms}ms latency, "
+          f"{args.jitter_ms}ms jitter, view more after {args.view_more_delay_ms}ms ===")
+    results = {
+        'benchmark': 'replay',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_commit': git_commit(),
+        'host': {'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'runs': [],
+    }
+    with FixtureSite(asset_latency=args.asset_latency_ms / 1000, page_latency=args.latency_ms / 1000,
+                     jitter=args.jitter_ms / 1000, view_more_delay_ms=args.view_more_delay_ms,
+                     pages_dir=args.pages_dir) as site:
+        scraper.REFERRIZER_BASE_URL = site.url
+        for workers in args.workers:
+            result = run(contact_ids, workers)
+            result = {'target': args.target, 'workers': workers,
+                      'contacts_per_minute': round(result['scraped'] / result['elapsed_seconds'] * 60, 1),
+                      **result}
+            results['runs'].append(result)
+            print(f"{workers} workers: {result['contacts_per_minute']:.0f} contacts/min, "
+                  f"p95 {result['latency'].get('latency_p95_seconds')}s, "
+                  f"CPU {result['browser_cpu_seconds']:.0f}s Chrome + {result['python_cpu_seconds']:.0f}s Python, "
+                  f"peak RSS {result['peak_browser_rss_mb']}MB Chrome, {result['failed']} failed")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline and not compare_with_baseline(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
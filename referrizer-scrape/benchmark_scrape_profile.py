@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the lightweight scrape profile in create_chrome_driver.
+Scrapes the local fixture contact pages with headless Chrome, once with the
+default profile and once with the scrape profile, and reports pages per
+minute and the peak RSS of the browser process tree.
+
+Needs Chrome and chromedriver (set CHROMEDRIVER_PATH, and CHROME_BINARY if
+Chrome is not installed) and psutil.
+
+Usage: python benchmark_scrape_profile.py [pages] [asset_latency_ms]
+"""
+
+import io
+import os
+import sys
+import time
+import threading
+import contextlib
+import psutil
+
+import main as scraper
+from fixture_site import CONTACTS, FixtureSite
+
+class PeakRssSampler:
+    """Samples the RSS of chromedriver and every Chrome process it started."""
+
+    def __init__(self, pid, interval=0.1):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def sample(self):
+        total = 0
+        for process in [self.process] + self.process.children(recursive=True):
+            try:
+                total += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        self.peak = max(self.peak, total)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+def run(site, contact_ids, scrape_profile):
+    scraper.REFERRIZER_BASE_URL = site.url
+    with contextlib.redirect_stdout(io.StringIO()):
+        driver = scraper.create_chrome_driver(remote_debugging=False, scrape_profile=scrape_profile)
+    try:
+        with PeakRssSampler(driver.service.process.pid) as sampler:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for contact_id in contact_ids:
+                    scraper.get_contact_details(driver, contact_id)
+            elapsed = time.perf_counter() - start
+    finally:
+        driver.quit()
+    return len(contact_ids) / elapsed * 60, sampler.peak / (1024 * 1024)
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    asset_latency_ms = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    os.environ['USE_HEADLESS'] = 'true'
+
+    print(f"=== Benchmarking scrape profile on {pages} pages, {asset_latency_ms}ms asset latency ===")
+    contact_ids = list(CONTACTS)[:pages]
+    with FixtureSite(asset_latency=asset_latency_ms / 1000) as site:
+        default_rate, default_rss = run(site, contact_ids, scrape_profile=False)
+        print(f"Default profile:  {default_rate:.0f} pages/min, peak RSS {default_rss:.0f}MB")
+
+        profile_rate, profile_rss = run(site, contact_ids, scrape_profile=True)
+        print(f"Scrape profile:   {profile_rate:.0f} pages/min, peak RSS {profile_rss:.0f}MB")
+
+    print(f"Speedup:          {profile_rate / default_rate:.1f}x")
+    print(f"Memory saved:     {default_rss - profile_rss:.0f}MB per browser")
+
+if __name__ == "__main__":
+    main()
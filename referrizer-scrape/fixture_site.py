@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Referrizer contact details pages.
+Serves static HTML with the same data-qa selectors as the live app, so the
+scraper can be tested and benchmarked without logging in to Referrizer.
+Contact pages also pull in images, a web font, an analytics script and a
+chat widget script from another origin, like the live app, which the
+lightweight scrape profile blocks.
+
+Pages can be served with a latency and jitter, with the "view more" fields
+only added to the page some time after the click, and from a directory of
+recorded pages (<contact_id>.html) in place of the generated ones.
+
+Usage: python fixture_site.py [port]
+"""
+
+import os
+import sys
+import time
+import random
+import zlib
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def fixture_contact(i):
+    """Every 10th contact has no POW integration and every 4th has never responded."""
+    pow_id = None if i % 10 == 9 else str(50000 + i)
+    last_responded = None if i % 4 == 3 else f"04/{i % 28 + 1:02d}/2025"
+    return pow_id, f"05/{i % 28 + 1:02d}/2025", last_responded
+
+# contact_id -> (pow_id, last contacted, last responded); None is a missing field
+CONTACTS = {str(1000 + i): fixture_contact(i) for i in range(500)}
+
+# Cookie that the fixture treats as a logged-in session
+SESSION_COOKIE = ('referrizer_session', 'valid')
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html>
+<body>
+<form>
+  <input id="username"><input id="password" type="password">
+  <button type="submit">Log in</button>
+</form>
+</body>
+</html>
+"""
+
+CONTACTS_PAGE = """<!DOCTYPE html>
+<html><body><div data-qa="contacts-list">Contacts</div></body></html>
+"""
+
+CONTACT_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<title>Contact details</title>
+<link rel="stylesheet" href="/assets/styles.css">
+<script async src="/assets/analytics.js"></script>
+<script async src="{widget_origin}/assets/widget.js"></script>
+</head>
+<body>
+<div data-qa="contact-basic-info">
+  <img src="/assets/avatar.png?contact={contact_id}" width="160" height="160">
+  <h1>Contact {contact_id}</h1>
+  {pow_id_field}
+  <button data-qa="contact-basic-info-customer-fields-view-more-button"
+          onclick="{view_more_onclick}">View more</button>
+  {customer_fields_block}
+</div>
+<div class="gallery">
+  <img src="/assets/banner.png?contact={contact_id}"><img src="/assets/photo-1.png?contact={contact_id}">
+  <img src="/assets/photo-2.png?contact={contact_id}"><img src="/assets/photo-3.png?contact={contact_id}">
+</div>
+</body>
+</html>
+"""
+
+def solid_png(width, height):
+    """A valid PNG that is small on the wire but large once decoded."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    rows = b''.join(b'\x00' + b'\x80\x40\x20' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+# Stands in for a third-party tracker: allocates and computes on every page
+ANALYTICS_JS = """
+(function () {
+    var events = [];
+    for (var i = 0; i < 200000; i++) { events.push({id: i, at: Date.now(), path: location.pathname + i}); }
+    window.__analytics = events.length;
+})();
+"""
+
+# Stands in for a third-party chat widget, served from the fixture's other origin
+WIDGET_JS = """
+(function () {
+    var messages = [];
+    for (var i = 0; i < 200000; i++) { messages.push({id: i, text: 'message ' + i}); }
+    window.__widget = messages.length;
+})();
+"""
+
+STYLES_CSS = """
+@font-face { font-family: "Fixture Sans"; src: url("/assets/font.woff2") format("woff2"); }
+body { font-family: "Fixture Sans", sans-serif; }
+"""
+
+ASSETS = {
+    'styles.css': ('text/css', STYLES_CSS.encode('utf-8')),
+    'analytics.js': ('application/javascript', ANALYTICS_JS.encode('utf-8')),
+    'widget.js': ('application/javascript', WIDGET_JS.encode('utf-8')),
+    'font.woff2': ('font/woff2', bytes(range(256)) * 400),
+    'avatar.png': ('image/png', solid_png(640, 640)),
+    'banner.png': ('image/png', solid_png(1920, 600)),
+    'photo-1.png': ('image/png', solid_png(1280, 960)),
+    'photo-2.png': ('image/png', solid_png(1280, 960)),
+    'photo-3.png': ('image/png', solid_png(1280, 960)),
+}
+
+def field_html(data_qa, value):
+    if value is None:
+        return ''
+    return f'<span data-qa="{data_qa}">{value}</span>'
+
+# "View more" that only reveals fields already in the page
+SHOW_FIELDS_ONCLICK = "document.getElementById('customer-fields').style.display = 'block'"
+SHOWN_FIELDS_BLOCK = '<div id="customer-fields" style="display: none">{customer_fields}</div>'
+
+# "View more" that fetches the fields, like the live app: they are added after a delay
+LOAD_FIELDS_ONCLICK = ("setTimeout(function () {{ document.getElementById('customer-fields').appendChild("
+                       "document.getElementById('customer-fields-template').content.cloneNode(true)); }}, {delay_ms})")
+LOADED_FIELDS_BLOCK = ('<div id="customer-fields"></div>'
+                       '<template id="customer-fields-template">{customer_fields}</template>')
+
+def render_contact_page(contact_id, view_more_delay_ms=0, widget_origin=''):
+    """
+    HTML of a contact details page, or None for an unknown contact.
+    With view_more_delay_ms the "view more" fields are only in the page that
+    long after the button is clicked. widget_origin is where the chat widget
+    script comes from, another origin than the page's.
+    """
+    if contact_id not in CONTACTS:
+        return None
+    pow_id, last_contacted, last_responded = CONTACTS[contact_id]
+    customer_fields = (field_html('contact-basic-info-customer-fields-contact-last-contacted-date', last_contacted)
+                       + field_html('contact-basic-info-customer-fields-contact-last-responded-date', last_responded))
+    if view_more_delay_ms:
+        onclick = LOAD_FIELDS_ONCLICK.format(delay_ms=int(view_more_delay_ms))
+        block = LOADED_FIELDS_BLOCK.format(customer_fields=customer_fields)
+    else:
+        onclick = SHOW_FIELDS_ONCLICK
+        block = SHOWN_FIELDS_BLOCK.format(customer_fields=customer_fields)
+    return CONTACT_PAGE.format(
+        contact_id=contact_id,
+        widget_origin=widget_origin,
+        pow_id_field=field_html('contact-basic-info-integration-pow-id', pow_id),
+        view_more_onclick=onclick,
+        customer_fields_block=block,
+    )
+
+def load_recorded_page(pages_dir, contact_id):
+    """A recorded contact page from pages_dir, or None when there is none."""
+    if not pages_dir or not contact_id.isdigit():
+        return None
+    try:
+        with open(os.path.join(pages_dir, f"{contact_id}.html"), encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def logged_in(self):
+        return '='.join(SESSION_COOKIE) in self.headers.get('Cookie', '')
+
+    def wait_like_the_app(self):
+        """Delay a page by the latency plus up to the jitter."""
+        delay = self.server.page_latency + random.uniform(0, self.server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        content_type = 'text/html; charset=utf-8'
+        if len(parts) == 2 and parts[0] == 'assets' and parts[1] in ASSETS:
+            # Assets come from a slower CDN
+            time.sleep(self.server.asset_latency)
+            content_type, content = ASSETS[parts[1]]
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+        elif len(parts) == 3 and parts[0] == 'contacts' and parts[2] == 'details':
+            self.wait_like_the_app()
+            body = (load_recorded_page(self.server.pages_dir, parts[1])
+                    or render_contact_page(parts[1], self.server.view_more_delay_ms, self.server.widget_origin))
+        elif parts == ['contacts']:
+            body = CONTACTS_PAGE if self.logged_in() else LOGIN_PAGE
+        elif parts == ['']:
+            body = LOGIN_PAGE
+        else:
+            body = None
+
+        if body is None:
+            self.send_error(404)
+            return
+        content = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+class FixtureSite:
+    """
+    Serves the fixture pages from a background thread.
+
+    Args:
+        port (int): Port to listen on; 0 picks a free one.
+        asset_latency (float): Seconds before each image, font or script is served.
+        page_latency (float): Seconds before each contact page.
+        jitter (float): Up to this many extra seconds, at random, on top of page_latency.
+        view_more_delay_ms (int): When set, "view more" adds its fields this long after the click.
+        pages_dir (str, optional): Directory of recorded <contact_id>.html pages served instead.
+    """
+
+    def __init__(self, port=0, asset_latency=0.0, page_latency=0.0, jitter=0.0, view_more_delay_ms=0,
+                 pages_dir=None):
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), FixtureHandler)
+        self.server.asset_latency = asset_latency
+        self.server.page_latency = page_latency
+        self.server.jitter = jitter
+        self.server.view_more_delay_ms = view_more_delay_ms
+        self.server.pages_dir = pages_dir
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        # The same server under another host name, a different origin for the browser
+        self.server.widget_origin = f"http://localhost:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    with FixtureSite(port) as site:
+        print(f"Serving fixture contact pages at {site.url}/contacts/<id>/details")
+        site.thread.join()
@@ -1,29 +1,342 @@
 
 import requests
+import os
+import json
 import sys
+import math
+import queue
+import atexit
+import signal
+import threading
+import uuid
+import ipaddress
+import urllib3
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import trio
 from bs4 import BeautifulSoup
 import time
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import InvalidSessionIdException, NoSuchWindowException, TimeoutException
 import pandas as pd
-import pandas_gbq
 from google.cloud import bigquery
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import NamedTuple
+from collections import Counter, defaultdict
+from contextlib import contextmanager
 from selenium.webdriver.chrome.options import Options
 
 
 
 
 bq_pow_mapping_table_id = 'tys-bi.referrizer.pow_mapping'
-bq_pow_mapping_staging_table_id = 'tys-bi.referrizer.pow_mapping_staging' 
+bq_pow_mapping_staging_table_id = 'tys-bi.referrizer.pow_mapping_run_staging' 
+bq_scrape_schedule_table_id = 'tys-bi.referrizer.pow_mapping_scrape_schedule'
+
+# Contact selection: never-scraped contacts first, then ones not scraped within the TTL.
+# The TTL doubles for each consecutive scrape that found no POW ID.
+CONTACT_LIMIT = int(os.environ.get('REFERRIZER_CONTACT_LIMIT', 500))
+RESCRAPE_TTL_HOURS = int(os.environ.get('REFERRIZER_RESCRAPE_TTL_HOURS', 168))
+MAX_EMPTY_BACKOFF = int(os.environ.get('REFERRIZER_MAX_EMPTY_BACKOFF', 4))
+
+REFERRIZER_BASE_URL = os.environ.get('REFERRIZER_BASE_URL', 'https://app.referrizer.com')
+
+# Browser pool sizing; each headless Chrome needs roughly this much memory
+BROWSER_WORKERS = os.environ.get('REFERRIZER_BROWSER_WORKERS')
+BROWSER_MEMORY_MB = int(os.environ.get('REFERRIZER_BROWSER_MEMORY_MB', 450))
+# Scraped rows are appended to staging in batches, and merged once per run
+UPLOAD_BATCH_SIZE = int(os.environ.get('REFERRIZER_UPLOAD_BATCH_SIZE', 500))
+UPLOAD_FLUSH_SECONDS = float(os.environ.get('REFERRIZER_UPLOAD_FLUSH_SECONDS', 300))
+STAGING_EXPIRATION_DAYS = 7
+
+# Browsers are kept across warm invocations until they hit one of these limits
+BROWSER_MAX_PAGES = int(os.environ.get('REFERRIZER_BROWSER_MAX_PAGES', 1000))
+BROWSER_MAX_RSS_MB = int(os.environ.get('REFERRIZER_BROWSER_MAX_RSS_MB', 1200))
+
+# Lightweight scrape profile: eager page loads, capped JS heap and renderer
+# processes, and no images, fonts, media, analytics or third-party scripts
+SCRAPE_PROFILE = os.environ.get('REFERRIZER_SCRAPE_PROFILE', '').lower() in ('1', 'true', 'yes')
+JS_HEAP_MB = int(os.environ.get('REFERRIZER_JS_HEAP_MB', 256))
+RENDERER_PROCESS_LIMIT = int(os.environ.get('REFERRIZER_RENDERER_PROCESS_LIMIT', 2))
+BLOCKED_URL_PATTERNS = [
+    # Images, fonts and media
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.mp4', '*.webm', '*.mp3', '*.wav',
+    # Analytics, tag managers and chat widgets
+    '*analytics.js*', '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+    '*connect.facebook.net*', '*hotjar.com*', '*fullstory.com*', '*segment.io*', '*segment.com*',
+    '*intercom.io*', '*intercomcdn.com*', '*mixpanel.com*', '*heap.io*', '*clarity.ms*',
+]
+# Scripts load only from the app's own site, plus these hosts (comma separated),
+# e.g. a CDN that serves the app's bundle
+FIRST_PARTY_SCRIPT_HOSTS = [host.strip() for host in os.environ.get('REFERRIZER_SCRIPT_HOSTS', '').split(',')
+                            if host.strip()]
+
+# Saved login session and run checkpoint; a GCS bucket when configured, otherwise a local directory
+SESSION_BUCKET = os.environ.get('REFERRIZER_SESSION_BUCKET')
+SESSION_DIR = os.environ.get('REFERRIZER_SESSION_DIR', '/tmp/referrizer-session')
+SESSION_FILE_NAME = 'referrizer-session.json'
+CHECKPOINT_FILE_NAME = 'referrizer-checkpoint.json'
+# A checkpoint older than this is from an earlier day's contact selection
+CHECKPOINT_MAX_AGE_HOURS = 12
+# Scraped rows waiting for their staging batch are saved with the checkpoint
+# at most this often, which bounds what a crash loses between loads
+CHECKPOINT_SAVE_SECONDS = float(os.environ.get('REFERRIZER_CHECKPOINT_SAVE_SECONDS', 10))
+# How long a loaded /contacts page is watched for the app sending it to the login form
+SESSION_CHECK_SECONDS = 2
+
+# Verification codes are written to this table with the time they arrived
+VERIFICATION_CODE_TABLE_ID = 'tys-bi.referrizer.verification_code'
+VERIFICATION_CODE_TIMESTAMP_COLUMN = 'received_at'
+VERIFICATION_TIMEOUT_SECONDS = int(os.environ.get('REFERRIZER_VERIFICATION_TIMEOUT', 180))
+VERIFICATION_POLL_INITIAL_SECONDS = 2
+VERIFICATION_POLL_MAX_SECONDS = 20
+
+# Fields read from the contact details page
+CONTACT_FIELD_SELECTORS = {
+    'pow_id': '[data-qa="contact-basic-info-integration-pow-id"]',
+    'last_time_account_dir_comm': '[data-qa="contact-basic-info-customer-fields-contact-last-contacted-date"]',
+    'last_time_contact_dir_comm': '[data-qa="contact-basic-info-customer-fields-contact-last-responded-date"]',
+}
+VIEW_MORE_BUTTON_SELECTOR = 'button[data-qa="contact-basic-info-customer-fields-view-more-button"]'
+DETAILS_PANEL_SELECTOR = '[data-qa^="contact-basic-info"]'
+CONTACT_READY_TIMEOUT_SECONDS = 10
+# The page counts as settled when the details panel has not changed for this long
+CONTACT_SETTLE_MS = 500
+
+# Runs in the page: clicks "view more" once it renders and resolves with the
+# text of every field that is present, and when the click and the fields came. It resolves as soon as all fields are
+# found, or once the details panel is rendered, expanded and unchanged for
+# settleMs, or at the timeout.
+READ_CONTACT_FIELDS_JS = """
+var selectors = arguments[0], viewMoreSelector = arguments[1], panelSelector = arguments[2],
+    timeoutMs = arguments[3], settleMs = arguments[4], done = arguments[arguments.length - 1];
+var start = Date.now(), lastChange = start, clicked = false, viewMoreMs = null;
+var observer = new MutationObserver(function () { lastChange = Date.now(); });
+observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+
+function readFields() {
+    var fields = {}, found = 0, total = 0;
+    for (var name in selectors) {
+        total++;
+        var element = document.querySelector(selectors[name]);
+        var text = element ? (element.innerText || element.textContent || '').trim() : '';
+        if (text) { fields[name] = text; found++; }
+    }
+    return {fields: fields, complete: found === total};
+}
+
+function check() {
+    var button = document.querySelector(viewMoreSelector);
+    if (button && !clicked) {
+        button.click();
+        clicked = true;
+        lastChange = Date.now();
+        viewMoreMs = lastChange - start;
+    }
+    var result = readFields(), now = Date.now();
+    var settled = document.readyState !== 'loading' && document.querySelector(panelSelector) &&
+        (clicked || !button) && now - lastChange >= settleMs;
+    if (result.complete || settled || now - start >= timeoutMs) {
+        observer.disconnect();
+        done({fields: result.fields, timing: {viewMoreMs: viewMoreMs, readyMs: now - start}});
+    } else {
+        setTimeout(check, 50);
+    }
+}
+check();
+"""
+
+# Supervision of the scrape loop: a contact that takes longer than the budget
+# counts as a hung browser. Contacts lost to a dead or hung browser are retried
+# on a fresh one, up to MAX_CONTACT_ATTEMPTS times in all.
+CONTACT_BUDGET_SECONDS = float(os.environ.get('REFERRIZER_CONTACT_BUDGET_SECONDS', 60))
+PAGE_LOAD_TIMEOUT_SECONDS = 30
+MAX_CONTACT_ATTEMPTS = int(os.environ.get('REFERRIZER_MAX_CONTACT_ATTEMPTS', 3))
+# Errors whose message means the browser or its renderer is gone
+DEAD_SESSION_MARKERS = (
+    'invalid session id',
+    'timed out receiving message from renderer',
+    'chrome not reachable',
+    'session deleted',
+    'disconnected',
+    'tab crashed',
+)
+
+# Optional BigQuery table that gets one row per run with its timing report
+RUN_STATS_TABLE_ID = os.environ.get('REFERRIZER_RUN_STATS_TABLE')
+
+# One BigQuery client per process; credentials and connections are reused by every call
+BIGQUERY_CREDENTIALS = 'tys-bi.json'
+BIGQUERY_POOL_SIZE = 10
+
+_bigquery_client = None
+_bigquery_client_lock = threading.Lock()
+_schedule_table_ready = False
+
+# Set on SIGTERM, which Cloud Run sends shortly before it stops the container
+_shutdown_requested = threading.Event()
+_previous_sigterm_handler = None
+
+
+def _percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list, None when it is empty."""
+    if not sorted_values:
+        return None
+    # The smallest value with at least p% of the list at or below it
+    return sorted_values[max(0, math.ceil(p * len(sorted_values) / 100) - 1)]
+
+
+class RunTimer:
+    """
+    Collects how long each phase of a run takes, from any thread.
+    A span costs two perf_counter calls and a list append, so it stays on in production.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(list)
+
+    @contextmanager
+    def span(self, name):
+        """Time the body of a with block as one sample of phase name."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.durations[name].append(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.durations = defaultdict(list)
+
+    def summary(self):
+        """Count, total and p50/p95/p99/max seconds of every phase."""
+        with self.lock:
+            durations = {name: sorted(samples) for name, samples in self.durations.items()}
+        return {
+            name: {
+                'count': len(samples),
+                'total_seconds': round(sum(samples), 3),
+                'p50_seconds': round(_percentile(samples, 50), 3),
+                'p95_seconds': round(_percentile(samples, 95), 3),
+                'p99_seconds': round(_percentile(samples, 99), 3),
+                'max_seconds': round(samples[-1], 3),
+            }
+            for name, samples in durations.items()
+        }
+
+
+# Phases of the current run; main resets it at the start of each run
+run_timer = RunTimer()
+
+
+def create_bigquery_client():
+    """
+    BigQuery client on one authorized session with a keep-alive connection pool.
+    Uses the tys-bi.json service account when present, otherwise the default credentials.
+    """
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession
+    from google.oauth2 import service_account
+
+    scopes = ['https://www.googleapis.com/auth/cloud-platform']
+    if os.path.exists(BIGQUERY_CREDENTIALS):
+        credentials = service_account.Credentials.from_service_account_file(BIGQUERY_CREDENTIALS, scopes=scopes)
+        project = credentials.project_id
+    else:
+        credentials, project = google.auth.default(scopes=scopes)
+
+    session = AuthorizedSession(credentials)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=BIGQUERY_POOL_SIZE)
+    session.mount('https://', adapter)
+    return bigquery.Client(project=project, credentials=credentials, _http=session)
+
+
+def get_bigquery_client():
+    """BigQuery client shared by the whole process, created on first use."""
+    global _bigquery_client
+    if _bigquery_client is None:
+        with _bigquery_client_lock:
+            if _bigquery_client is None:
+                _bigquery_client = create_bigquery_client()
+    return _bigquery_client
+
+
+def set_bigquery_client(client):
+    """Replace the shared BigQuery client, e.g. with a fake in tests. None resets it."""
+    global _bigquery_client
+    with _bigquery_client_lock:
+        _bigquery_client = client
+
+
+class BigQueryVerificationCodeProvider:
+    """Reads verification codes from the verification_code table."""
+
+    def get_code(self, since):
+        """Return the newest code that arrived after `since`, or None."""
+        query = f"""
+        SELECT code
+        FROM `{VERIFICATION_CODE_TABLE_ID}`
+        WHERE {VERIFICATION_CODE_TIMESTAMP_COLUMN} > @since
+        ORDER BY {VERIFICATION_CODE_TIMESTAMP_COLUMN} DESC
+        LIMIT 1
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter('since', 'TIMESTAMP', since)]
+        )
+        for row in get_bigquery_client().query(query, job_config=job_config).result():
+            return row.code
+        return None
+
+
+def wait_for_verification_code(code_provider, since, timeout=VERIFICATION_TIMEOUT_SECONDS,
+                               initial_delay=VERIFICATION_POLL_INITIAL_SECONDS,
+                               max_delay=VERIFICATION_POLL_MAX_SECONDS):
+    """
+    Poll for a verification code with exponential backoff.
+
+    Args:
+        code_provider: Object with a get_code(since) method.
+        since (datetime): When the challenge appeared; older codes are ignored.
+        timeout (float): Seconds to wait before giving up.
+        initial_delay (float): Seconds between the first polls, doubled after each miss.
+        max_delay (float): Upper bound on the delay between polls.
+    Returns:
+        str: The verification code, or None if none arrived before the deadline.
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        try:
+            code = code_provider.get_code(since)
+            if code:
+                return code
+        except Exception as e:
+            print(f"Error checking for verification code: {e}")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
 
 
-def login_to_referrizer(driver):
+def login_to_referrizer(driver, code_provider=None):
+    if code_provider is None:
+        code_provider = BigQueryVerificationCodeProvider()
+
     ip_address = requests.get('https://www.curlmyip.org').text.replace('\n','')
     print(f"My IP address is {ip_address}")
-    driver.get("https://app.referrizer.com")
+    driver.get(REFERRIZER_BASE_URL)
 
     # Wait for and fill login form
     try:
@@ -35,7 +348,8 @@ def login_to_referrizer(driver):
         password = driver.find_element(By.ID, "password")
         password.send_keys("6629")
         
-        # Submit login form
+        # Submit login form; a verification code sent for this login arrives after this point
+        challenge_time = datetime.now(timezone.utc)
         submit_button = driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
         submit_button.click()
     except Exception as e:
@@ -51,20 +365,11 @@ def login_to_referrizer(driver):
         verification_element = WebDriverWait(driver, 10).until(
             EC.presence_of_element_located((By.XPATH, "//*[@id='verification-code']"))
         )
-        print('Waiting for 100 seconds for verification code')
-        time.sleep(100)
-
-        # If element exists, query BigQuery for verification code
-        bigquery_credentials = 'tys-bi.json'
-        bigquery_client = bigquery.Client.from_service_account_json(bigquery_credentials)
-        query = """ SELECT code FROM `tys-bi.referrizer.verification_code` """
+        print(f"Waiting up to {VERIFICATION_TIMEOUT_SECONDS} seconds for verification code")
 
-        # Execute query and get verification code
-        results = bigquery_client.query(query).result()
-        verification_code = None
-        for row in results:
-            verification_code = row.code
-            break
+        # Only a code that arrived after this login's challenge is accepted
+        with run_timer.span('verification_wait'):
+            verification_code = wait_for_verification_code(code_provider, challenge_time)
 
         if verification_code:
             # Enter verification code
@@ -84,44 +389,172 @@ def login_to_referrizer(driver):
         pass
 
 
-def get_contact_ids():
-    bigquery_credentials = 'tys-bi.json'
-
-    bigquery_client = bigquery.Client.from_service_account_json(bigquery_credentials)
+def ensure_scrape_schedule_table(bq_client):
+    """Create the scrape schedule table on first use, with pow_mapping's contact_id type."""
+    global _schedule_table_ready
+    if _schedule_table_ready:
+        return
+    bq_client.query(f"""
+    CREATE TABLE IF NOT EXISTS `{bq_scrape_schedule_table_id}` AS
+    SELECT contact_id,
+           CAST(NULL AS TIMESTAMP) AS last_scraped_at,
+           0 AS attempts,
+           CAST(NULL AS STRING) AS last_result
+    FROM `{bq_pow_mapping_table_id}`
+    WHERE FALSE
+    """).result()
+    _schedule_table_ready = True
+
+
+def get_contact_ids(limit=CONTACT_LIMIT, ttl_hours=RESCRAPE_TTL_HOURS, max_backoff=MAX_EMPTY_BACKOFF, bq_client=None):
+    """
+    Pick the contacts most likely to have changed since they were last scraped.
+    Contacts that were never scraped come first, then contacts scraped before
+    the schedule existed, then contacts whose last scrape is older than the
+    TTL. The TTL doubles with each consecutive empty result, up to
+    2**max_backoff times, so contacts without a POW ID are retried less often.
 
-    # Looking up by ids from the ret_clients table?
+    Args:
+        limit (int): Maximum number of contacts.
+        ttl_hours (int): Hours before a scraped contact is due again.
+        max_backoff (int): Cap on the doubling of the TTL.
+        bq_client (bigquery.Client, optional): Defaults to get_bigquery_client().
+    Returns:
+        pandas.DataFrame: Columns id and lastVisitDate.
+    """
+    if bq_client is None:
+        bq_client = get_bigquery_client()
+    ensure_scrape_schedule_table(bq_client)
 
     query = f"""
-    SELECT DISTINCT id, lastVisitDate
-    FROM `tys-bi.referrizer.ret_clients` r
+    SELECT id, lastVisitDate
+    FROM (
+      SELECT DISTINCT id, lastVisitDate
+      FROM `tys-bi.referrizer.ret_clients`
+      WHERE partition_date = date_add(CURRENT_DATE('America/Chicago'), interval -1 day)
+    ) r
     left join `{bq_pow_mapping_table_id}` m on m.contact_id = r.id
-    WHERE partition_date = date_add(CURRENT_DATE('America/Chicago'), interval -1 day)
-    and (m.contact_id is null or m.pow_id is null)
-    ORDER BY lastVisitDate desc
-    LIMIT 500
-    """
-    return bigquery_client.query(query).to_dataframe()
-
-def upload_to_gbq(df):
-    pandas_gbq.to_gbq(
-        df,
-        destination_table=bq_pow_mapping_staging_table_id,
-        project_id='tys-bi',
-        if_exists='replace'
-    )
-    print("Data successfully uploaded to BigQuery")
+    left join `{bq_scrape_schedule_table_id}` s on s.contact_id = r.id
+    WHERE s.contact_id is null
+       or s.last_scraped_at < timestamp_sub(
+            CURRENT_TIMESTAMP(),
+            interval cast(@ttl_hours * pow(2, least(if(s.last_result = 'empty', s.attempts, 0), @max_backoff)) as int64) hour)
+    ORDER BY case
+               when m.contact_id is null and s.contact_id is null then 0
+               when s.contact_id is null then 1
+               else 2
+             end,
+             s.last_scraped_at,
+             lastVisitDate desc
+    LIMIT @limit
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('ttl_hours', 'INT64', ttl_hours),
+        bigquery.ScalarQueryParameter('max_backoff', 'INT64', max_backoff),
+        bigquery.ScalarQueryParameter('limit', 'INT64', limit),
+    ])
+    return bq_client.query(query, job_config=job_config).to_dataframe()
+
+
+def update_scrape_schedule(run_id, run_started, bq_client=None):
+    """
+    Record when each contact of a run was scraped and whether it had a POW ID.
+    attempts counts consecutive scrapes without a POW ID and drives the backoff.
+    Contacts that failed to scrape are not recorded, so the next run retries them.
+    """
+    if bq_client is None:
+        bq_client = get_bigquery_client()
+    ensure_scrape_schedule_table(bq_client)
+
+    query = f"""
+    MERGE `{bq_scrape_schedule_table_id}` T
+    USING (
+      -- Runs after the run's MERGE, so a contact with a known POW ID counts as
+      -- found even when this scrape did not see it
+      SELECT s.contact_id, max(s.scraped_at) AS scraped_at,
+             logical_or(s.pow_id != '-' or m.pow_id is not null) AS found
+      FROM `{bq_pow_mapping_staging_table_id}` s
+      left join `{bq_pow_mapping_table_id}` m on m.contact_id = s.contact_id
+      WHERE s.run_id = @run_id AND s.scraped_at >= @run_started
+      GROUP BY s.contact_id
+    ) S
+    ON T.contact_id = S.contact_id
+    WHEN MATCHED THEN
+      UPDATE SET last_scraped_at = S.scraped_at,
+                 attempts = if(S.found, 0, T.attempts + 1),
+                 last_result = if(S.found, 'found', 'empty')
+    WHEN NOT MATCHED THEN
+      INSERT (contact_id, last_scraped_at, attempts, last_result)
+      VALUES (S.contact_id, S.scraped_at, if(S.found, 0, 1), if(S.found, 'found', 'empty'))
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('run_id', 'STRING', run_id),
+        bigquery.ScalarQueryParameter('run_started', 'TIMESTAMP', run_started),
+    ])
+    bq_client.query(query, job_config=job_config).result()
+    print("Scrape schedule updated")
+
+
+class ContactRecord(NamedTuple):
+    """One scraped contact, in the column order of the staging table."""
+    contact_id: str
+    pow_id: str
+    last_time_account_dir_comm: str
+    last_time_contact_dir_comm: str
+
+
+class ContactBuffer:
+    """Collects ContactRecords as plain column lists until they are loaded."""
+
+    def __init__(self):
+        self.columns = {field: [] for field in ContactRecord._fields}
+        self._appenders = [self.columns[field].append for field in ContactRecord._fields]
+
+    def __len__(self):
+        return len(self.columns['contact_id'])
+
+    def append(self, record):
+        for append, value in zip(self._appenders, record):
+            append(value)
+
+    def to_dataframe(self):
+        """Build the DataFrame of everything buffered, in one step."""
+        return pd.DataFrame(self.columns, columns=list(ContactRecord._fields))
+
+    def clear(self):
+        for column in self.columns.values():
+            column.clear()
+
+
+def merge_pow_mapping(run_id, run_started, bq_client=None):
+    """
+    Merge one run's staged rows into pow_mapping.
 
-def merge_pow_mapping():
-    client = bigquery.Client()
+    Args:
+        run_id (str): Run whose rows are merged.
+        run_started (datetime): Start of the run, so only recent staging partitions are read.
+        bq_client (bigquery.Client, optional): Defaults to get_bigquery_client().
+    """
+    if bq_client is None:
+        bq_client = get_bigquery_client()
     merge_query = f"""
     MERGE `{bq_pow_mapping_table_id}` T
-    USING `{bq_pow_mapping_staging_table_id}` S
+    USING (
+      SELECT * EXCEPT(run_id, scraped_at)
+      FROM `{bq_pow_mapping_staging_table_id}`
+      WHERE run_id = @run_id AND scraped_at >= @run_started
+      -- A contact is staged twice when a run retries it; the latest row wins
+      QUALIFY ROW_NUMBER() OVER (PARTITION BY contact_id ORDER BY scraped_at DESC) = 1
+    ) S
     ON T.contact_id = S.contact_id
+    -- A field missing from one read keeps the value pow_mapping already has
     WHEN MATCHED THEN
-      UPDATE SET pow_id = cast(nullif(S.pow_id, '-') as int64),
-                 last_time_account_dir_comm = parse_date('%m/%d/%Y', nullif(S.last_time_account_dir_comm, '-')),
-                 last_time_contact_dir_comm = parse_date('%m/%d/%Y', nullif(S.last_time_contact_dir_comm, '-'))
-                 
+      UPDATE SET pow_id = coalesce(cast(nullif(S.pow_id, '-') as int64), T.pow_id),
+                 last_time_account_dir_comm = coalesce(parse_date('%m/%d/%Y', nullif(S.last_time_account_dir_comm, '-')),
+                                                       T.last_time_account_dir_comm),
+                 last_time_contact_dir_comm = coalesce(parse_date('%m/%d/%Y', nullif(S.last_time_contact_dir_comm, '-')),
+                                                       T.last_time_contact_dir_comm)
+
     WHEN NOT MATCHED THEN
       INSERT (contact_id, pow_id, last_time_account_dir_comm, last_time_contact_dir_comm)
       VALUES (contact_id, 
@@ -130,123 +563,336 @@ def merge_pow_mapping():
               parse_date('%m/%d/%Y', nullif(S.last_time_contact_dir_comm, '-'))
               )
     """
-    query_job = client.query(merge_query)
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('run_id', 'STRING', run_id),
+        bigquery.ScalarQueryParameter('run_started', 'TIMESTAMP', run_started),
+    ])
+    query_job = bq_client.query(merge_query, job_config=job_config)
     query_job.result()  # Wait for the query to complete
     print("Merge completed successfully")
 
 
-def click_view_more_button(driver):
-    try:
-        view_more_button = WebDriverWait(driver,10).until(
-            EC.element_to_be_clickable((By.CSS_SELECTOR, 'button[data-qa="contact-basic-info-customer-fields-view-more-button"]'))
+class StagingUploader:
+    """
+    Appends scraped rows to the staging table, tagged with the run ID.
+    Rows are loaded whenever batch_size rows are waiting or flush_interval
+    seconds have passed. finish() loads the rest and runs the one MERGE of
+    the run.
+    """
+
+    def __init__(self, run_id, run_started, bq_client=None, batch_size=UPLOAD_BATCH_SIZE,
+                 flush_interval=UPLOAD_FLUSH_SECONDS, checkpoint=None):
+        self.run_id = run_id
+        self.run_started = run_started
+        self.bq_client = bq_client if bq_client is not None else get_bigquery_client()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Records which contacts are scraped and staged, so a restarted run can skip them
+        self.checkpoint = checkpoint
+        self.buffer = ContactBuffer()
+        # A resumed run's MERGE also covers the rows staged before the restart
+        self.total_records = len(checkpoint.completed) if checkpoint is not None else 0
+        if checkpoint is not None:
+            # Rows scraped before the restart that never made it into a batch
+            for record in checkpoint.pending:
+                self.buffer.append(record)
+        self.last_flush = time.monotonic()
+
+    def add(self, record):
+        """Queue one scraped ContactRecord and load the batch when it is due."""
+        self.buffer.append(record)
+        if self.checkpoint is not None:
+            self.checkpoint.add_pending(record)
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Append the waiting rows to the staging table."""
+        self.last_flush = time.monotonic()
+        if not len(self.buffer):
+            return
+
+        with run_timer.span('dataframe'):
+            batch_df = self.buffer.to_dataframe()
+            batch_df['run_id'] = self.run_id
+            batch_df['scraped_at'] = pd.Timestamp.now(tz='UTC')
+        job_config = bigquery.LoadJobConfig(
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            # Staged rows are only needed until the run's MERGE
+            time_partitioning=bigquery.TimePartitioning(field='scraped_at',
+                                                        expiration_ms=STAGING_EXPIRATION_DAYS * 24 * 3600 * 1000),
+        )
+        with run_timer.span('upload'):
+            self.bq_client.load_table_from_dataframe(batch_df, bq_pow_mapping_staging_table_id,
+                                                     job_config=job_config).result()
+        self.total_records += len(batch_df)
+        self.buffer.clear()
+        if self.checkpoint is not None:
+            with run_timer.span('checkpoint_save'):
+                self.checkpoint.mark_staged(batch_df['contact_id'].tolist())
+        print(f"Uploaded {len(batch_df)} records. Total records processed: {self.total_records}")
+
+    def finish(self):
+        """Load the remaining rows, merge the run into pow_mapping and update the schedule."""
+        self.flush()
+        if self.total_records:
+            with run_timer.span('merge'):
+                merge_pow_mapping(self.run_id, self.run_started, self.bq_client)
+            with run_timer.span('schedule_update'):
+                update_scrape_schedule(self.run_id, self.run_started, self.bq_client)
+        if self.checkpoint is not None:
+            # The run is merged, so the next one selects new contacts
+            self.checkpoint.clear()
+        return self.total_records
+
+
+def new_run_id():
+    """Unique, sortable ID for one scrape run."""
+    return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+
+
+class RunCheckpoint:
+    """
+    Progress of one run: its ID, the contacts it selected, the ones already
+    staged and the scraped rows still waiting for a staging load. Saved after
+    every staging load and every save_interval seconds in between, so a run cut
+    short by a timeout, a crash or SIGTERM resumes where it stopped instead of
+    scraping the same contacts again.
+    """
+
+    def __init__(self, store, run_id, run_started, contact_ids, completed=(), pending=(),
+                 save_interval=CHECKPOINT_SAVE_SECONDS):
+        self.store = store
+        self.run_id = run_id
+        self.run_started = run_started
+        self.contact_ids = list(contact_ids)
+        self.completed = set(completed)
+        self.pending = [ContactRecord(*row) for row in pending]
+        self.save_interval = save_interval
+        self.last_save = time.monotonic()
+
+    @classmethod
+    def load(cls, store, max_age_hours=CHECKPOINT_MAX_AGE_HOURS, bq_client=None):
+        """
+        The saved checkpoint of an unfinished run.
+
+        Args:
+            store: LocalStateStore or GCSStateStore holding the checkpoint.
+            max_age_hours (float): Older checkpoints are not resumed, so a run that
+                never finished doesn't hold back the next day's contacts. Their
+                rows are staged and merged first.
+            bq_client (bigquery.Client, optional): For that MERGE. Defaults to get_bigquery_client().
+        Returns:
+            RunCheckpoint or None: None when there is nothing to resume.
+        """
+        state = store.load()
+        if not state:
+            return None
+        try:
+            run_started = datetime.fromisoformat(state['run_started'])
+            checkpoint = cls(store, state['run_id'], run_started, state['contact_ids'], state['completed'],
+                             state.get('pending', []))
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Ignoring unreadable checkpoint: {e}")
+            store.clear()
+            return None
+        age_hours = (datetime.now(timezone.utc) - run_started).total_seconds() / 3600
+        if age_hours > max_age_hours:
+            print(f"Not resuming run {checkpoint.run_id} from {age_hours:.0f} hours ago")
+            checkpoint.merge_staged(bq_client)
+            store.clear()
+            return None
+        return checkpoint
+
+    def remaining(self):
+        """Contact IDs that still have to be scraped, in their original order."""
+        scraped = self.completed.union(record.contact_id for record in self.pending)
+        return [contact_id for contact_id in self.contact_ids if contact_id not in scraped]
+
+    def add_pending(self, record):
+        """Record a scraped contact that is not staged yet, saving when save_interval has passed."""
+        self.pending.append(record)
+        if time.monotonic() - self.last_save >= self.save_interval:
+            self.save()
+
+    def mark_staged(self, contact_ids):
+        """Record contacts whose rows are in the staging table."""
+        self.completed.update(contact_ids)
+        staged = set(contact_ids)
+        self.pending = [record for record in self.pending if record.contact_id not in staged]
+        self.save()
+
+    def merge_staged(self, bq_client=None):
+        """
+        Stage the waiting rows and merge this run without resuming it.
+        When that fails the checkpoint is kept and the error raised, so the next
+        attempt merges the rows instead of dropping them with the checkpoint.
+        """
+        if not self.completed and not self.pending:
+            return
+        contacts = len(self.completed) + len(self.pending)
+        try:
+            StagingUploader(self.run_id, self.run_started, bq_client, checkpoint=self).finish()
+        except Exception as e:
+            print(f"Error merging the {contacts} scraped contacts of run {self.run_id}, "
+                  f"keeping its checkpoint: {e}")
+            raise
+        print(f"Merged the {contacts} scraped contacts of run {self.run_id}")
+
+    def save(self):
+        self.last_save = time.monotonic()
+        self.store.save({
+            'run_id': self.run_id,
+            'run_started': self.run_started.isoformat(),
+            'contact_ids': self.contact_ids,
+            'completed': sorted(self.completed),
+            'pending': [list(record) for record in self.pending],
+        })
+
+    def clear(self):
+        self.store.clear()
+
+
+def start_or_resume_run(checkpoint_store, select_contacts=get_contact_ids, bq_client=None):
+    """
+    Resume the checkpointed run if there is one, otherwise start a new run.
+
+    Args:
+        checkpoint_store: LocalStateStore or GCSStateStore for the checkpoint.
+        select_contacts (callable): Returns the DataFrame of contacts for a new run.
+        bq_client (bigquery.Client, optional): Merges what a stale checkpoint staged.
+    Returns:
+        RunCheckpoint: The run, already saved.
+    """
+    checkpoint = RunCheckpoint.load(checkpoint_store, bq_client=bq_client)
+    if checkpoint is not None:
+        print(f"Resuming run {checkpoint.run_id}: {len(checkpoint.completed)} of "
+              f"{len(checkpoint.contact_ids)} contacts already staged, {len(checkpoint.pending)} waiting to be")
+        return checkpoint
+
+    with run_timer.span('contact_selection'):
+        contact_ids = select_contacts()['id'].tolist()
+    checkpoint = RunCheckpoint(checkpoint_store, new_run_id(), datetime.now(timezone.utc), contact_ids)
+    checkpoint.save()
+    return checkpoint
+
+
+def get_contact_details(driver, contact_id):
+    url = f"{REFERRIZER_BASE_URL}/contacts/{contact_id}/details"
+    with run_timer.span('page_load'):
+        driver.get(url)
+
+    # One round trip: the script clicks "view more" and resolves once every
+    # field is on the page or the details panel has stopped changing.
+    # A read that fails raises, so the contact counts as failed instead of
+    # staging a row of '-' over what pow_mapping already knows.
+    with run_timer.span('field_read'):
+        result = driver.execute_async_script(
+            READ_CONTACT_FIELDS_JS, CONTACT_FIELD_SELECTORS, VIEW_MORE_BUTTON_SELECTOR, DETAILS_PANEL_SELECTOR,
+            int(CONTACT_READY_TIMEOUT_SECONDS * 1000), CONTACT_SETTLE_MS
         )
-        view_more_button.click()
-        #time.sleep(0.5)  # Short wait to allow UI to respond
+    page_fields = result['fields']
+    # The in-page split of field_read, measured by the script
+    timing = result.get('timing') or {}
+    if timing.get('viewMoreMs') is not None:
+        run_timer.record('view_more_click', timing['viewMoreMs'] / 1000)
+        run_timer.record('field_wait', (timing['readyMs'] - timing['viewMoreMs']) / 1000)
+
+    # Fields that are not on the page keep the default value
+    scraped_elements = {field: page_fields.get(field) or '-' for field in CONTACT_FIELD_SELECTORS}
+
+    record = ContactRecord(contact_id, **scraped_elements)
+    print(list(record))
+    return record
+
+def is_first_party_url(url):
+    """
+    True for a URL on the app's own site: the host of REFERRIZER_BASE_URL,
+    another host under the same domain, or one of FIRST_PARTY_SCRIPT_HOSTS.
+    URLs that don't go over the network, like data:, count as first party.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https'):
         return True
-    except Exception as e:
-        print(f"Error clicking view more button: {e}")
+    host = parsed.hostname or ''
+    app_host = urlparse(REFERRIZER_BASE_URL).hostname or ''
+    if host == app_host or host in FIRST_PARTY_SCRIPT_HOSTS:
+        return True
+    try:
+        ipaddress.ip_address(app_host)
         return False
+    except ValueError:
+        site = '.'.join(app_host.split('.')[-2:])
+    return host == site or host.endswith('.' + site)
 
 
-def get_contact_details(driver, contact_id):
-    url = f"https://app.referrizer.com/contacts/{contact_id}/details"
-    driver.get(url)
-
-    fields_to_scrape = ['pow_id', 'last_time_account_dir_comm', 'last_time_contact_dir_comm']
-    # Initialize pow_id with a default value
-    scraped_elements = {}
-    for field in fields_to_scrape:
-        scraped_elements[field] = '-'
-    scrape_info = {}
-
-     # Zoom out to 67%
-    driver.execute_script("document.body.style.zoom='67%'")
-
-    # Click the view more button to expand additional fields
-    click_view_more_button(driver)
-    # Function already handles exceptions internally
-    
-    # populate field data to be scraped
-    scrape_info['pow_id'] = '[data-qa="contact-basic-info-integration-pow-id"]'
-    scrape_info['last_time_account_dir_comm'] = '[data-qa="contact-basic-info-customer-fields-contact-last-contacted-date"]'
-    scrape_info['last_time_contact_dir_comm'] = '[data-qa="contact-basic-info-customer-fields-contact-last-responded-date"]'
-    
-  
-    # Wait for the element to be present
-    for field in fields_to_scrape:
+class ThirdPartyScriptBlocker:
+    """
+    Fails a browser's script requests to other sites, whatever their URL.
+    Script requests are paused with CDP Fetch interception and answered on a
+    background thread that holds its own CDP connection to the page. When the
+    browser quits the connection closes, and Chrome drops the interception
+    with it.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.blocked = 0
+        self.ready = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self, timeout=10):
+        """Start intercepting and wait until Chrome has it enabled."""
+        self.thread.start()
+        if not self.ready.wait(timeout):
+            raise TimeoutError("CDP script interception did not start")
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
         try:
-            element = WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, scrape_info[field])))
-            #element = driver.find_element(By.CSS_SELECTOR, scrape_info[field])
-            scraped_elements[field] = element.text.strip()
-        
+            trio.run(self.intercept)
         except Exception as e:
-            print(f"Error finding {field} element: {e}")
-        # Keep the default pow_id value
-    # Try up to 3 more times to get the POW ID if it's empty
-
-
-    # for field in fields_to_scrape:
+            # Once started, the connection ends with the browser
+            if not self.ready.is_set():
+                self.error = e
+        finally:
+            self.ready.set()
+
+    async def intercept(self):
+        async with self.driver.bidi_connection() as connection:
+            session, devtools = connection.session, connection.devtools
+            # Unbounded, since a paused request that is never answered hangs the page
+            events = session.listen(devtools.fetch.RequestPaused, buffer_size=math.inf)
+            pattern = devtools.fetch.RequestPattern(url_pattern='*', resource_type=devtools.network.ResourceType.SCRIPT)
+            await session.execute(devtools.fetch.enable(patterns=[pattern]))
+            self.ready.set()
+            async for event in events:
+                if is_first_party_url(event.request.url):
+                    await session.execute(devtools.fetch.continue_request(request_id=event.request_id))
+                else:
+                    self.blocked += 1
+                    await session.execute(devtools.fetch.fail_request(
+                        request_id=event.request_id, error_reason=devtools.network.ErrorReason.BLOCKED_BY_CLIENT))
 
-    #     attempts = 0
-    #     max_attempts = 3
-        
-    #     element_value = scraped_elements[field]
-
-    #     while (element_value == '' or element_value == '-') and attempts < max_attempts:
-    #         print(f"Retry attempt {attempts+1} for contact {contact_id} and element {field}")
-
-    #         # Try clicking the view more button again
-    #         if click_view_more_button(driver):
-    #             try:
-    #                 # Wait a bit longer on retries
-    #                 time.sleep(1.5)
-
-    #                 # Try to find the POW ID element
-    #                 element = driver.find_element(By.CSS_SELECTOR, scrape_info[field])
-    #                 new_element_value = element.text.strip()
-
-    #                 if new_element_value:  # Only update if we got a non-empty value
-    #                     scraped_elements[field] = new_element_value
-    #                     print(f"Found {field} on retry: {new_element_value}")
-    #                     break  # Exit the loop if we found a valid element id
-    #             except Exception as e:
-    #                 print(f"Error finding {field} in retry attempt {attempts+1}: {e}")
-    #                 # Keep existing element_id value
-
-    #         attempts += 1
-
-
-    # Create dataframe with both IDs
-    df = pd.DataFrame({
-        'contact_id': [contact_id],
-        'pow_id': [scraped_elements['pow_id']],
-        'last_time_account_dir_comm' : [scraped_elements['last_time_account_dir_comm']],
-        'last_time_contact_dir_comm' : [scraped_elements['last_time_contact_dir_comm']]
-    })
-    
-    print([contact_id,
-           scraped_elements['pow_id'],
-           scraped_elements['last_time_account_dir_comm'],
-           scraped_elements['last_time_contact_dir_comm']])
-    return df
 
-def main(request=None):
+def create_chrome_driver(remote_debugging=True, scrape_profile=None):
     """
-    Cloud Run function that scrapes Referrizer data.
-    Can be called directly or as a Cloud Run function.
+    Start a Chrome driver configured for the local or Cloud Run environment.
 
     Args:
-        request (flask.Request, optional): The request object when called as Cloud Run function.
-            Defaults to None when called directly.
+        remote_debugging (bool): Open the remote debugging port in development
+            environments. Only one browser at a time can hold the port.
+        scrape_profile (bool, optional): Use the lightweight scrape profile.
+            Defaults to REFERRIZER_SCRAPE_PROFILE.
     Returns:
-        The response text, or any set of values that can be turned into a
-        Response object using `make_response`.
+        webdriver.Chrome: The started driver.
     """
     # Configure Chrome options for both local and Cloud Run environments
     chrome_options = webdriver.ChromeOptions()
 
     # Detect if running in Cloud Run or similar environment
-    import os
     is_cloud_environment = os.environ.get('CLOUD_RUN_JOB', False) or os.environ.get('K_SERVICE', False)
 
     # Always use these options for stability
@@ -270,12 +916,28 @@ def main(request=None):
     # chrome_options.add_argument('--user-data-dir=/tmp/chrome-data')
 
     # Add debugging port in development environments
-    if not is_cloud_environment:
+    if not is_cloud_environment and remote_debugging:
         chrome_options.add_argument('--remote-debugging-port=9222')
 
+    if scrape_profile is None:
+        scrape_profile = SCRAPE_PROFILE
+    if scrape_profile:
+        # Only the page text is read: return from get() at DOMContentLoaded,
+        # skip images and cap the memory of each renderer
+        print("Using the lightweight scrape profile")
+        chrome_options.page_load_strategy = 'eager'
+        chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+        chrome_options.add_argument(f'--js-flags=--max-old-space-size={JS_HEAP_MB}')
+        chrome_options.add_argument(f'--renderer-process-limit={RENDERER_PROCESS_LIMIT}')
+        chrome_options.add_argument('--disable-background-networking')
+        chrome_options.add_argument('--disable-component-update')
+        chrome_options.add_argument('--disable-default-apps')
+        chrome_options.add_argument('--disable-sync')
+        chrome_options.add_argument('--mute-audio')
+        chrome_options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+
     # Initialize Chrome driver
     from selenium.webdriver.chrome.service import Service
-    import os
     import platform
     import subprocess
 
@@ -291,6 +953,12 @@ def main(request=None):
             chrome_options.binary_location = "/usr/bin/google-chrome"
 
             service = Service("/usr/local/bin/chromedriver")
+        elif os.environ.get('CHROMEDRIVER_PATH'):
+            # Explicit binaries, e.g. for the local test harness
+            print(f"Using chromedriver at: {os.environ['CHROMEDRIVER_PATH']}")
+            if os.environ.get('CHROME_BINARY'):
+                chrome_options.binary_location = os.environ['CHROME_BINARY']
+            service = Service(executable_path=os.environ['CHROMEDRIVER_PATH'])
         else:
             # For local development, try multiple approaches
             print("Running in local environment")
@@ -325,71 +993,872 @@ def main(request=None):
 
         # Initialize the driver with the service and options
         print("Initializing Chrome driver...")
-        driver = webdriver.Chrome(service=service, options=chrome_options)
+        with run_timer.span('driver_startup'):
+            driver = webdriver.Chrome(service=service, options=chrome_options)
+        # Leave room for the in-page wait in get_contact_details
+        driver.set_script_timeout(CONTACT_READY_TIMEOUT_SECONDS + 5)
+        driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT_SECONDS)
+        if scrape_profile:
+            # Requests for these never leave the browser
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+            try:
+                ThirdPartyScriptBlocker(driver).start()
+            except Exception as e:
+                print(f"Third-party scripts are not blocked: {e}")
         print("Chrome driver initialized successfully")
+        return driver
 
     except Exception as e:
         print(f"Chrome initialization failed: {e}")
         import traceback
         traceback.print_exc()
         raise
-    starttime = datetime.now()
-    print(f"Starting job at: {starttime}")
 
+
+def default_browser_workers():
+    """
+    Number of browser workers for this container.
+    REFERRIZER_BROWSER_WORKERS wins when set. Otherwise one browser per
+    available CPU, capped by how many browsers fit in the memory limit.
+    """
+    if BROWSER_WORKERS:
+        return max(1, int(BROWSER_WORKERS))
+
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    # Cloud Run exposes the instance memory limit through cgroups
+    workers = cpus
+    for limit_file in ['/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes']:
+        try:
+            with open(limit_file) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            workers = min(workers, int(limit) // (BROWSER_MEMORY_MB * 1024 * 1024))
+        break
+    return max(1, workers)
+
+
+def get_session_state(driver):
+    """Capture the cookies and local storage of a logged-in browser."""
+    return {
+        'cookies': driver.get_cookies(),
+        'local_storage': driver.execute_script(
+            "var items = {};"
+            "for (var i = 0; i < localStorage.length; i++) {"
+            "  var key = localStorage.key(i); items[key] = localStorage.getItem(key);"
+            "}"
+            "return items;"
+        ) or {},
+    }
+
+
+def restore_session_state(driver, state):
+    """Copy a captured session into another browser so it skips the login."""
+    with run_timer.span('session_restore'):
+        # Cookies and local storage can only be set for the page's own origin
+        driver.get(REFERRIZER_BASE_URL)
+        driver.delete_all_cookies()
+        for cookie in state['cookies']:
+            # Cookies that went through JSON can carry a float expiry, which add_cookie rejects
+            cookie = dict(cookie)
+            if 'expiry' in cookie:
+                cookie['expiry'] = int(cookie['expiry'])
+            driver.add_cookie(cookie)
+        for key, value in state['local_storage'].items():
+            driver.execute_script("localStorage.setItem(arguments[0], arguments[1]);", key, value)
+
+
+class LocalStateStore:
+    """Keeps a JSON state file, like the saved session, in a local directory, for local runs and tests."""
+
+    def __init__(self, directory, file_name=SESSION_FILE_NAME):
+        self.path = os.path.join(directory, file_name)
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self):
+        """Return the saved state, or None when there is none."""
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, state):
+        # The session cookies are credentials, so only the owner can read them
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class GCSStateStore:
+    """Keeps a JSON state file in a Cloud Storage bucket, shared by all instances."""
+
+    def __init__(self, bucket_name, file_name=SESSION_FILE_NAME):
+        from google.cloud import storage
+        self.blob = storage.Client().bucket(bucket_name).blob(file_name)
+
+    def load(self):
+        """Return the saved state, or None when there is none."""
+        from google.api_core.exceptions import NotFound
+        try:
+            return json.loads(self.blob.download_as_text())
+        except NotFound:
+            return None
+
+    def save(self, state):
+        self.blob.upload_from_string(json.dumps(state), content_type='application/json')
+
+    def clear(self):
+        from google.api_core.exceptions import NotFound
+        try:
+            self.blob.delete()
+        except NotFound:
+            pass
+
+
+def get_state_store(file_name):
+    """Use the bucket when REFERRIZER_SESSION_BUCKET is set, otherwise REFERRIZER_SESSION_DIR."""
+    if SESSION_BUCKET:
+        return GCSStateStore(SESSION_BUCKET, file_name)
+    return LocalStateStore(SESSION_DIR, file_name)
+
+
+def get_session_store():
+    """Where the login session is saved."""
+    return get_state_store(SESSION_FILE_NAME)
+
+
+def get_checkpoint_store():
+    """Where the progress of the current run is saved."""
+    return get_state_store(CHECKPOINT_FILE_NAME)
+
+
+def is_session_valid(driver):
+    """
+    Load /contacts and check that the app keeps it instead of asking to log in.
+    The session is valid when, for SESSION_CHECK_SECONDS after the page loads,
+    no login form shows up and the app does not redirect away from /contacts.
+    Nothing on the page itself has to match, so the check doesn't depend on
+    the markup of the contacts list.
+    """
+    contacts_path = urlparse(f"{REFERRIZER_BASE_URL}/contacts").path
+
+    def asks_to_log_in(d):
+        return d.find_elements(By.ID, "username") or not urlparse(d.current_url).path.startswith(contacts_path)
+
+    try:
+        driver.get(f"{REFERRIZER_BASE_URL}/contacts")
+    except Exception as e:
+        print(f"Session check could not load /contacts: {e}")
+        return False
+    try:
+        # A redirect from script or a login form rendered late ends the wait early
+        WebDriverWait(driver, SESSION_CHECK_SECONDS, poll_frequency=0.2).until(asks_to_log_in)
+    except TimeoutException:
+        return True
+    except Exception as e:
+        print(f"Session check failed: {e}")
+    return False
+
+
+def ensure_logged_in(driver, session_store):
+    """
+    Log the browser in, reusing the saved session when it is still valid.
+    The full login only runs when there is no saved session or it has expired.
+    The new session is then saved for the next run.
+
+    Args:
+        driver (webdriver.Chrome): Browser to log in.
+        session_store: LocalStateStore or GCSStateStore.
+    """
     try:
-        # Login to Referrizer
+        state = session_store.load()
+    except Exception as e:
+        print(f"Could not load saved session: {e}")
+        state = None
+
+    if state:
+        restore_session_state(driver, state)
+        if is_session_valid(driver):
+            print("Reusing saved Referrizer session")
+            return
+        print("Saved session has expired, logging in")
+
+    with run_timer.span('login'):
         login_to_referrizer(driver)
-        
-        # Get contact IDs to process
-        contact_ids_df = get_contact_ids()
 
-        print(f"Total contacts to process: {len(contact_ids_df)}")
+    if is_session_valid(driver):
+        try:
+            session_store.save(get_session_state(driver))
+            print("Saved Referrizer session")
+        except Exception as e:
+            print(f"Could not save session: {e}")
+    else:
+        print("Login did not reach the contacts page, session not saved")
+
+
+def add_browser_workers(drivers, count):
+    """
+    Start more browsers in parallel, each reusing the session of drivers[0].
 
-        results = []
-        total_records = 0
+    Args:
+        drivers (list): Running drivers; the new ones are appended.
+        count (int): Number of browsers to add.
+    """
+    if count <= 0:
+        return
+    state = get_session_state(drivers[0])
 
-        # Process each contact ID
-        for index, contact_id in enumerate(contact_ids_df['id'], 1):
+    def start_worker_browser(_):
+        driver = create_chrome_driver(remote_debugging=False)
+        try:
+            restore_session_state(driver, state)
+        except Exception:
+            driver.quit()
+            raise
+        return driver
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        futures = [executor.submit(start_worker_browser, i) for i in range(count)]
+        for future in futures:
             try:
-                contact_data = get_contact_details(driver, contact_id)
-                results.append(contact_data)
-
-                # Process batch when reaching 200 records
-                if index % 200 == 0:
-                    print(f"Processing batch {index} of {len(contact_ids_df)}")
-                    batch_df = pd.concat(results, ignore_index=True)
-                    upload_to_gbq(batch_df)
-                    merge_pow_mapping()
-                    total_records += len(batch_df)
-                    print(f"Uploaded {len(batch_df)} records. Total records processed: {total_records}")
-                    results = []  # Reset for next batch
+                drivers.append(future.result())
+            except Exception as e:
+                print(f"Could not start browser worker: {e}")
+
+
+def start_browser_pool(workers, session_store=None):
+    """
+    Start the browsers for the worker pool with one login.
+    The first browser logs in, the others start in parallel and reuse its session.
+
+    Args:
+        workers (int): Number of browsers.
+        session_store: Where the login session is saved. Defaults to get_session_store().
+    Returns:
+        list: The logged-in drivers. The caller quits them.
+    """
+    if session_store is None:
+        session_store = get_session_store()
+
+    drivers = [create_chrome_driver()]
+    try:
+        ensure_logged_in(drivers[0], session_store)
+        add_browser_workers(drivers, workers - 1)
+    except Exception:
+        for driver in drivers:
+            driver.quit()
+        raise
+
+    print(f"Started {len(drivers)} browser workers")
+    return drivers
+
+
+def browser_rss_mb(driver):
+    """Resident memory of chromedriver and every Chrome process it started, in MB."""
+    import psutil
+    try:
+        process = psutil.Process(driver.service.process.pid)
+    except (AttributeError, psutil.NoSuchProcess):
+        return 0
+    total = 0
+    for child in [process] + process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return total / (1024 * 1024)
+
+
+def kill_browser(driver):
+    """
+    Kill chromedriver and the Chrome processes it started.
+    Unlike quit() this doesn't wait on chromedriver, which may be stuck on the
+    command that hung. Drivers without a local chromedriver are quit instead.
+    """
+    import psutil
+    try:
+        process = psutil.Process(driver.service.process.pid)
+    except (AttributeError, psutil.NoSuchProcess):
+        driver.quit()
+        return
+    for child in process.children(recursive=True) + [process]:
+        try:
+            child.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+
+class BrowserManager:
+    """
+    Keeps the browser pool and its logged-in session alive for the life of the container.
+    Warm invocations reuse the running browsers instead of starting Chrome and
+    logging in again. A browser is restarted when it stops responding or passes
+    the page or memory limit.
+    """
+
+    def __init__(self, max_pages=BROWSER_MAX_PAGES, max_rss_mb=BROWSER_MAX_RSS_MB):
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.drivers = []
+        self.pages = {}
+        # Held by main for a whole run so overlapping requests don't share browsers
+        self.lock = threading.Lock()
+        # Guards self.drivers while workers replace their browsers
+        self.pool_lock = threading.Lock()
+
+    def restart_reason(self, driver):
+        """Why the browser should be replaced, or None if it can be reused."""
+        try:
+            driver.execute_script("return 1")
+        except Exception:
+            return "browser is not responding"
+        if self.pages.get(id(driver), 0) >= self.max_pages:
+            return f"loaded {self.pages[id(driver)]} pages"
+        rss_mb = browser_rss_mb(driver)
+        if rss_mb >= self.max_rss_mb:
+            return f"using {rss_mb:.0f}MB"
+        return None
+
+    def _quit(self, driver):
+        self.pages.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception as e:
+            print(f"Error closing browser: {e}")
+
+    def acquire(self, workers, session_store=None):
+        """
+        Logged-in browsers for a run, started only if the warm ones can't be reused.
+
+        Args:
+            workers (int): Number of browsers needed.
+            session_store: Where the login session is saved. Defaults to get_session_store().
+        Returns:
+            list: The drivers. Return them with release() instead of quitting them.
+        """
+        healthy = []
+        for driver in self.drivers:
+            reason = self.restart_reason(driver)
+            if reason:
+                print(f"Restarting browser: {reason}")
+                self._quit(driver)
+            else:
+                healthy.append(driver)
+        self.drivers = healthy
+
+        if not self.drivers:
+            self.drivers = start_browser_pool(workers, session_store)
+            return list(self.drivers)
+
+        if is_session_valid(self.drivers[0]):
+            print(f"Reusing {len(self.drivers)} warm browsers")
+        else:
+            ensure_logged_in(self.drivers[0], session_store or get_session_store())
+            state = get_session_state(self.drivers[0])
+            for driver in self.drivers[1:]:
+                restore_session_state(driver, state)
+
+        add_browser_workers(self.drivers, workers - len(self.drivers))
+        return self.drivers[:workers]
+
+    def replace(self, driver, session_state):
+        """
+        Quit a dead or hung browser and start a replacement with the run's session.
+
+        Args:
+            driver (webdriver.Chrome): The browser to replace.
+            session_state (dict): From get_session_state, restored into the new browser.
+        Returns:
+            webdriver.Chrome: The new browser, in the old one's place in the pool.
+        """
+        self._quit(driver)
+        new_driver = create_chrome_driver(remote_debugging=False)
+        try:
+            restore_session_state(new_driver, session_state)
+        except Exception:
+            new_driver.quit()
+            raise
+        with self.pool_lock:
+            if driver in self.drivers:
+                self.drivers[self.drivers.index(driver)] = new_driver
+            else:
+                self.drivers.append(new_driver)
+        return new_driver
+
+    def release(self, drivers, pages):
+        """Record the pages a run loaded; the shared queue spreads them evenly over the drivers."""
+        for driver in drivers:
+            self.pages[id(driver)] = self.pages.get(id(driver), 0) + pages // max(1, len(drivers))
+
+    def shutdown(self):
+        """Quit every browser."""
+        for driver in self.drivers:
+            self._quit(driver)
+        self.drivers = []
+
+
+browser_manager = BrowserManager()
+atexit.register(browser_manager.shutdown)
 
+
+class ContactBudgetExceeded(Exception):
+    """A contact took longer than its wall-clock budget, so the browser is treated as hung."""
+
+
+def is_dead_session_error(error):
+    """True when an error means the browser session can't be used any more."""
+    if isinstance(error, (InvalidSessionIdException, NoSuchWindowException, ContactBudgetExceeded)):
+        return True
+    if isinstance(error, (urllib3.exceptions.HTTPError, ConnectionError)):
+        # chromedriver itself is gone
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in DEAD_SESSION_MARKERS)
+
+
+class ScrapeMetrics:
+    """Per-contact latencies and browser restarts of one run, shared by the workers."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.restarts = Counter()
+        self.requeued = 0
+
+    def record_latency(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def record_restart(self, reason):
+        with self.lock:
+            self.restarts[reason] += 1
+
+    def record_requeue(self):
+        with self.lock:
+            self.requeued += 1
+
+    def summary(self):
+        """Counts and latency percentiles in seconds, ready to log as JSON."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            restarts = dict(self.restarts)
+            requeued = self.requeued
+
+        def percentile(p):
+            value = _percentile(latencies, p)
+            return round(value, 3) if value is not None else None
+
+        return {
+            'contacts': len(latencies),
+            'latency_p50_seconds': percentile(50),
+            'latency_p95_seconds': percentile(95),
+            'latency_p99_seconds': percentile(99),
+            'latency_max_seconds': percentile(100),
+            'browser_restarts': sum(restarts.values()),
+            'restart_reasons': restarts,
+            'requeued_contacts': requeued,
+        }
+
+
+class ScrapeSupervisor:
+    """
+    Runs every scrape within a wall-clock budget and recovers from dead browsers.
+    Scrapes run on the worker threads themselves. One watchdog thread kills
+    the browser of any scrape that overruns the budget, which unblocks the
+    hung call. A contact lost to a dead or hung browser is requeued, up to
+    max_attempts tries, and the worker carries on with a restarted browser.
+    """
+
+    def __init__(self, restart_browser=None, budget=CONTACT_BUDGET_SECONDS,
+                 max_attempts=MAX_CONTACT_ATTEMPTS, metrics=None):
+        """
+        Args:
+            restart_browser (callable, optional): Takes the dead driver and returns a
+                logged-in replacement. Without it a worker whose browser dies stops,
+                and the other workers take its contacts.
+            budget (float): Seconds one contact may take.
+            max_attempts (int): Tries per contact before it counts as failed.
+            metrics (ScrapeMetrics, optional): Where latencies and restarts are recorded.
+        """
+        self.restart_browser = restart_browser
+        self.budget = budget
+        self.max_attempts = max_attempts
+        self.metrics = metrics if metrics is not None else ScrapeMetrics()
+        self.lock = threading.Lock()
+        # Deadline and driver of every scrape in progress
+        self.running = {}
+        # Scrapes whose browser the watchdog killed
+        self.overran = set()
+        self.watchdog = None
+
+    def scrape(self, scrape, driver, contact_id):
+        """Call scrape(driver, contact_id), raising ContactBudgetExceeded if it overruns the budget."""
+        call = object()
+        started = time.monotonic()
+        with self.lock:
+            self.running[call] = (started + self.budget, driver)
+            if self.watchdog is None:
+                self.watchdog = threading.Thread(target=self._watch, daemon=True)
+                self.watchdog.start()
+        try:
+            record = scrape(driver, contact_id)
+        finally:
+            with self.lock:
+                del self.running[call]
+                overran = call in self.overran
+                self.overran.discard(call)
+            if overran:
+                # Whatever the call returned or raised, its browser is gone
+                raise ContactBudgetExceeded(f"contact {contact_id} took longer than {self.budget:.0f}s")
+        self.metrics.record_latency(time.monotonic() - started)
+        return record
+
+    def _watch(self):
+        """Kill the browsers of scrapes past their deadline. Exits once no scrape is running."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                waiting = {call: entry for call, entry in self.running.items() if call not in self.overran}
+                if not waiting:
+                    self.watchdog = None
+                    return
+                expired = [call for call, (deadline, _) in waiting.items() if deadline <= now]
+                self.overran.update(expired)
+            if not expired:
+                # Every scrape has the same budget, so later ones can't expire sooner
+                time.sleep(min(deadline for deadline, _ in waiting.values()) - now)
+                continue
+            for call in expired:
+                driver = waiting[call][1]
+                print(f"Scrape overran {self.budget:.0f}s, killing its browser")
+                try:
+                    kill_browser(driver)
+                except Exception as e:
+                    print(f"Error killing browser: {e}")
+
+    def recover(self, driver, error):
+        """
+        Replace the browser after a dead-session error.
+
+        Returns:
+            The driver to carry on with. Raises if the browser could not be restarted.
+        """
+        if self.restart_browser is None:
+            raise RuntimeError(f"no way to restart the browser after: {error}")
+        reason = 'timeout' if isinstance(error, ContactBudgetExceeded) else type(error).__name__
+        print(f"Restarting browser after {reason}: {error}")
+        self.metrics.record_restart(reason)
+        return self.restart_browser(driver)
+
+
+def _scrape_worker(scrape, drivers, index, contact_queue, results_queue, stop_event, supervisor):
+    """Scrape contacts from the shared queue until it is empty or the run is stopped."""
+    try:
+        while not stop_event.is_set():
+            try:
+                contact_id, attempt = contact_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results_queue.put((contact_id, supervisor.scrape(scrape, drivers[index], contact_id), None))
+                continue
             except Exception as e:
-                print(f"Error processing contact {contact_id}: {e}")
+                error = e
+            if not is_dead_session_error(error):
+                results_queue.put((contact_id, None, error))
                 continue
 
-        # Process remaining records
-        if results:
-            final_batch = pd.DataFrame()
-            final_batch = pd.concat(results, ignore_index=True)
-            upload_to_gbq(final_batch)
-            merge_pow_mapping()
-            total_records += len(final_batch)
-            print(f"Final batch uploaded: {len(final_batch)} records")
-            print(f"Total records processed: {total_records}")
+            if attempt + 1 < supervisor.max_attempts:
+                supervisor.metrics.record_requeue()
+                contact_queue.put((contact_id, attempt + 1))
+            else:
+                results_queue.put((contact_id, None, error))
+            try:
+                drivers[index] = supervisor.recover(drivers[index], error)
+            except Exception as e:
+                # The other workers pick up the requeued contacts
+                print(f"Could not restart browser, stopping worker: {e}")
+                return
+    finally:
+        # Tells scrape_contacts this worker is done
+        results_queue.put(None)
+
 
-        endtime = datetime.now()
-        print(f"Ending job at: {endtime}")
-        print(f"Total runtime: {endtime - starttime}")
+def scrape_contacts(drivers, contact_ids, uploader, scrape=get_contact_details, stop_event=None,
+                    supervisor=None):
+    """
+    Scrape contacts with one worker thread per browser.
+    The workers pull contact IDs from a shared queue. This thread feeds
+    their results to the single uploader, so uploads overlap with scraping.
 
-        return f"Processed {total_records} records successfully"
+    Args:
+        drivers (list): Logged-in drivers, one per worker. A worker that
+            restarts its browser puts the new driver in its place.
+        contact_ids (list): Contact IDs to scrape.
+        uploader (StagingUploader): Receives each scraped contact.
+        scrape (callable): Scrapes one contact with a worker's driver.
+        stop_event (threading.Event, optional): When set, the workers finish the
+            contacts they are on and take no new ones. Defaults to _shutdown_requested.
+        supervisor (ScrapeSupervisor, optional): Budgets and retries each contact.
+            Defaults to one that requeues but cannot restart browsers, so a
+            worker whose browser dies stops.
+    Returns:
+        tuple: (contacts scraped, contact IDs that failed)
+    """
+    if stop_event is None:
+        stop_event = _shutdown_requested
+    if supervisor is None:
+        supervisor = ScrapeSupervisor()
+    contact_queue = queue.Queue()
+    for contact_id in contact_ids:
+        contact_queue.put((contact_id, 0))
+    results_queue = queue.Queue()
+
+    workers = [threading.Thread(target=_scrape_worker,
+                                args=(scrape, drivers, index, contact_queue, results_queue, stop_event, supervisor),
+                                daemon=True)
+               for index in range(len(drivers))]
+    for worker in workers:
+        worker.start()
+
+    failed_contact_ids = []
+    scraped = 0
+    finished_workers = 0
+    while finished_workers < len(workers):
+        result = results_queue.get()
+        if result is None:
+            finished_workers += 1
+            continue
+        contact_id, record, error = result
+        if error is not None:
+            print(f"Error processing contact {contact_id}: {error}")
+            failed_contact_ids.append(contact_id)
+            continue
+        uploader.add(record)
+        scraped += 1
+
+    for worker in workers:
+        worker.join()
+
+    if stop_event.is_set():
+        print(f"Stopped with {contact_queue.qsize()} contacts left for the next run")
+    else:
+        # Requeued contacts no worker was left to take
+        while not contact_queue.empty():
+            failed_contact_ids.append(contact_queue.get_nowait()[0])
+    return scraped, failed_contact_ids
+
+
+def _handle_sigterm(signum, frame):
+    """Stop taking new contacts so main can stage what it has and save the checkpoint."""
+    print("SIGTERM received, stopping the run after the contacts in progress")
+    _shutdown_requested.set()
+    if callable(_previous_sigterm_handler):
+        # Let the server shut down gracefully too
+        _previous_sigterm_handler(signum, frame)
+    elif not browser_manager.lock.locked():
+        # No run to wind down
+        sys.exit(128 + signum)
+
+
+def install_sigterm_handler():
+    """Handle SIGTERM, keeping any handler the server already installed."""
+    global _previous_sigterm_handler
+    try:
+        previous = signal.signal(signal.SIGTERM, _handle_sigterm)
+    except ValueError:
+        # Signal handlers can only be installed from the main thread
+        print("Not in the main thread, SIGTERM will not checkpoint the run")
+        return
+    if previous is not _handle_sigterm:
+        _previous_sigterm_handler = previous
 
-    except Exception as e:
-        print(f"Error in main function: {e}")
-        return f"Error: {str(e)}", 500
-    finally:
-        # Always close the driver
-        driver.quit()
+
+install_sigterm_handler()
+
+
+def build_run_report(run_id, status, started, records, metrics, workers=None, timer=None):
+    """
+    Structured summary of one run, shaped as a Cloud Logging JSON entry.
+
+    Args:
+        run_id (str): Run ID, None if the run failed before it got one.
+        status (str): 'success', 'interrupted' or 'error'.
+        started (datetime): When the run started, timezone-aware.
+        records (int): Records staged for the run.
+        metrics (ScrapeMetrics): Per-contact latencies and browser restarts.
+        workers (int, optional): Browser workers.
+        timer (RunTimer, optional): Phase timings. Defaults to run_timer.
+    Returns:
+        dict: The report, ready for json.dumps.
+    """
+    if timer is None:
+        timer = run_timer
+    total_seconds = (datetime.now(timezone.utc) - started).total_seconds()
+    severity = {'success': 'INFO', 'interrupted': 'WARNING'}.get(status, 'ERROR')
+    return {
+        'severity': severity,
+        'message': f"Scrape run {run_id} {status}: {records} records in {total_seconds:.1f}s",
+        'logging.googleapis.com/labels': {'run_id': str(run_id)},
+        'run_id': run_id,
+        'status': status,
+        'workers': workers,
+        'started_at': started.isoformat(),
+        'total_seconds': round(total_seconds, 3),
+        'records': records,
+        'contacts': metrics.summary(),
+        'phases': timer.summary(),
+    }
+
+
+def write_run_report(report, table_id=RUN_STATS_TABLE_ID, bq_client=None):
+    """
+    Log the run report as one JSON line, which Cloud Logging parses into a
+    structured entry, and append it to the run stats table when one is set.
+
+    Args:
+        report (dict): From build_run_report.
+        table_id (str, optional): BigQuery table for the report. Defaults to
+            REFERRIZER_RUN_STATS_TABLE; None only logs it.
+        bq_client (bigquery.Client, optional): Defaults to get_bigquery_client().
+    """
+    print(json.dumps(report))
+    if not table_id:
+        return
+    if bq_client is None:
+        bq_client = get_bigquery_client()
+    row = {
+        'run_id': report['run_id'],
+        'started_at': report['started_at'],
+        'status': report['status'],
+        'total_seconds': report['total_seconds'],
+        'records': report['records'],
+        'report': json.dumps(report),
+    }
+    job_config = bigquery.LoadJobConfig(
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        schema=[
+            bigquery.SchemaField('run_id', 'STRING'),
+            bigquery.SchemaField('started_at', 'TIMESTAMP'),
+            bigquery.SchemaField('status', 'STRING'),
+            bigquery.SchemaField('total_seconds', 'FLOAT'),
+            bigquery.SchemaField('records', 'INTEGER'),
+            bigquery.SchemaField('report', 'STRING'),
+        ],
+    )
+    bq_client.load_table_from_json([row], table_id, job_config=job_config).result()
+
+
+def get_request_options(request):
+    """Options from the request JSON body, empty when called directly."""
+    if hasattr(request, 'get_json'):
+        return request.get_json(silent=True) or {}
+    return {}
+
+
+def main(request=None):
+    """
+    Cloud Run function that scrapes Referrizer data.
+    Can be called directly or as a Cloud Run function. A run that was cut
+    short is resumed from its checkpoint before new contacts are selected.
+
+    Args:
+        request (flask.Request, optional): The request object when called as Cloud Run function.
+            Defaults to None when called directly. An optional JSON body can set
+            "workers", the number of browser workers, and "batch_size" and
+            "flush_interval" for the staging uploads.
+    Returns:
+        The response text, or any set of values that can be turned into a
+        Response object using `make_response`.
+    """
+    options = get_request_options(request)
+    workers = int(options.get('workers') or default_browser_workers())
+
+    starttime = datetime.now()
+    print(f"Starting job at: {starttime}")
+    print(f"Using {workers} browser workers")
+
+    if _shutdown_requested.is_set():
+        return "Shutting down, not starting a new run", 503
+
+    with browser_manager.lock:
+        run_timer.reset()
+        with run_timer.span('browser_acquire'):
+            drivers = browser_manager.acquire(workers)
+        browser_pages = 0
+        uploader = None
+        checkpoint = None
+        metrics = ScrapeMetrics()
+        status = 'error'
+
+        try:
+            # Resume an interrupted run, or pick the contacts for a new one
+            checkpoint = start_or_resume_run(get_checkpoint_store())
+            contact_ids = checkpoint.remaining()
+            print(f"Run ID: {checkpoint.run_id}")
+            print(f"Total contacts to process: {len(contact_ids)}")
+
+            uploader = StagingUploader(checkpoint.run_id, checkpoint.run_started,
+                                       batch_size=int(options.get('batch_size') or UPLOAD_BATCH_SIZE),
+                                       flush_interval=float(options.get('flush_interval') or UPLOAD_FLUSH_SECONDS),
+                                       checkpoint=checkpoint)
+
+            if contact_ids and not _shutdown_requested.is_set():
+                browser_pages = len(contact_ids)
+                session_state = get_session_state(drivers[0])
+                supervisor = ScrapeSupervisor(lambda driver: browser_manager.replace(driver, session_state),
+                                              metrics=metrics)
+                scrape_contacts(drivers, contact_ids, uploader, supervisor=supervisor)
+
+            if _shutdown_requested.is_set():
+                # Stage what was scraped; the next run resumes from the checkpoint and merges
+                uploader.flush()
+                print(f"Run {checkpoint.run_id} interrupted with {len(checkpoint.remaining())} contacts left")
+                status = 'interrupted'
+                return f"Interrupted after {uploader.total_records} records, the next run will resume", 503
+
+            # One MERGE for the whole run
+            total_records = uploader.finish()
+            status = 'success'
+
+            endtime = datetime.now()
+            print(f"Ending job at: {endtime}")
+            print(f"Total runtime: {endtime - starttime}")
+
+            return f"Processed {total_records} records successfully"
+
+        except Exception as e:
+            print(f"Error in main function: {e}")
+            if uploader is not None:
+                # Keep the contacts scraped so far for the resumed run
+                try:
+                    uploader.flush()
+                except Exception as flush_error:
+                    print(f"Error staging partial results: {flush_error}")
+            return f"Error: {str(e)}", 500
+        finally:
+            report = build_run_report(checkpoint.run_id if checkpoint else None, status,
+                                      starttime.astimezone(timezone.utc),
+                                      uploader.total_records if uploader else 0, metrics, workers)
+            try:
+                write_run_report(report)
+            except Exception as e:
+                print(f"Error writing run report: {e}")
+            # Keep the browsers warm for the next invocation
+            browser_manager.release(drivers, browser_pages)
     
     return 'success'
 
@@ -0,0 +1,953 @@
+#!/usr/bin/env python3
+"""
+Test harness for the Referrizer scraper.
+Runs the scraper against the local fixture pages in fixture_site.py. The
+browser pool is tested with a driver that reads the static HTML directly;
+the Chrome test runs when CHROMEDRIVER_PATH (and CHROME_BINARY if Chrome is
+not installed) point at a local Chrome.
+"""
+
+import os
+import json
+import time
+import threading
+import tempfile
+from datetime import datetime, timedelta, timezone
+import pytest
+import requests
+import pandas as pd
+from bs4 import BeautifulSoup
+from selenium.common.exceptions import (InvalidSessionIdException, NoSuchElementException, TimeoutException,
+                                        WebDriverException)
+from selenium.webdriver.common.by import By
+
+import main
+import fixture_site
+from fixture_site import CONTACTS, SESSION_COOKIE, FixtureSite
+
+class StaticElement:
+    def __init__(self, tag):
+        self.tag = tag
+
+    @property
+    def text(self):
+        return self.tag.get_text()
+
+class StaticPageDriver:
+    """Minimal WebDriver stand-in that fetches pages without running JavaScript."""
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.soup = None
+        self.visited = []
+        self.current_url = None
+        self.crashed = False
+        self.closed = False
+
+    def get(self, url):
+        if self.crashed:
+            raise InvalidSessionIdException("invalid session id")
+        self.visited.append(url)
+        response = self.session.get(url)
+        response.raise_for_status()
+        self.current_url = response.url
+        self.soup = BeautifulSoup(response.text, 'html.parser')
+
+    def execute_script(self, script, *args):
+        if self.crashed:
+            raise WebDriverException("invalid session id")
+        return None
+
+    def execute_async_script(self, script, *args):
+        # Answers the readiness script in get_contact_details from the parsed page
+        assert script == main.READ_CONTACT_FIELDS_JS
+        fields = {}
+        for name, selector in args[0].items():
+            tag = self.soup.select_one(selector)
+            if tag is not None and tag.get_text().strip():
+                fields[name] = tag.get_text().strip()
+        view_more_ms = 0 if self.soup.select_one(args[1]) is not None else None
+        return {'fields': fields, 'timing': {'viewMoreMs': view_more_ms, 'readyMs': 1}}
+
+    def find_element(self, by, value):
+        if by == By.ID:
+            by, value = By.CSS_SELECTOR, f"#{value}"
+        if by != By.CSS_SELECTOR:
+            raise NotImplementedError(by)
+        tag = self.soup.select_one(value)
+        if tag is None:
+            raise NoSuchElementException(value)
+        return StaticElement(tag)
+
+    def find_elements(self, by, value):
+        try:
+            return [self.find_element(by, value)]
+        except NoSuchElementException:
+            return []
+
+    def get_cookies(self):
+        return [{'name': cookie.name, 'value': cookie.value, 'path': cookie.path} for cookie in self.session.cookies]
+
+    def add_cookie(self, cookie):
+        self.session.cookies.set(cookie['name'], cookie['value'], path=cookie.get('path', '/'))
+
+    def delete_all_cookies(self):
+        self.session.cookies.clear()
+
+    def quit(self):
+        self.closed = True
+        self.session.close()
+
+class FixtureSiteTest:
+    """Points the scraper at the fixture site for the duration of a test."""
+
+    def __init__(self, **site_options):
+        self.site_options = site_options
+
+    def __enter__(self):
+        self.site = FixtureSite(**self.site_options).__enter__()
+        self.base_url = main.REFERRIZER_BASE_URL
+        main.REFERRIZER_BASE_URL = self.site.url
+        # The fixture pages answer at once, so the session check needn't watch them long
+        self.session_check_seconds = main.SESSION_CHECK_SECONDS
+        main.SESSION_CHECK_SECONDS = 0.3
+        return self.site
+
+    def __exit__(self, *exc_info):
+        main.REFERRIZER_BASE_URL = self.base_url
+        main.SESSION_CHECK_SECONDS = self.session_check_seconds
+        self.site.__exit__(*exc_info)
+
+class FakeJob:
+    def result(self):
+        return []
+
+    def to_dataframe(self):
+        return pd.DataFrame({'id': [], 'lastVisitDate': []})
+
+class FakeBigQueryClient:
+    """Records load jobs and queries instead of running them."""
+
+    def __init__(self):
+        self.loads = []
+        self.json_loads = []
+        self.queries = []
+
+    def load_table_from_dataframe(self, df, table_id, job_config=None):
+        self.loads.append((df.copy(), table_id, job_config))
+        return FakeJob()
+
+    def load_table_from_json(self, rows, table_id, job_config=None):
+        self.json_loads.append((rows, table_id, job_config))
+        return FakeJob()
+
+    def query(self, sql, job_config=None):
+        self.queries.append((sql, job_config))
+        return FakeJob()
+
+def staged_rows(bq_client):
+    """Scraped rows in the staging loads, without the run columns."""
+    rows = [row for df, _, _ in bq_client.loads
+            for row in df.drop(columns=['run_id', 'scraped_at']).values.tolist()]
+    return sorted(rows)
+
+def expected_row(contact_id):
+    return [contact_id, *[value or '-' for value in CONTACTS[contact_id]]]
+
+def test_get_contact_details_static_page():
+    """A contact page is scraped into one record, including the "view more" fields."""
+    with FixtureSiteTest():
+        record = main.get_contact_details(StaticPageDriver(), '1001')
+
+    assert list(record) == expected_row('1001')
+
+def test_get_contact_details_missing_fields():
+    """Fields that are not on the page resolve to '-' without waiting them out."""
+    with FixtureSiteTest():
+        start = time.monotonic()
+        record = main.get_contact_details(StaticPageDriver(), '1019')
+
+    assert record == main.ContactRecord('1019', '-', '05/20/2025', '-')
+    assert time.monotonic() - start < 1
+
+def test_scrape_contacts_with_worker_pool():
+    """Every contact is scraped once across the workers and staged in batches."""
+    contact_ids = [str(1000 + i) for i in range(12)]
+    drivers = [StaticPageDriver() for _ in range(3)]
+    bq_client = FakeBigQueryClient()
+    uploader = main.StagingUploader('run-1', datetime.now(timezone.utc), bq_client, batch_size=5)
+
+    with FixtureSiteTest():
+        scraped, failed_contact_ids = main.scrape_contacts(drivers, contact_ids, uploader)
+    uploader.finish()
+
+    assert scraped == 12
+    assert failed_contact_ids == []
+    assert [len(df) for df, _, _ in bq_client.loads] == [5, 5, 2]
+    assert staged_rows(bq_client) == [expected_row(contact_id) for contact_id in contact_ids]
+    # The queue spreads the contacts over the workers
+    assert sum(len(driver.visited) for driver in drivers) == 12
+
+def test_scrape_contacts_skips_failed_contacts():
+    """A failing contact is reported and the rest of the batch is still uploaded."""
+    bq_client = FakeBigQueryClient()
+    uploader = main.StagingUploader('run-1', datetime.now(timezone.utc), bq_client)
+
+    with FixtureSiteTest():
+        # 9999 is not on the fixture site, so the page load fails
+        scraped, failed_contact_ids = main.scrape_contacts([StaticPageDriver(), StaticPageDriver()],
+                                                           ['1000', '9999', '1002'], uploader)
+
+    assert uploader.finish() == 2
+    assert failed_contact_ids == ['9999']
+    assert [row[0] for row in staged_rows(bq_client)] == ['1000', '1002']
+
+def test_failed_read_does_not_overwrite_pow_id():
+    """A contact whose fields could not be read is not staged, and a missing field keeps the known value."""
+    class TimingOutDriver(StaticPageDriver):
+        def execute_async_script(self, script, *args):
+            if self.current_url.endswith('/1001/details'):
+                raise TimeoutException("script timeout")
+            return super().execute_async_script(script, *args)
+
+    bq_client = FakeBigQueryClient()
+    uploader = main.StagingUploader('run-1', datetime.now(timezone.utc), bq_client)
+    with FixtureSiteTest():
+        scraped, failed_contact_ids = main.scrape_contacts([TimingOutDriver()], ['1000', '1001'], uploader)
+    uploader.finish()
+
+    # No row of '-' for 1001, so its pow_id and dates in pow_mapping stay as they are
+    assert failed_contact_ids == ['1001']
+    assert staged_rows(bq_client) == [expected_row('1000')]
+    merge_sql = next(sql for sql, _ in bq_client.queries if sql.split('`')[1:2] == [main.bq_pow_mapping_table_id])
+    assert "coalesce(cast(nullif(S.pow_id, '-') as int64), T.pow_id)" in merge_sql
+    for column in ('last_time_account_dir_comm', 'last_time_contact_dir_comm'):
+        assert f"T.{column})" in merge_sql
+
+def test_default_browser_workers_override():
+    """REFERRIZER_BROWSER_WORKERS sets the pool size."""
+    workers = main.BROWSER_WORKERS
+    try:
+        main.BROWSER_WORKERS = '3'
+        assert main.default_browser_workers() == 3
+        main.BROWSER_WORKERS = None
+        assert main.default_browser_workers() >= 1
+    finally:
+        main.BROWSER_WORKERS = workers
+
+def fake_login(driver):
+    """Stands in for login_to_referrizer by setting the fixture's session cookie."""
+    fake_login.calls += 1
+    driver.add_cookie({'name': SESSION_COOKIE[0], 'value': SESSION_COOKIE[1]})
+
+class FakeLogin:
+    """Replaces login_to_referrizer for the duration of a test."""
+
+    def __enter__(self):
+        self.login = main.login_to_referrizer
+        main.login_to_referrizer = fake_login
+        fake_login.calls = 0
+        return fake_login
+
+    def __exit__(self, *exc_info):
+        main.login_to_referrizer = self.login
+
+def test_session_store_roundtrip():
+    """The local session store saves and loads the session state."""
+    with tempfile.TemporaryDirectory() as directory:
+        store = main.LocalStateStore(directory)
+        assert store.load() is None
+
+        state = {'cookies': [{'name': 'a', 'value': 'b'}], 'local_storage': {'token': 'x'}}
+        store.save(state)
+
+        assert main.LocalStateStore(directory).load() == state
+        assert os.stat(store.path).st_mode & 0o077 == 0
+
+def test_login_saves_session_for_next_run():
+    """Without a saved session the browser logs in, and the next run reuses the session."""
+    with tempfile.TemporaryDirectory() as directory, FixtureSiteTest(), FakeLogin() as login:
+        store = main.LocalStateStore(directory)
+
+        main.ensure_logged_in(StaticPageDriver(), store)
+        assert login.calls == 1
+        assert store.load()['cookies'][0]['value'] == SESSION_COOKIE[1]
+
+        driver = StaticPageDriver()
+        main.ensure_logged_in(driver, store)
+        assert login.calls == 1
+        assert driver.current_url.endswith('/contacts') and not driver.find_elements(By.ID, 'username')
+
+def test_expired_session_logs_in_again():
+    """A saved session that no longer reaches /contacts is replaced by a new login."""
+    with tempfile.TemporaryDirectory() as directory, FixtureSiteTest(), FakeLogin() as login:
+        store = main.LocalStateStore(directory)
+        store.save({'cookies': [{'name': SESSION_COOKIE[0], 'value': 'expired'}], 'local_storage': {}})
+
+        main.ensure_logged_in(StaticPageDriver(), store)
+
+        assert login.calls == 1
+        assert store.load()['cookies'][0]['value'] == SESSION_COOKIE[1]
+
+def test_session_check_does_not_depend_on_page_markup(monkeypatch):
+    """/contacts counts as logged in unless it shows the login form or redirects away."""
+    class RedirectingDriver(StaticPageDriver):
+        """Like the app's router, moves a logged-out browser to /login before the form renders."""
+        def get(self, url):
+            super().get(url)
+            self.current_url = url.replace('/contacts', '/login')
+            self.soup = BeautifulSoup('<html><body></body></html>', 'html.parser')
+
+    # A contacts page without the fixture's data-qa attributes
+    monkeypatch.setattr(fixture_site, 'CONTACTS_PAGE', '<html><body><div id="app">Contacts</div></body></html>')
+    with FixtureSiteTest() as site:
+        driver = StaticPageDriver()
+        driver.get(site.url)
+        fake_login(driver)
+        start = time.monotonic()
+        assert main.is_session_valid(driver)
+        assert time.monotonic() - start < 2
+
+        assert not main.is_session_valid(StaticPageDriver())
+        assert not main.is_session_valid(RedirectingDriver())
+
+class FakeCodeProvider:
+    """Verification codes that arrive at given times, like rows in the verification_code table."""
+
+    def __init__(self, codes):
+        self.codes = codes
+        self.polls = []
+
+    def get_code(self, since):
+        self.polls.append(time.monotonic())
+        arrived = [(received_at, code) for received_at, code in self.codes
+                   if received_at > since and received_at <= datetime.now(timezone.utc)]
+        return max(arrived)[1] if arrived else None
+
+def test_verification_code_ignores_older_codes():
+    """A code from an earlier login is not accepted; the new one is picked up once it arrives."""
+    challenge_time = datetime.now(timezone.utc)
+    provider = FakeCodeProvider([
+        (challenge_time - timedelta(minutes=5), '111111'),
+        (challenge_time + timedelta(seconds=0.2), '222222'),
+    ])
+
+    code = main.wait_for_verification_code(provider, challenge_time, timeout=5, initial_delay=0.05, max_delay=1)
+
+    assert code == '222222'
+    assert len(provider.polls) > 1
+
+def test_verification_code_backoff_and_deadline():
+    """Polls back off exponentially and stop at the deadline."""
+    provider = FakeCodeProvider([])
+    start = time.monotonic()
+
+    code = main.wait_for_verification_code(provider, datetime.now(timezone.utc), timeout=0.5,
+                                           initial_delay=0.05, max_delay=0.2)
+
+    assert code is None
+    assert time.monotonic() - start < 1
+    gaps = [later - earlier for earlier, later in zip(provider.polls, provider.polls[1:])]
+    assert gaps[1] > gaps[0] * 1.5
+    assert max(gaps) < 0.3
+
+class FakeBrowsers:
+    """Replaces create_chrome_driver with StaticPageDriver and counts the launches."""
+
+    def __enter__(self):
+        self.create_chrome_driver = main.create_chrome_driver
+        self.launched = []
+
+        def create_chrome_driver(remote_debugging=True, scrape_profile=None):
+            self.launched.append(StaticPageDriver())
+            return self.launched[-1]
+
+        main.create_chrome_driver = create_chrome_driver
+        return self
+
+    def __exit__(self, *exc_info):
+        main.create_chrome_driver = self.create_chrome_driver
+
+def test_browser_manager_reuses_warm_browsers():
+    """A second run reuses the running browsers without launching Chrome or logging in."""
+    with tempfile.TemporaryDirectory() as directory, FixtureSiteTest(), FakeLogin() as login, \
+            FakeBrowsers() as browsers:
+        manager = main.BrowserManager()
+        store = main.LocalStateStore(directory)
+
+        first = manager.acquire(2, store)
+        manager.release(first, 10)
+        second = manager.acquire(2, store)
+
+    assert second == first
+    assert len(browsers.launched) == 2
+    assert login.calls == 1
+
+def test_browser_manager_restarts_crashed_and_worn_browsers():
+    """Browsers that stopped responding or passed the page limit are replaced."""
+    with tempfile.TemporaryDirectory() as directory, FixtureSiteTest(), FakeLogin() as login, \
+            FakeBrowsers() as browsers:
+        manager = main.BrowserManager(max_pages=100)
+        store = main.LocalStateStore(directory)
+
+        first = manager.acquire(2, store)
+        first[1].crashed = True
+        second = manager.acquire(2, store)
+        assert second[0] is first[0] and second[1] is not first[1]
+        assert first[1].closed
+
+        manager.release(second, 200)
+        third = manager.acquire(2, store)
+        assert not set(map(id, third)) & set(map(id, second))
+
+    assert len(browsers.launched) == 5
+    # The replacements restored the saved session instead of logging in
+    assert login.calls == 1
+
+def test_staging_uploader_merges_once_per_run():
+    """Batches are appended with the run ID and the run ends with a single MERGE filtered by it."""
+    bq_client = FakeBigQueryClient()
+    run_started = datetime.now(timezone.utc)
+    uploader = main.StagingUploader('run-1', run_started, bq_client, batch_size=2)
+
+    with FixtureSiteTest():
+        driver = StaticPageDriver()
+        for contact_id in ['1000', '1001', '1002', '1003', '1004']:
+            uploader.add(main.get_contact_details(driver, contact_id))
+    total_records = uploader.finish()
+
+    assert total_records == 5
+    assert [len(df) for df, _, _ in bq_client.loads] == [2, 2, 1]
+    for df, table_id, job_config in bq_client.loads:
+        assert table_id == main.bq_pow_mapping_staging_table_id
+        assert set(df['run_id']) == {'run-1'}
+        assert job_config.write_disposition == 'WRITE_APPEND'
+
+    merges = [(sql, job_config) for sql, job_config in bq_client.queries if sql.strip().startswith('MERGE')]
+    assert [sql.split('`')[1] for sql, _ in merges] == [main.bq_pow_mapping_table_id,
+                                                        main.bq_scrape_schedule_table_id]
+    for sql, job_config in merges:
+        assert 'run_id = @run_id' in sql
+        assert {param.name: param.value for param in job_config.query_parameters} == \
+            {'run_id': 'run-1', 'run_started': run_started}
+
+def test_get_contact_ids_uses_schedule():
+    """Contacts are picked from the schedule with the TTL and backoff as parameters."""
+    bq_client = FakeBigQueryClient()
+    main._schedule_table_ready = False
+
+    main.get_contact_ids(limit=50, ttl_hours=24, max_backoff=3, bq_client=bq_client)
+    main.get_contact_ids(bq_client=bq_client)
+
+    creates = [sql for sql, _ in bq_client.queries if 'CREATE TABLE IF NOT EXISTS' in sql]
+    assert len(creates) == 1 and main.bq_scrape_schedule_table_id in creates[0]
+
+    sql, job_config = bq_client.queries[1]
+    assert main.bq_scrape_schedule_table_id in sql
+    assert "if(s.last_result = 'empty', s.attempts, 0)" in sql
+    assert {param.name: param.value for param in job_config.query_parameters} == \
+        {'ttl_hours': 24, 'max_backoff': 3, 'limit': 50}
+    # Never-scraped contacts sort before stale ones
+    assert sql.index('then 0') < sql.index('then 1') < sql.index('else 2')
+
+def test_bigquery_client_is_shared_and_injectable():
+    """The client is built once for all threads, and tests can swap in a fake."""
+    create_bigquery_client = main.create_bigquery_client
+    built = []
+
+    def build():
+        time.sleep(0.05)
+        built.append(FakeBigQueryClient())
+        return built[-1]
+
+    try:
+        main.set_bigquery_client(None)
+        main.create_bigquery_client = build
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(main.get_bigquery_client())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(built) == 1
+        assert all(client is built[0] for client in clients)
+
+        fake = FakeBigQueryClient()
+        main.set_bigquery_client(fake)
+        uploader = main.StagingUploader('run-1', datetime.now(timezone.utc))
+        uploader.add(main.ContactRecord('1000', '50000', '05/01/2025', '-'))
+        uploader.finish()
+        assert len(fake.loads) == 1 and fake.queries
+    finally:
+        main.create_bigquery_client = create_bigquery_client
+        main.set_bigquery_client(None)
+
+def test_contact_buffer_builds_one_dataframe():
+    """Records are kept as column lists and become a DataFrame only when asked."""
+    buffer = main.ContactBuffer()
+    buffer.append(main.ContactRecord('1000', '50000', '05/01/2025', '04/01/2025'))
+    buffer.append(main.ContactRecord('1001', '-', '05/02/2025', '-'))
+
+    df = buffer.to_dataframe()
+    buffer.clear()
+
+    assert list(df.columns) == list(main.ContactRecord._fields)
+    assert df.values.tolist() == [['1000', '50000', '05/01/2025', '04/01/2025'], ['1001', '-', '05/02/2025', '-']]
+    assert len(buffer) == 0 and len(df) == 2
+
+def test_staging_uploader_flushes_on_interval():
+    """A slow run still stages rows once the flush interval has passed."""
+    bq_client = FakeBigQueryClient()
+    uploader = main.StagingUploader('run-1', datetime.now(timezone.utc), bq_client, batch_size=100,
+                                    flush_interval=0.05)
+
+    with FixtureSiteTest():
+        driver = StaticPageDriver()
+        uploader.add(main.get_contact_details(driver, '1000'))
+        time.sleep(0.1)
+        uploader.add(main.get_contact_details(driver, '1001'))
+
+    assert [len(df) for df, _, _ in bq_client.loads] == [2]
+    assert uploader.finish() == 2
+    # Nothing is left to load, so finish only merges
+    assert len(bq_client.loads) == 1
+
+def test_checkpoint_resumes_remaining_contacts():
+    """A run cut short resumes with its run ID, its unstaged rows and only the contacts it had not scraped."""
+    with tempfile.TemporaryDirectory() as directory:
+        store = main.LocalStateStore(directory, main.CHECKPOINT_FILE_NAME)
+        selected = pd.DataFrame({'id': ['1000', '1001', '1002', '1003', '1004']})
+        checkpoint = main.start_or_resume_run(store, select_contacts=lambda: selected)
+        checkpoint.save_interval = 0
+
+        bq_client = FakeBigQueryClient()
+        uploader = main.StagingUploader(checkpoint.run_id, checkpoint.run_started, bq_client, batch_size=2,
+                                        checkpoint=checkpoint)
+        with FixtureSiteTest():
+            driver = StaticPageDriver()
+            for contact_id in ['1000', '1001', '1002']:
+                uploader.add(main.get_contact_details(driver, contact_id))
+
+        def select_again():
+            raise AssertionError("a resumed run must not select contacts again")
+
+        # The crash loses the uploader, but 1002's row was saved with the checkpoint
+        resumed = main.start_or_resume_run(store, select_contacts=select_again)
+        assert resumed.run_id == checkpoint.run_id
+        assert resumed.run_started == checkpoint.run_started
+        assert resumed.pending == [main.ContactRecord(*expected_row('1002'))]
+        assert resumed.remaining() == ['1003', '1004']
+
+        uploader = main.StagingUploader(resumed.run_id, resumed.run_started, bq_client, checkpoint=resumed)
+        with FixtureSiteTest():
+            main.scrape_contacts([StaticPageDriver()], resumed.remaining(), uploader)
+        # The MERGE covers the rows staged before and after the restart
+        assert uploader.finish() == 5
+        assert store.load() is None
+        assert staged_rows(bq_client) == [expected_row(contact_id) for contact_id in selected['id']]
+
+def test_checkpoint_saves_unstaged_rows_at_most_every_interval():
+    """Rows between staging loads are saved with the checkpoint, without a store write per contact."""
+    with tempfile.TemporaryDirectory() as directory:
+        store = main.LocalStateStore(directory, main.CHECKPOINT_FILE_NAME)
+        checkpoint = main.RunCheckpoint(store, 'run-1', datetime.now(timezone.utc), ['1000', '1001'],
+                                        save_interval=3600)
+        checkpoint.save()
+        checkpoint.add_pending(main.ContactRecord('1000', '50000', '05/01/2025', '04/01/2025'))
+        assert store.load()['pending'] == []
+
+        checkpoint.save_interval = 0
+        checkpoint.add_pending(main.ContactRecord('1001', '-', '05/02/2025', '-'))
+        assert store.load()['pending'] == [['1000', '50000', '05/01/2025', '04/01/2025'],
+                                           ['1001', '-', '05/02/2025', '-']]
+        checkpoint.mark_staged(['1000'])
+        assert store.load()['pending'] == [['1001', '-', '05/02/2025', '-']]
+        assert store.load()['completed'] == ['1000']
+
+def test_old_or_unreadable_checkpoint_is_ignored():
+    """A stale or corrupt checkpoint starts a new run instead of resuming."""
+    with tempfile.TemporaryDirectory() as directory:
+        store = main.LocalStateStore(directory, main.CHECKPOINT_FILE_NAME)
+        old = main.RunCheckpoint(store, 'run-old', datetime.now(timezone.utc) - timedelta(days=2), ['1000'])
+        old.save()
+        assert main.RunCheckpoint.load(store) is None
+        assert store.load() is None
+
+        store.save({'run_id': 'run-bad'})
+        checkpoint = main.start_or_resume_run(store, select_contacts=lambda: pd.DataFrame({'id': ['1001']}))
+        assert checkpoint.run_id != 'run-bad'
+        assert checkpoint.remaining() == ['1001']
+
+def test_stale_checkpoint_merges_its_staged_rows():
+    """Rows scraped by a run too old to resume are staged and merged before a new run starts."""
+    with tempfile.TemporaryDirectory() as directory:
+        store = main.LocalStateStore(directory, main.CHECKPOINT_FILE_NAME)
+        run_started = datetime.now(timezone.utc) - timedelta(days=2)
+        old = main.RunCheckpoint(store, 'run-old', run_started, ['1000', '1001', '1002'], completed=['1000'],
+                                 pending=[expected_row('1001')])
+        old.save()
+
+        class FailingBigQueryClient(FakeBigQueryClient):
+            def query(self, sql, job_config=None):
+                raise RuntimeError("BigQuery unavailable")
+
+        # The row that never reached staging is staged before the MERGE, and
+        # without the MERGE the checkpoint stays for the next attempt
+        failing_client = FailingBigQueryClient()
+        with pytest.raises(RuntimeError):
+            main.start_or_resume_run(store, select_contacts=lambda: pd.DataFrame({'id': ['1002']}),
+                                     bq_client=failing_client)
+        assert staged_rows(failing_client) == [expected_row('1001')]
+        assert store.load()['run_id'] == 'run-old'
+        assert store.load()['completed'] == ['1000', '1001']
+
+        bq_client = FakeBigQueryClient()
+        checkpoint = main.start_or_resume_run(store, select_contacts=lambda: pd.DataFrame({'id': ['1002']}),
+                                              bq_client=bq_client)
+        assert checkpoint.run_id != 'run-old'
+        assert checkpoint.remaining() == ['1002']
+        assert bq_client.loads == []
+        merges = [job_config for sql, job_config in bq_client.queries if 'MERGE' in sql]
+        assert len(merges) == 2
+        for job_config in merges:
+            params = {param.name: param.value for param in job_config.query_parameters}
+            assert params == {'run_id': 'run-old', 'run_started': run_started}
+
+def test_stop_event_stops_workers_and_keeps_results():
+    """After a stop the workers finish the contact they are on and take no new ones."""
+    stop_event = threading.Event()
+    bq_client = FakeBigQueryClient()
+    uploader = main.StagingUploader('run-1', datetime.now(timezone.utc), bq_client)
+    contact_ids = [str(1000 + i) for i in range(20)]
+
+    def scrape(driver, contact_id):
+        if contact_id == '1002':
+            stop_event.set()
+        return main.get_contact_details(driver, contact_id)
+
+    with FixtureSiteTest():
+        scraped, failed_contact_ids = main.scrape_contacts([StaticPageDriver()], contact_ids, uploader,
+                                                           scrape=scrape, stop_event=stop_event)
+    uploader.flush()
+
+    assert scraped == 3 and failed_contact_ids == []
+    assert [row[0] for row in staged_rows(bq_client)] == ['1000', '1001', '1002']
+
+def test_supervisor_replaces_dead_browser_and_requeues():
+    """A contact lost to a dead browser is retried on a restarted one with the same session."""
+    with tempfile.TemporaryDirectory() as directory, FixtureSiteTest(), FakeLogin() as login, \
+            FakeBrowsers() as browsers:
+        manager = main.BrowserManager()
+        drivers = manager.acquire(2, main.LocalStateStore(directory))
+        session_state = main.get_session_state(drivers[0])
+        dead = drivers[1]
+        dead.crashed = True
+
+        bq_client = FakeBigQueryClient()
+        uploader = main.StagingUploader('run-1', datetime.now(timezone.utc), bq_client)
+        supervisor = main.ScrapeSupervisor(lambda driver: manager.replace(driver, session_state))
+        contact_ids = [str(1000 + i) for i in range(6)]
+        scraped, failed_contact_ids = main.scrape_contacts(drivers, contact_ids, uploader, supervisor=supervisor)
+        uploader.flush()
+
+    assert scraped == 6 and failed_contact_ids == []
+    assert sorted(row[0] for row in staged_rows(bq_client)) == contact_ids
+    assert dead.closed and dead not in manager.drivers and dead not in drivers
+    assert len(browsers.launched) == 3 and login.calls == 1
+    summary = supervisor.metrics.summary()
+    assert summary['browser_restarts'] == 1 and summary['restart_reasons'] == {'InvalidSessionIdException': 1}
+    assert summary['requeued_contacts'] == 1 and summary['contacts'] == 6
+
+class HangingDriver(StaticPageDriver):
+    """Driver whose page loads hang until the browser is killed."""
+
+    def __init__(self):
+        super().__init__()
+        self.killed = threading.Event()
+
+    def get(self, url):
+        self.killed.wait()
+        raise WebDriverException("chrome not reachable")
+
+    def quit(self):
+        self.killed.set()
+        super().quit()
+
+def test_supervisor_kills_browser_over_budget():
+    """A hung scrape is cut off at the budget and the contact is retried on a new browser."""
+    hung = HangingDriver()
+    bq_client = FakeBigQueryClient()
+    uploader = main.StagingUploader('run-1', datetime.now(timezone.utc), bq_client)
+    supervisor = main.ScrapeSupervisor(lambda driver: StaticPageDriver(), budget=0.3)
+    start = time.monotonic()
+    with FixtureSiteTest():
+        scraped, failed_contact_ids = main.scrape_contacts([hung], ['1000', '1001', '1002'],
+                                                           uploader, supervisor=supervisor)
+    uploader.flush()
+
+    assert time.monotonic() - start < 1.5
+    assert scraped == 3 and failed_contact_ids == []
+    assert hung.closed
+    assert supervisor.metrics.summary()['restart_reasons'] == {'timeout': 1}
+
+def test_supervisor_runs_scrapes_on_the_worker_threads():
+    """No thread is started per contact, and the watchdog exits once the scrapes are done."""
+    threads = set()
+    threads_before = threading.active_count()
+
+    def scrape(driver, contact_id):
+        threads.add(threading.get_ident())
+        return main.ContactRecord(contact_id, '-', '-', '-')
+
+    uploader = main.StagingUploader('run-1', datetime.now(timezone.utc), FakeBigQueryClient())
+    supervisor = main.ScrapeSupervisor(budget=0.2)
+    contact_ids = [str(1000 + i) for i in range(50)]
+    scraped, _ = main.scrape_contacts([object(), object()], contact_ids, uploader,
+                                      scrape=scrape, supervisor=supervisor)
+
+    assert scraped == 50 and len(threads) <= 2
+    deadline = time.monotonic() + 2
+    while supervisor.watchdog is not None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert supervisor.watchdog is None and threading.active_count() == threads_before
+
+def test_supervisor_gives_up_after_max_attempts():
+    """A contact that keeps killing the browser fails after max_attempts instead of looping."""
+    def scrape(driver, contact_id):
+        if contact_id == '1001':
+            raise WebDriverException("timeout: Timed out receiving message from renderer: 10.000")
+        return main.ContactRecord(contact_id, '-', '-', '-')
+
+    uploader = main.StagingUploader('run-1', datetime.now(timezone.utc), FakeBigQueryClient())
+    supervisor = main.ScrapeSupervisor(lambda driver: object(), max_attempts=2)
+    scraped, failed_contact_ids = main.scrape_contacts([object()], ['1000', '1001', '1002'], uploader,
+                                                       scrape=scrape, supervisor=supervisor)
+
+    assert scraped == 2 and failed_contact_ids == ['1001']
+    summary = supervisor.metrics.summary()
+    assert summary['browser_restarts'] == 2 and summary['requeued_contacts'] == 1
+
+def test_run_timer_summarises_phases_from_all_threads():
+    """Spans from every thread add up, with percentiles per phase."""
+    timer = main.RunTimer()
+
+    def work():
+        for _ in range(50):
+            with timer.span('page_load'):
+                pass
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for seconds in range(1, 101):
+        timer.record('upload', seconds)
+
+    summary = timer.summary()
+    assert summary['page_load']['count'] == 200
+    assert summary['upload']['p50_seconds'] == 50 and summary['upload']['p99_seconds'] == 99
+    assert summary['upload']['total_seconds'] == 5050
+    timer.reset()
+    assert timer.summary() == {}
+
+def test_percentile_uses_nearest_rank():
+    """Known nearest-rank answers, including lists too short for the high percentiles."""
+    assert main._percentile([], 50) is None
+    assert main._percentile([7], 50) == 7 and main._percentile([7], 99) == 7
+    assert main._percentile([1, 2, 3, 4], 50) == 2
+    assert main._percentile([1, 2, 3, 4], 75) == 3
+    assert main._percentile([1, 2, 3, 4], 95) == 4
+    one_to_hundred = list(range(1, 101))
+    assert [main._percentile(one_to_hundred, p) for p in (7, 50, 95, 99, 100)] == [7, 50, 95, 99, 100]
+    assert main._percentile(one_to_hundred, 0) == 1
+
+def test_run_report_is_logged_and_stored():
+    """The run report covers the scrape and upload phases and goes to the run stats table."""
+    main.run_timer.reset()
+    bq_client = FakeBigQueryClient()
+    started = datetime.now(timezone.utc)
+    uploader = main.StagingUploader('run-1', started, bq_client)
+    metrics = main.ScrapeMetrics()
+    with FixtureSiteTest():
+        main.scrape_contacts([StaticPageDriver()], ['1000', '1001'], uploader,
+                             supervisor=main.ScrapeSupervisor(metrics=metrics))
+    uploader.finish()
+
+    report = main.build_run_report('run-1', 'success', started, uploader.total_records, metrics, 1)
+    main.write_run_report(report, table_id='tys-bi.referrizer.run_stats', bq_client=bq_client)
+
+    assert report['severity'] == 'INFO' and report['records'] == 2
+    assert {'page_load', 'field_read', 'view_more_click', 'field_wait', 'dataframe', 'upload', 'merge',
+            'schedule_update'} <= set(report['phases'])
+    assert report['phases']['page_load']['count'] == 2
+    assert report['contacts']['contacts'] == 2 and report['contacts']['latency_p99_seconds'] is not None
+    [(rows, table_id, job_config)] = bq_client.json_loads
+    assert table_id == 'tys-bi.referrizer.run_stats' and job_config.write_disposition == 'WRITE_APPEND'
+    assert rows[0]['run_id'] == 'run-1' and json.loads(rows[0]['report'])['status'] == 'success'
+
+def test_fixture_site_replays_recorded_pages_with_latency():
+    """The replay site serves recorded pages, adds latency and can defer the view more fields."""
+    with tempfile.TemporaryDirectory() as pages_dir:
+        with open(os.path.join(pages_dir, '1005.html'), 'w') as f:
+            f.write('<div data-qa="contact-basic-info-integration-pow-id">77777</div>'
+                    '<div data-qa="contact-basic-info-customer-fields-contact-last-contacted-date">01/02/2025</div>')
+
+        with FixtureSiteTest(page_latency=0.1, jitter=0.05, view_more_delay_ms=300, pages_dir=pages_dir) as site:
+            start = time.monotonic()
+            page = requests.get(f"{site.url}/contacts/1001/details").text
+            assert 0.1 <= time.monotonic() - start < 1
+            record = main.get_contact_details(StaticPageDriver(), '1005')
+
+    assert record == main.ContactRecord('1005', '77777', '01/02/2025', '-')
+    # The deferred fields only reach the page from the template, after the click
+    soup = BeautifulSoup(page, 'html.parser')
+    assert soup.select_one('#customer-fields').get_text().strip() == ''
+    assert "setTimeout" in soup.select_one('button')['onclick'] and '300)' in soup.select_one('button')['onclick']
+
+def test_first_party_urls_are_the_apps_site(monkeypatch):
+    """Scripts from the app's host, its domain and the configured hosts pass; other sites don't."""
+    monkeypatch.setattr(main, 'REFERRIZER_BASE_URL', 'https://app.referrizer.com')
+    monkeypatch.setattr(main, 'FIRST_PARTY_SCRIPT_HOSTS', ['d1234.cloudfront.net'])
+    assert main.is_first_party_url('https://app.referrizer.com/static/app.js')
+    assert main.is_first_party_url('https://cdn.referrizer.com/bundle.js')
+    assert main.is_first_party_url('https://d1234.cloudfront.net/bundle.js')
+    assert main.is_first_party_url('data:text/javascript,1')
+    assert not main.is_first_party_url('https://widget.intercom.io/widget.js')
+    assert not main.is_first_party_url('https://referrizer.com.evil.example/app.js')
+
+    # An IP address has no domain to share
+    monkeypatch.setattr(main, 'REFERRIZER_BASE_URL', 'http://127.0.0.1:8000')
+    assert main.is_first_party_url('http://127.0.0.1:8000/assets/analytics.js')
+    assert not main.is_first_party_url('http://localhost:8000/assets/widget.js')
+
+# Tests that drive a real headless Chrome, set CHROMEDRIVER_PATH (and CHROME_BINARY) to run them
+HAVE_CHROMEDRIVER = os.path.exists(os.environ.get('CHROMEDRIVER_PATH', ''))
+requires_chrome = pytest.mark.skipif(not HAVE_CHROMEDRIVER, reason="set CHROMEDRIVER_PATH to run Chrome tests")
+
+@requires_chrome
+def test_chrome_worker_pool(monkeypatch):
+    """Two headless Chrome workers scrape the fixture pages."""
+    monkeypatch.setenv('USE_HEADLESS', 'true')
+    drivers = [main.create_chrome_driver(remote_debugging=False) for _ in range(2)]
+    bq_client = FakeBigQueryClient()
+    uploader = main.StagingUploader('run-1', datetime.now(timezone.utc), bq_client)
+
+    try:
+        with FixtureSiteTest():
+            contact_ids = ['1000', '1001', '1002', '1003']
+            main.scrape_contacts(drivers, contact_ids, uploader)
+    finally:
+        for driver in drivers:
+            driver.quit()
+    uploader.finish()
+
+    assert staged_rows(bq_client) == [expected_row(contact_id) for contact_id in contact_ids]
+
+# A recorded page whose "view more" never loads and whose panel never settles,
+# like a contact stuck on a spinner: only the timeout ends the wait
+NEVER_SETTLING_PAGE = """<!DOCTYPE html>
+<html>
+<body>
+<div data-qa="contact-basic-info">
+  <span data-qa="contact-basic-info-integration-pow-id">50000</span>
+  <span data-qa="contact-basic-info-loading">Loading</span>
+  <button data-qa="contact-basic-info-customer-fields-view-more-button">View more</button>
+</div>
+<script>
+setInterval(function () {
+    document.querySelector('[data-qa="contact-basic-info-loading"]').textContent = 'Loading ' + Date.now();
+}, 100);
+</script>
+</body>
+</html>
+"""
+
+@requires_chrome
+def test_chrome_reads_fields_with_page_script(monkeypatch):
+    """READ_CONTACT_FIELDS_JS in headless Chrome: fields that arrive late, missing fields and the timeout."""
+    monkeypatch.setenv('USE_HEADLESS', 'true')
+    driver = main.create_chrome_driver(remote_debugging=False)
+    try:
+        # The fields come 300ms after the click; a missing one ends the wait once the panel settles
+        with FixtureSiteTest(view_more_delay_ms=300):
+            assert list(main.get_contact_details(driver, '1000')) == expected_row('1000')
+            start = time.monotonic()
+            record = main.get_contact_details(driver, '1019')
+            elapsed = time.monotonic() - start
+        assert record == main.ContactRecord('1019', '-', '05/20/2025', '-')
+        assert elapsed < main.CONTACT_READY_TIMEOUT_SECONDS / 2
+
+        # A panel that never settles is read when the timeout runs out, with the fields found so far
+        monkeypatch.setattr(main, 'CONTACT_READY_TIMEOUT_SECONDS', 1)
+        with tempfile.TemporaryDirectory() as pages_dir:
+            with open(os.path.join(pages_dir, '1000.html'), 'w') as f:
+                f.write(NEVER_SETTLING_PAGE)
+            with FixtureSiteTest(pages_dir=pages_dir):
+                start = time.monotonic()
+                record = main.get_contact_details(driver, '1000')
+                elapsed = time.monotonic() - start
+        assert record == main.ContactRecord('1000', '50000', '-', '-')
+        assert 1 <= elapsed < 3
+    finally:
+        driver.quit()
+
+@requires_chrome
+def test_scrape_profile_blocks_third_party_scripts(monkeypatch):
+    """The scrape profile reads the fields without running the analytics or the other origin's widget."""
+    monkeypatch.setenv('USE_HEADLESS', 'true')
+    driver = main.create_chrome_driver(remote_debugging=False, scrape_profile=True)
+    try:
+        with FixtureSiteTest():
+            assert list(main.get_contact_details(driver, '1000')) == expected_row('1000')
+            # Async scripts get a moment to run if they were let through
+            time.sleep(1)
+            assert driver.execute_script("return [window.__analytics, window.__widget]") == [None, None]
+    finally:
+        driver.quit()
+
+if __name__ == "__main__":
+    test_get_contact_details_static_page()
+    test_get_contact_details_missing_fields()
+    test_scrape_contacts_with_worker_pool()
+    test_scrape_contacts_skips_failed_contacts()
+    test_failed_read_does_not_overwrite_pow_id()
+    test_default_browser_workers_override()
+    test_session_store_roundtrip()
+    test_login_saves_session_for_next_run()
+    test_expired_session_logs_in_again()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_session_check_does_not_depend_on_page_markup(monkeypatch)
+    test_verification_code_ignores_older_codes()
+    test_verification_code_backoff_and_deadline()
+    test_browser_manager_reuses_warm_browsers()
+    test_browser_manager_restarts_crashed_and_worn_browsers()
+    test_staging_uploader_merges_once_per_run()
+    test_get_contact_ids_uses_schedule()
+    test_bigquery_client_is_shared_and_injectable()
+    test_contact_buffer_builds_one_dataframe()
+    test_staging_uploader_flushes_on_interval()
+    test_checkpoint_resumes_remaining_contacts()
+    test_checkpoint_saves_unstaged_rows_at_most_every_interval()
+    test_old_or_unreadable_checkpoint_is_ignored()
+    test_stale_checkpoint_merges_its_staged_rows()
+    test_stop_event_stops_workers_and_keeps_results()
+    test_supervisor_replaces_dead_browser_and_requeues()
+    test_supervisor_kills_browser_over_budget()
+    test_supervisor_runs_scrapes_on_the_worker_threads()
+    test_supervisor_gives_up_after_max_attempts()
+    test_run_timer_summarises_phases_from_all_threads()
+    test_percentile_uses_nearest_rank()
+    test_run_report_is_logged_and_stored()
+    test_fixture_site_replays_recorded_pages_with_latency()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_first_party_urls_are_the_apps_site(monkeypatch)
+    if HAVE_CHROMEDRIVER:
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            test_chrome_worker_pool(monkeypatch)
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            test_chrome_reads_fields_with_page_script(monkeypatch)
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            test_scrape_profile_blocks_third_party_scripts(monkeypatch)
+    else:
+        print("Skipping Chrome tests: set CHROMEDRIVER_PATH to run them")
+    print("All tests passed")